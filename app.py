@@ -2,61 +2,265 @@ import os
 import json
 import uuid
 import asyncio
+import contextvars
+import copy
+import importlib.util
+import itertools
+import logging
 import random
+import re
+import threading
+import time
+import weakref
 from datetime import datetime
-from flask import Flask, request, render_template, jsonify
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    render_template,
+    request,
+    stream_with_context,
+)
 from dotenv import load_dotenv
 
+from commentary_cache import CommentaryCache
+from engine import Engine, rank_moves
+from fastboard import Position
+from game_hub import GameHub
+from game_jobs import AsyncGameJobQueue, EventLoopThread, GameJobQueue, QueueFullError
+from game_store import create_game_store
+from http_cache import (
+    IMMUTABLE,
+    REVALIDATE,
+    compress_response,
+    not_modified,
+    set_cache_headers,
+    strong_etag,
+)
+from kifu_export import FORMATS, export_game, stream_zip
+from kifu_import import new_game_id, read_kifu
+from llm_health import LLMHealth
+from logging_config import setup_logging
+from metrics import Registry
+from opening_book import OpeningBook, load_opening_book
+from position_cache import PositionCache
+from rate_limiter import (
+    COMMENTARY_PRIORITY,
+    MOVE_PRIORITY,
+    RateLimiter,
+    estimate_tokens,
+)
+
 # 環境変数を読み込み
 load_dotenv()
 
-# OpenAI API設定
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
+# ログの設定（LOG_LEVEL・LOG_FORMAT環境変数で変更可能）
+setup_logging()
+logger = logging.getLogger(__name__)
 
 try:
-    from openai import OpenAI
     import shogi
     import shogi.CSA
 except ImportError:
     raise SystemExit(
         "必要なライブラリをインストールしてください: pip install openai python-shogi"
     )
+# openaiの読み込みには時間がかかるので、ここでは存在の確認だけを行い最初に使うときに読み込む
+if importlib.util.find_spec("openai") is None:
+    raise SystemExit(
+        "必要なライブラリをインストールしてください: pip install openai python-shogi"
+    )
 
-# OpenAIクライアントの初期化
-try:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or api_key == "your_openai_api_key_here":
-        print(
-            "警告: OpenAI APIキーが設定されていません。.envファイルにAPIキーを設定してください。"
-        )
-        print("サンプルデータモードで動作します。")
-        client = None
-    else:
-        client = OpenAI(api_key=api_key)
-        print("OpenAI クライアントが正常に初期化されました")
-        # 簡単な接続テスト
-        try:
-            # モデル一覧を取得してAPIキーの有効性を確認
-            models = client.models.list()
-            print("OpenAI API接続確認: 成功")
-        except Exception as test_error:
-            print(f"OpenAI API接続テスト失敗: {test_error}")
-            print("APIキーが無効か、ネットワークエラーの可能性があります。")
-            client = None
-except Exception as e:
-    print(f"OpenAI client initialization failed: {e}")
-    print("AIコメント機能は無効になりますが、基本機能は動作します")
-    client = None
+# OpenAI互換APIの接続先（負荷試験ではfake_openai.pyの偽サーバーを指定する）
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# OpenAI APIキー（クライアントは最初に使うときに作成する）
+api_key = os.getenv("OPENAI_API_KEY")
+LLM_CONFIGURED = bool(api_key) and api_key != "your_openai_api_key_here"
+if not LLM_CONFIGURED:
+    logger.warning(
+        "OpenAI APIキーが設定されていません。.envファイルにAPIキーを設定してください。"
+        "サンプルデータモードで動作します。"
+    )
 
 app = Flask(__name__)
 
-# グローバル変数でゲームデータを保存
-generated_games = {}
+# Prometheus形式で公開するメトリクス（/metrics）
+metrics_registry = Registry()
+HTTP_REQUEST_DURATION = metrics_registry.histogram(
+    "http_request_duration_seconds",
+    "HTTPリクエストの処理時間（ルートごと）",
+    ("route", "method", "status"),
+)
+LLM_REQUEST_DURATION = metrics_registry.histogram(
+    "llm_request_duration_seconds",
+    "LLM呼び出しの所要時間（move: 指し手、commentary: 解説、commentary_batch: 一括解説）",
+    ("kind",),
+)
+LLM_REQUESTS = metrics_registry.counter(
+    "llm_requests_total", "LLM呼び出しの回数（結果ごと）", ("kind", "status")
+)
+LLM_TOKENS = metrics_registry.counter(
+    "llm_tokens_total", "LLM呼び出しで使ったトークン数", ("kind", "type")
+)
+LLM_MOVE_ANSWERS = metrics_registry.counter(
+    "llm_move_answers_total",
+    "LLMの指し手の回答数（legal: 合法手、illegal: 不正な手、error: 呼び出しの失敗）",
+    ("result",),
+)
+LLM_HEDGED_REQUESTS = metrics_registry.counter(
+    "llm_hedged_requests_total",
+    "応答が遅いため同じ要求をもう1つ送った回数（winner: 先に返った方、none: 両方失敗）",
+    ("kind", "winner"),
+)
+LLM_DEADLINE_MISSES = metrics_registry.counter(
+    "llm_deadline_misses_total",
+    "持ち時間内にLLMの応答が返らなかった回数（move: 指し手、commentary: 解説）",
+    ("kind",),
+)
+PLY_DURATION = metrics_registry.histogram(
+    "ply_duration_seconds",
+    "定跡以外の1手の選択にかかった時間（対局者の種類ごと）",
+    ("player",),
+)
+MOVE_FALLBACKS = metrics_registry.counter(
+    "move_fallbacks_total",
+    "LLMの手の代わりに内蔵エンジンの手を使った回数（理由ごと）",
+    ("reason",),
+)
+SAMPLE_FALLBACKS = metrics_registry.counter(
+    "sample_data_fallbacks_total",
+    "対局の代わりにサンプルデータを返した回数",
+    ("route",),
+)
+
+# 盤面の実装（fast: 配列ベースのfastboard、python-shogi: shogi.Board）
+BOARD_BACKEND = os.getenv("BOARD_BACKEND", "fast")
+
+
+def new_board(sfen=None):
+    """設定された実装で盤面を作成（sfen省略時は初期局面）"""
+    if BOARD_BACKEND == "python-shogi":
+        return shogi.Board(sfen) if sfen else shogi.Board()
+    return Position(sfen)
+
+
+# 局面キャッシュ（k手ごとのSFENチェックポイント + 直近の局面）
+POSITION_CACHE_INTERVAL = int(os.getenv("POSITION_CACHE_INTERVAL", "8"))
+POSITION_CACHE_MAX_GAMES = int(os.getenv("POSITION_CACHE_MAX_GAMES", "256"))
+position_cache = PositionCache(
+    POSITION_CACHE_INTERVAL, POSITION_CACHE_MAX_GAMES, board_factory=new_board
+)
+
+# 解説生成の同時実行数（解説は次の手の選択と並行して生成する）
+COMMENTARY_CONCURRENCY = int(os.getenv("COMMENTARY_CONCURRENCY", "4"))
+# 1回のLLM呼び出しでまとめて解説する手数（1で1手ずつ解説）
+COMMENTARY_BATCH_SIZE = int(os.getenv("COMMENTARY_BATCH_SIZE", "1"))
+# start_gameで指定できる解説のまとめ数の上限
+MAX_COMMENTARY_BATCH_SIZE = 20
+
+# OpenAI APIのレート制限（全対局で共有。1分あたりのリクエスト数・トークン数、0で制限なし）
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+# 429が返った場合の再送回数
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+llm_rate_limiter = RateLimiter(OPENAI_RPM, OPENAI_TPM, max_retries=OPENAI_MAX_RETRIES)
+
+# 対局者の種類（llm: OpenAI、engine: 内蔵エンジン、random: ランダム）
+PLAYER_TYPES = ("llm", "engine", "random")
+# 内蔵エンジンの1手あたりの持ち時間（秒）
+ENGINE_MOVE_TIME = float(os.getenv("ENGINE_MOVE_TIME", "1.0"))
+# LLMが使えない・不正な手を返した場合のエンジンの持ち時間（秒）
+ENGINE_FALLBACK_TIME = float(os.getenv("ENGINE_FALLBACK_TIME", "0.3"))
+# LLMの指し手の応答を待つ時間（秒、0で無制限）。過ぎたら候補手の順位付けの最上位の手を指す
+MOVE_DEADLINE = float(os.getenv("MOVE_DEADLINE", "5.0"))
+# 指し手の応答がこの秒数で返らなければ同じ要求をもう1つ送り、先に返った方を使う（0で送らない）
+MOVE_HEDGE_AFTER = float(os.getenv("MOVE_HEDGE_AFTER", "2.0"))
+# 対局生成中に解説の応答を待つ時間（秒、0で無制限）。過ぎた解説は後回しにして対局の保存後に生成する
+COMMENTARY_DEADLINE = float(os.getenv("COMMENTARY_DEADLINE", "10.0"))
+# LLMに渡す候補手の数（全合法手を静的評価で順位付けした上位）
+LLM_MOVE_CANDIDATES = int(os.getenv("LLM_MOVE_CANDIDATES", "8"))
+
+# 対局生成ジョブの実行方式
+#   shared_loop: 全ての対局のコルーチンを常駐するイベントループ1つで多重化する
+#   threads: ワーカースレッドごとにイベントループを作り、1スレッドで1局ずつ生成する
+GAME_EXECUTION = os.getenv("GAME_EXECUTION", "shared_loop")
+# 対局生成ワーカー数（threads）・同時に生成する対局数（shared_loop）と待ち行列の上限
+GAME_WORKERS = int(os.getenv("GAME_WORKERS", "2"))
+GAME_CONCURRENCY = int(os.getenv("GAME_CONCURRENCY", "16"))
+GAME_QUEUE_SIZE = int(os.getenv("GAME_QUEUE_SIZE", "8"))
+
+# 取り込んだ棋譜・後回しにした解説を同時に生成する対局数と待ち行列の上限（1ジョブ1局）
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+IMPORT_QUEUE_SIZE = int(os.getenv("IMPORT_QUEUE_SIZE", "1000"))
+# 1回の取り込みで受け付ける対局数の上限
+IMPORT_MAX_GAMES = int(os.getenv("IMPORT_MAX_GAMES", "10000"))
+
+# 観戦者向けの対局イベント配信ハブ
+game_hub = GameHub()
+
+# 永続データ（キャッシュなど）の保存先
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# 解説キャッシュ（局面と指し手ごと。プロンプトやモデルを変えたらバージョンを更新する）
+COMMENTARY_CACHE_VERSION = "gpt-4o-mini:v1"
+# 保存先のSQLiteファイル（空にするとメモリのみ）
+COMMENTARY_CACHE_PATH = os.getenv(
+    "COMMENTARY_CACHE_PATH", os.path.join(DATA_DIR, "commentary_cache.sqlite3")
+)
+COMMENTARY_CACHE_SIZE = int(os.getenv("COMMENTARY_CACHE_SIZE", "4096"))
+# 解説の有効期間（秒、0で無期限）とSQLiteの最大行数
+COMMENTARY_CACHE_TTL = float(os.getenv("COMMENTARY_CACHE_TTL", str(30 * 24 * 3600)))
+COMMENTARY_CACHE_MAX_ROWS = int(os.getenv("COMMENTARY_CACHE_MAX_ROWS", "100000"))
+commentary_cache = CommentaryCache(
+    COMMENTARY_CACHE_PATH or None,
+    max_entries=COMMENTARY_CACHE_SIZE,
+    ttl=COMMENTARY_CACHE_TTL or None,
+    max_rows=COMMENTARY_CACHE_MAX_ROWS,
+)
+
+# 対局データと全局面の保存先（SQLiteは複数のワーカープロセスで共有、空にするとメモリのみ）
+GAME_STORE_PATH = os.getenv("GAME_STORE_PATH", os.path.join(DATA_DIR, "games.sqlite3"))
+# メモリに置く対局数、SQLiteに残す対局数、保存期間（秒、0で無期限）
+GAME_STORE_MEMORY_SIZE = int(os.getenv("GAME_STORE_MEMORY_SIZE", "256"))
+GAME_STORE_MAX_GAMES = int(os.getenv("GAME_STORE_MAX_GAMES", "10000"))
+GAME_STORE_MAX_AGE = float(os.getenv("GAME_STORE_MAX_AGE", str(30 * 24 * 3600)))
+game_store = create_game_store(
+    GAME_STORE_PATH,
+    memory_size=GAME_STORE_MEMORY_SIZE,
+    max_games=GAME_STORE_MAX_GAMES,
+    max_age=GAME_STORE_MAX_AGE or None,
+)
+
+# イベントループごとの非同期OpenAIクライアントと、接続確認用の同期クライアント
+_async_clients = weakref.WeakKeyDictionary()
+_client = None
+_client_lock = threading.Lock()
+
+# OpenAI APIの接続確認の間隔（秒、接続できている間・できない間）とタイムアウト（秒）
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "60"))
+LLM_HEALTH_OFFLINE_INTERVAL = float(os.getenv("LLM_HEALTH_OFFLINE_INTERVAL", "10"))
+LLM_HEALTH_TIMEOUT = float(os.getenv("LLM_HEALTH_TIMEOUT", "5"))
 
 # バージョン情報
 APP_VERSION = "1.0.0"
-print(f"AIの将棋トレーニング v{APP_VERSION} 起動中...")
-print(f"OpenAI API設定: {'有効' if client else '無効（サンプルデータモード）'}")
+
+# レスポンス圧縮（この大きさ未満は圧縮しない、gzip・brotliの圧縮レベル）
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+# 保存済みの対局を配信し直すとき、この手数を超える対局は全局面を送らない
+# （ビューアは盤面の差分APIで表示する）
+REPLAY_POSITIONS_MAX_MOVES = int(os.getenv("REPLAY_POSITIONS_MAX_MOVES", "120"))
+logger.info("AIの将棋トレーニング v%s 起動中...", APP_VERSION)
+logger.info(
+    "OpenAI API設定: %s",
+    (
+        "有効（接続確認はバックグラウンドで行います）"
+        if LLM_CONFIGURED
+        else "無効（サンプルデータモード）"
+    ),
+)
 
 # サンプル棋譜データ（30手の完全な対局）
 SAMPLE_GAME_DATA = {
@@ -249,17 +453,40 @@ SAMPLE_GAME_DATA = {
     "winReason": "",
 }
 
+# 定跡（ファイルがなければ組み込みの定跡とサンプル棋譜から作成）と、定跡を参照する手数
+OPENING_BOOK_PATH = os.getenv(
+    "OPENING_BOOK_PATH", os.path.join(DATA_DIR, "opening_book.bin")
+)
+OPENING_BOOK_MAX_PLY = int(os.getenv("OPENING_BOOK_MAX_PLY", "24"))
+try:
+    opening_book = load_opening_book(
+        OPENING_BOOK_PATH, [SAMPLE_GAME_DATA], OPENING_BOOK_MAX_PLY
+    )
+except Exception as e:
+    logger.error("定跡の読み込みエラー: %s", e)
+    opening_book = OpeningBook(None)
+
+
+def display_square(rank, file):
+    """表示上の (段, 列) をマス番号に変換
+
+    convert_usi_to_japanese関数と同じ座標系を使用
+    将棋盤面は9筋から1筋（右から左）なので、fileを逆順で表示
+    USI座標: to_square = rank * 9 + file (0-80)
+    日本語座標: to_file = (to_square % 9) + 1, to_rank = (to_square // 9) + 1
+    """
+    return rank * 9 + (8 - file)  # 9筋から1筋の順番で表示
+
 
 class ShogiGame:
     def __init__(self):
-        self.board = shogi.Board()
+        self.board = new_board()
         self.moves = []
         self.commentaries = []
 
     def board_to_japanese_string(self, board):
         """盤面を日本語の漢字で表示する（色分け用マーカー付き）"""
         try:
-            print("テキスト盤面生成を開始")  # デバッグ用
             # 通常のテキスト盤面を生成
             lines = []
 
@@ -271,47 +498,23 @@ class ShogiGame:
 
                 for file in range(9):
                     try:
-                        # convert_usi_to_japanese関数と同じ座標系を使用
-                        # 将棋盤面は9筋から1筋（右から左）なので、fileを逆順で表示
-                        # USI座標: to_square = rank * 9 + file (0-80)
-                        # 日本語座標: to_file = (to_square % 9) + 1, to_rank = (to_square // 9) + 1
-                        display_file = 8 - file  # 9筋から1筋の順番で表示
-                        square_index = rank * 9 + display_file
-                        piece = board.piece_at(square_index)
-
-                        if piece is None:
-                            line += "・"
-                        else:
-                            # 駒の日本語名を取得
-                            piece_name = self.get_piece_japanese_name(piece)
-                            # 後手の駒には特殊マーカーを付ける（python-shogiではWHITEが後手）
-                            try:
-                                is_gote = piece.color == shogi.WHITE
-                            except:
-                                is_gote = str(piece).isupper()
-
-                            if is_gote:
-                                # 後手の駒にマーカーを付ける（後でCSSで置換）
-                                line += f"◆{piece_name}◆"
-                            else:
-                                line += piece_name
-
+                        line += self.square_to_japanese(
+                            board, display_square(rank, file)
+                        )
                     except Exception as e:
-                        print(f"駒処理エラー at rank={rank}, file={file}: {e}")
+                        logger.warning(
+                            "駒処理エラー at rank=%d, file=%d: %s", rank, file, e
+                        )
                         line += "？"
 
                 lines.append(line)
 
             # テキストとして結合
             result = "\n".join(lines)
-            print("テキスト盤面生成成功")  # デバッグ用
             return result
 
         except Exception as e:
-            print(f"Error in board_to_japanese_string: {e}")
-            import traceback
-
-            traceback.print_exc()
+            logger.exception("Error in board_to_japanese_string: %s", e)
             # エラーの場合は簡単な文字列置換に戻す
             try:
                 board_str = str(board)
@@ -339,6 +542,25 @@ class ShogiGame:
             except:
                 return f"盤面表示エラー: {e}"
 
+    def square_to_japanese(self, board, square_index):
+        """1マス分の表示文字列（空きマスは・、後手の駒はマーカー付き）"""
+        piece = board.piece_at(square_index)
+        if piece is None:
+            return "・"
+
+        # 駒の日本語名を取得
+        piece_name = self.get_piece_japanese_name(piece)
+        # 後手の駒には特殊マーカーを付ける（python-shogiではWHITEが後手）
+        try:
+            is_gote = piece.color == shogi.WHITE
+        except:
+            is_gote = str(piece).isupper()
+
+        if is_gote:
+            # 後手の駒にマーカーを付ける（後でCSSで置換）
+            return f"◆{piece_name}◆"
+        return piece_name
+
     def get_piece_japanese_name(self, piece):
         """駒の日本語名を取得"""
         try:
@@ -374,26 +596,23 @@ class ShogiGame:
 
             # どちらでもない場合（エラー）
             else:
-                print(f"Debug: Unknown piece type: {piece.piece_type}")
+                logger.debug("Unknown piece type: %s", piece.piece_type)
                 return "？"
 
         except Exception as e:
-            print(f"駒名取得エラー: {e}")
-            import traceback
-
-            traceback.print_exc()
+            logger.exception("駒名取得エラー: %s", e)
             return "？"
 
     def get_board_state(self, move_number=0):
         """指定した手数での盤面状態を取得"""
-        temp_board = shogi.Board()
+        temp_board = new_board()
         for i in range(min(move_number, len(self.moves))):
             temp_board.push_usi(self.moves[i])
         return temp_board
 
-    def get_captured_pieces(self, move_number=0):
-        """指定した手数での持ち駒を取得"""
-        temp_board = self.get_board_state(move_number)
+    def get_captured_pieces(self, move_number=0, board=None):
+        """指定した手数での持ち駒を取得（boardを渡した場合はその盤面から取得）"""
+        temp_board = board if board is not None else self.get_board_state(move_number)
 
         sente_pieces = {}
         gote_pieces = {}
@@ -456,21 +675,278 @@ def convert_usi_to_japanese(move_usi, board):
         return f"{file_str}{rank_str}"
 
     except Exception as e:
-        print(f"日本語変換エラー: {e}")
+        logger.warning("日本語変換エラー: %s", e)
         return move_usi  # エラー時はUSI記法をそのまま返す
 
 
+def get_client():
+    """同期OpenAIクライアントを取得（最初に呼ばれたときに作成）"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+
+            _client = OpenAI(api_key=api_key, base_url=OPENAI_BASE_URL)
+        return _client
+
+
+def check_llm_connection():
+    """モデル一覧を取得してAPIキーと接続先を確認（失敗すると例外）"""
+    get_client().with_options(timeout=LLM_HEALTH_TIMEOUT, max_retries=0).models.list()
+
+
+llm_health = LLMHealth(
+    check_llm_connection,
+    enabled=LLM_CONFIGURED,
+    interval=LLM_HEALTH_INTERVAL,
+    offline_interval=LLM_HEALTH_OFFLINE_INTERVAL,
+)
+
+
+def llm_available():
+    """LLMを使えるか（APIキーが設定され、接続確認で失敗していない）
+
+    最初に呼ばれたときに接続確認のスレッドを起動する。
+    """
+    llm_health.start()
+    return llm_health.available
+
+
+def get_async_client():
+    """実行中のイベントループに対応する非同期OpenAIクライアントを取得"""
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        from openai import AsyncOpenAI
+
+        # 再送はllm_rate_limiterが行うのでSDK側では再送しない
+        async_client = AsyncOpenAI(
+            api_key=api_key, base_url=OPENAI_BASE_URL, max_retries=0
+        )
+        _async_clients[loop] = async_client
+    return async_client
+
+
+async def close_async_client():
+    """実行中のイベントループに対応する非同期OpenAIクライアントを閉じる"""
+    async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.close()
+
+
+class LLMUsage:
+    """1局分のLLM呼び出しの回数・トークン数と、指し手の回答の集計"""
+
+    def __init__(self):
+        self.calls = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.move_prompt_tokens = 0
+        self.move_answers = {"legal": 0, "illegal": 0, "error": 0}
+        self.hedges = 0
+        self.deadline_misses = {"move": 0, "commentary": 0}
+
+    def add_call(self, kind, prompt_tokens, completion_tokens):
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        if kind == "move":
+            self.move_prompt_tokens += prompt_tokens
+
+    def to_dict(self, plies):
+        """対局データに付ける集計（plies: 対局の手数）"""
+        answers = sum(self.move_answers.values())
+        total = self.prompt_tokens + self.completion_tokens
+        return {
+            "calls": dict(self.calls),
+            "promptTokens": self.prompt_tokens,
+            "completionTokens": self.completion_tokens,
+            "tokensPerPly": round(total / plies, 1) if plies else 0.0,
+            "movePromptTokensPerAnswer": (
+                round(self.move_prompt_tokens / answers, 1) if answers else 0.0
+            ),
+            "moveAnswers": dict(self.move_answers),
+            "legalAnswerRate": (
+                round(self.move_answers["legal"] / answers, 4) if answers else None
+            ),
+            "hedgedRequests": self.hedges,
+            "deadlineMisses": dict(self.deadline_misses),
+        }
+
+
+# 生成中の対局のLLMUsage（generate_ai_gameで設定し、解説のタスクにも引き継がれる）
+current_llm_usage = contextvars.ContextVar("current_llm_usage", default=None)
+
+
+def record_move_answer(result):
+    """LLMの指し手の回答の結果（legal・illegal・error）を記録"""
+    LLM_MOVE_ANSWERS.inc(result=result)
+    usage = current_llm_usage.get()
+    if usage is not None:
+        usage.move_answers[result] += 1
+
+
+def record_deadline_miss(kind):
+    """持ち時間内にLLMの応答が返らなかったことを記録"""
+    LLM_DEADLINE_MISSES.inc(kind=kind)
+    usage = current_llm_usage.get()
+    if usage is not None:
+        usage.deadline_misses[kind] += 1
+
+
+async def within_deadline(coro, deadline, kind):
+    """coroをdeadline秒（0なら無制限）まで待って結果を返す（間に合わなければ取り消してNone）"""
+    if not deadline:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, deadline)
+    except asyncio.TimeoutError:
+        record_deadline_miss(kind)
+        return None
+
+
+async def call_llm(kind, **kwargs):
+    """LLMのchat completionを呼び出し、所要時間・トークン数・エラー数を記録
+
+    呼び出しはllm_rate_limiterを通し、指し手（move）は解説より先に送る。
+    対局の生成中であれば、その対局のLLMUsageにも回数とトークン数を加える。
+    """
+    priority = MOVE_PRIORITY if kind == "move" else COMMENTARY_PRIORITY
+    estimated = estimate_tokens(kwargs.get("messages"), kwargs.get("max_tokens"))
+
+    async def attempt():
+        start = time.perf_counter()
+        try:
+            raw = await get_async_client().chat.completions.with_raw_response.create(
+                **kwargs
+            )
+        except Exception as e:
+            status = (
+                "rate_limited" if getattr(e, "status_code", None) == 429 else "error"
+            )
+            LLM_REQUESTS.inc(kind=kind, status=status)
+            if status == "error":
+                # 接続できなくなった可能性があるので次の確認を早める
+                llm_health.request_check()
+            raise
+        finally:
+            LLM_REQUEST_DURATION.observe(time.perf_counter() - start, kind=kind)
+        LLM_REQUESTS.inc(kind=kind, status="ok")
+        return raw
+
+    raw = await llm_rate_limiter.run(attempt, estimated, priority)
+    response = raw.parse()
+    usage = getattr(response, "usage", None)
+    prompt_tokens = completion_tokens = 0
+    if usage is not None:
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        LLM_TOKENS.inc(prompt_tokens, kind=kind, type="prompt")
+        LLM_TOKENS.inc(completion_tokens, kind=kind, type="completion")
+        llm_rate_limiter.settle(estimated, usage.total_tokens)
+    game_usage = current_llm_usage.get()
+    if game_usage is not None:
+        game_usage.add_call(kind, prompt_tokens, completion_tokens)
+    return response
+
+
+async def hedged_call_llm(kind, hedge_after, **kwargs):
+    """call_llmを呼び、hedge_after秒（0なら送らない）で応答がなければ同じ要求をもう1つ送って
+    先に成功した方の応答を返す（両方失敗した場合は最初の要求の例外を送出）
+    """
+    if not hedge_after:
+        return await call_llm(kind, **kwargs)
+    first = asyncio.create_task(call_llm(kind, **kwargs))
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            tasks.append(asyncio.create_task(call_llm(kind, **kwargs)))
+            usage = current_llm_usage.get()
+            if usage is not None:
+                usage.hedges += 1
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1:
+                        winner = "first" if task is first else "hedge"
+                        LLM_HEDGED_REQUESTS.inc(kind=kind, winner=winner)
+                    return task.result()
+        if len(tasks) > 1:
+            LLM_HEDGED_REQUESTS.inc(kind=kind, winner="none")
+        return first.result()
+    finally:
+        # 先に返らなかった方の要求は取り消す
+        for task in tasks:
+            task.cancel()
+
+
+def describe_position(board):
+    """盤面・持ち駒・手番をAPIレスポンス用の辞書にまとめる"""
+    game = ShogiGame()
+    return {
+        "boardState": game.board_to_japanese_string(board),
+        "capturedPieces": game.get_captured_pieces(board=board),
+        "currentTurn": "先手" if board.turn == shogi.BLACK else "後手",
+    }
+
+
+def build_game_positions(game_data):
+    """対局の全局面（盤面・持ち駒・手番）を初期局面から順に計算"""
+    board = new_board()
+    positions = [describe_position(board)]
+    for i, move_data in enumerate(game_data["moves"]):
+        try:
+            board.push_usi(move_data["moveUsi"])
+        except Exception as e:
+            logger.warning("Error applying move %d: %s", i + 1, e)
+            break
+        positions.append(describe_position(board))
+    return positions
+
+
+def store_game(game_data):
+    """対局データを保存し、全局面を事前計算する"""
+    positions = build_game_positions(game_data)
+    game_store.put(game_data, positions)
+    return positions
+
+
+def lookup_commentaries(keys):
+    """(局面のSFEN, USIの指し手) ごとにキャッシュの解説を引く（ないものはNone）
+
+    キャッシュはSQLiteを読むため、イベントループからはasyncio.to_threadで呼ぶ。
+    """
+    return [
+        commentary_cache.get(sfen, move_usi, COMMENTARY_CACHE_VERSION)
+        for sfen, move_usi in keys
+    ]
+
+
+def remember_commentaries(entries):
+    """(局面のSFEN, USIの指し手, 解説) をまとめてキャッシュに保存"""
+    for sfen, move_usi, commentary in entries:
+        commentary_cache.put(sfen, move_usi, COMMENTARY_CACHE_VERSION, commentary)
+
+
 async def generate_ai_commentary(board_state, move_usi, move_number, player):
-    """指定された手に対するAI解説を生成"""
-    if not client:
+    """指定された手に対するAI解説を生成（board_stateは指す前の盤面）"""
+    if not llm_available():
         return f"{move_number}手目の手です。詳細な解説を表示するにはOpenAI APIキーを設定してください。"
 
     try:
-        # 現在の盤面情報
-        board = shogi.Board()
-        for i in range(move_number - 1):
-            if i < len(SAMPLE_GAME_DATA["moves"]):
-                board.push_usi(SAMPLE_GAME_DATA["moves"][i]["moveUsi"])
+        # 指す前の盤面情報
+        board = board_state
+
+        # 同じ局面・同じ手の解説はキャッシュから返す
+        sfen = board.sfen()
+        (cached,) = await asyncio.to_thread(lookup_commentaries, [(sfen, move_usi)])
+        if cached is not None:
+            return cached
 
         # 手の詳細情報を取得
         move = shogi.Move.from_usi(move_usi)
@@ -499,7 +975,8 @@ async def generate_ai_commentary(board_state, move_usi, move_number, player):
 将棋の座標系では、1筋から9筋（左から右）、1段から9段（上から下）で表現されます。
 """
 
-        response = client.chat.completions.create(
+        response = await call_llm(
+            "commentary",
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "あなたは将棋の解説者です。"},
@@ -509,76 +986,361 @@ async def generate_ai_commentary(board_state, move_usi, move_number, player):
             temperature=0.7,
         )
 
-        return response.choices[0].message.content.strip()
+        commentary = response.choices[0].message.content.strip()
+        await asyncio.to_thread(remember_commentaries, [(sfen, move_usi, commentary)])
+        return commentary
 
     except Exception as e:
-        print(f"AI解説生成エラー: {e}")
+        logger.warning("AI解説生成エラー: %s", e)
         return f"{move_number}手目の手です。AI解説の生成中にエラーが発生しました。"
 
 
-async def generate_ai_move(board, move_number, player_type):
-    """AI（GPT）による次の手を生成"""
-    if not client:
-        # APIキーがない場合は定跡的な手を返す
-        legal_moves = list(board.legal_moves)
-        return random.choice(legal_moves) if legal_moves else None
-
+def parse_batch_commentary(content, move_numbers):
+    """まとめて生成した解説のJSONを {手数: 解説} に変換（読めない手は含めない）"""
     try:
-        # 現在の盤面状況を文字列で説明
-        legal_moves = list(board.legal_moves)
-        legal_moves_usi = [move.usi() for move in legal_moves[:10]]  # 最初の10手のみ
-
-        prompt = f"""
-あなたは{player_type}の将棋AIです。現在{move_number}手目を指す番です。
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+    items = data.get("commentaries") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return {}
+
+    commentaries = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            move_number = int(item.get("moveNumber"))
+        except (TypeError, ValueError):
+            continue
+        commentary = item.get("commentary")
+        if move_number in move_numbers and isinstance(commentary, str):
+            commentary = commentary.strip()
+            if commentary:
+                commentaries[move_number] = commentary
+    return commentaries
+
+
+async def generate_ai_commentary_batch(items):
+    """連続する複数の手の解説を1回のLLM呼び出しでまとめて生成
+
+    itemsは (指す前の盤面, USIの指し手, 手数, 手番) のリストで、同じ順序で解説のリストを返す。
+    キャッシュにある手は呼び出しに含めず、応答から読み取れなかった手は1手ずつ生成し直す。
+    """
+    if not llm_available() or len(items) <= 1:
+        return [await generate_ai_commentary(*item) for item in items]
+
+    results = [None] * len(items)
+    pending = []
+    keys = [(board.sfen(), move_usi) for board, move_usi, _, _ in items]
+    cached = await asyncio.to_thread(lookup_commentaries, keys)
+    for index, ((sfen, _), commentary) in enumerate(zip(keys, cached)):
+        if commentary is not None:
+            results[index] = commentary
+        else:
+            pending.append((index, sfen))
 
-以下の合法手の中から最適な手を1つ選んでください：
-{', '.join(legal_moves_usi)}
+    parsed = {}
+    if len(pending) > 1:
+        try:
+            # 各手の局面と指し手を列挙し、JSONでまとめて解説を返してもらう
+            lines = []
+            for index, sfen in pending:
+                board, move_usi, move_number, player = items[index]
+                lines.append(
+                    f"- 手数: {move_number}手目 / 手番: {player} / 指し手(USI): {move_usi}"
+                    f" / 指し手(日本語): {convert_usi_to_japanese(move_usi, board)}"
+                    f" / 指す前の局面(SFEN): {sfen}"
+                )
+            moves_text = "\n".join(lines)
+            prompt = f"""
+あなたは将棋のプロ解説者です。以下の連続した{len(pending)}手について、初心者にもわかりやすい解説をしてください。
+
+{moves_text}
+
+各手について以下の点を含めて100文字程度で解説してください：
+1. この手の狙いや意図
+2. 局面への影響
+3. 将棋の基本的なセオリーとの関連
 
-選択する手のUSI記法のみを回答してください（例：7g7f）
-説明は不要です。
+解説は敬語を使わず、親しみやすい口調でお願いします。
+駒の位置は「7六歩」のように日本語で表記してください。
+次のJSON形式だけで回答してください：
+{{"commentaries": [{{"moveNumber": 手数, "commentary": "解説"}}]}}
 """
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"あなたは{player_type}の将棋AIです。"},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=10,
-            temperature=0.5,
+            response = await call_llm(
+                "commentary_batch",
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "あなたは将棋の解説者です。"},
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=200 * len(pending),
+                temperature=0.7,
+                response_format={"type": "json_object"},
+            )
+            move_numbers = {items[index][2] for index, _ in pending}
+            parsed = parse_batch_commentary(
+                response.choices[0].message.content, move_numbers
+            )
+        except Exception as e:
+            logger.warning("AI解説の一括生成エラー: %s", e)
+
+    # 読み取れた解説を保存し、残りは1手ずつ生成
+    fallback = []
+    remembered = []
+    for index, sfen in pending:
+        board, move_usi, move_number, player = items[index]
+        commentary = parsed.get(move_number)
+        if commentary is not None:
+            remembered.append((sfen, move_usi, commentary))
+            results[index] = commentary
+        else:
+            fallback.append(index)
+    if remembered:
+        await asyncio.to_thread(remember_commentaries, remembered)
+    if fallback:
+        if len(pending) > 1:
+            logger.info(
+                "一括解説から読み取れなかった%d手を個別に生成します", len(fallback)
+            )
+        commentaries = await asyncio.gather(
+            *(generate_ai_commentary(*items[index]) for index in fallback)
         )
+        for index, commentary in zip(fallback, commentaries):
+            results[index] = commentary
+    return results
+
+
+async def generate_engine_move(board, time_limit=None, engine=None):
+    """内蔵エンジンによる次の手を生成（探索は別スレッドで実行）"""
+    if time_limit is None:
+        time_limit = ENGINE_MOVE_TIME
+    if engine is None:
+        engine = Engine()
+    # 探索中に元の盤面を触らないよう複製して渡す
+    search_board = shogi.Board(board.sfen())
+    result = await asyncio.to_thread(engine.search, search_board, time_limit)
+    return result.move
+
+
+USI_MOVE_PATTERN = re.compile(r"[1-9][a-i][1-9][a-i]\+?|[PLNSGBR]\*[1-9][a-i]")
+
+
+def candidate_line(ranked_move):
+    """候補手1つ分のプロンプトの行（USI記法と、詰み・王手・駒取り・成り・駒損の印）"""
+    tags = [
+        tag
+        for tag, flag in (
+            ("詰み", ranked_move.mate),
+            ("王手", ranked_move.check and not ranked_move.mate),
+            ("駒取り", ranked_move.capture),
+            ("成り", ranked_move.promotion),
+            ("駒損", ranked_move.hanging),
+        )
+        if flag
+    ]
+    return " ".join([ranked_move.move.usi()] + tags)
+
+
+def build_move_prompt(board, move_number, candidates):
+    """指し手を選ばせるプロンプト（局面のSFENと評価の高い順の候補手）"""
+    lines = [f"{move_number}手目 {board.sfen()}", "候補手:"]
+    lines.extend(candidate_line(candidate) for candidate in candidates)
+    return "\n".join(lines)
+
+
+async def generate_ai_move(board, move_number, player_type):
+    """AI（GPT）による次の手を生成
+
+    全ての合法手を内蔵エンジンの静的評価で順位付けし、上位LLM_MOVE_CANDIDATES手だけを
+    局面のSFENとともに渡して選ばせる。応答が遅ければMOVE_HEDGE_AFTER秒で同じ要求を
+    もう1つ送り、MOVE_DEADLINE秒を過ぎたら順位付けの最上位の手を指す。
+    """
+    if not llm_available():
+        # APIキーがない場合は内蔵エンジンの手を返す
+        MOVE_FALLBACKS.inc(reason="no_client")
+        return await generate_engine_move(board, ENGINE_FALLBACK_TIME)
+
+    try:
+        # 順位付けはpython-shogiの盤面で行う（探索と同じく別スレッドで実行）
+        ranked = await asyncio.to_thread(rank_moves, shogi.Board(board.sfen()))
+        if not ranked:
+            return None
+        if len(ranked) == 1:
+            # 選ぶ余地がなければLLMを呼ばない
+            return ranked[0].move
+        candidates = ranked[: max(1, LLM_MOVE_CANDIDATES)]
+
+        response = await within_deadline(
+            hedged_call_llm(
+                "move",
+                MOVE_HEDGE_AFTER,
+                model="gpt-4o-mini",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": f"{player_type}の将棋AI。局面（SFEN）と評価順の"
+                        "候補手から最善手をUSI記法で1つだけ答える。",
+                    },
+                    {
+                        "role": "user",
+                        "content": build_move_prompt(board, move_number, candidates),
+                    },
+                ],
+                max_tokens=10,
+                temperature=0.5,
+            ),
+            MOVE_DEADLINE,
+            "move",
+        )
+        if response is None:
+            logger.info(
+                "%d手目: LLMの応答が持ち時間（%.1f秒）内に返らないため評価最上位の手を指します",
+                move_number,
+                MOVE_DEADLINE,
+            )
+            MOVE_FALLBACKS.inc(reason="deadline")
+            return ranked[0].move
 
         ai_move_usi = response.choices[0].message.content.strip()
 
-        # 生成された手が合法手かチェック
-        try:
-            ai_move = shogi.Move.from_usi(ai_move_usi)
-            if ai_move in legal_moves:
-                return ai_move
-        except:
-            pass
+        # 生成された手が合法手かチェック（候補手以外の合法手も受け付ける）
+        match = USI_MOVE_PATTERN.search(ai_move_usi)
+        if match:
+            for ranked_move in ranked:
+                if ranked_move.move.usi() == match.group(0):
+                    record_move_answer("legal")
+                    return ranked_move.move
 
-        # 不正な手の場合はランダムに選択
-        return random.choice(legal_moves) if legal_moves else None
+        # 不正な手の場合は内蔵エンジンで選択
+        logger.info("AIが不正な手を返しました: %s", ai_move_usi)
+        record_move_answer("illegal")
+        MOVE_FALLBACKS.inc(reason="illegal_move")
+        return await generate_engine_move(board, ENGINE_FALLBACK_TIME)
 
     except Exception as e:
-        print(f"AI手生成エラー: {e}")
+        logger.warning("AI手生成エラー: %s", e)
+        record_move_answer("error")
+        MOVE_FALLBACKS.inc(reason="error")
+        return await generate_engine_move(board, ENGINE_FALLBACK_TIME)
+
+
+async def select_move(board, move_number, player_name, player_kind, engine=None):
+    """対局者の種類に応じて次の手を選択"""
+    if player_kind == "engine":
+        return await generate_engine_move(board, engine=engine)
+    if player_kind == "random":
         legal_moves = list(board.legal_moves)
         return random.choice(legal_moves) if legal_moves else None
+    return await generate_ai_move(board, move_number, player_name)
+
+
+async def annotate_game(game_data, commentary_batch_size=None, on_event=None):
+    """解説のない手にAI解説を生成して対局データに書き込み、生成した手数を返す
+
+    取り込んだ棋譜向け。盤面は初期局面から再生し、commentary_batch_sizeの手数ごとに
+    まとめた呼び出しをCOMMENTARY_CONCURRENCYまで並行して行う。
+    """
+    if not llm_available():
+        return 0
+    if commentary_batch_size is None:
+        commentary_batch_size = COMMENTARY_BATCH_SIZE
+    commentary_batch_size = max(1, commentary_batch_size)
 
+    board = new_board()
+    items = []
+    for move_record in game_data["moves"]:
+        if not move_record.get("commentary"):
+            player_type = "先手" if board.turn == shogi.BLACK else "後手"
+            items.append(
+                (
+                    move_record,
+                    (
+                        new_board(board.sfen()),
+                        move_record["moveUsi"],
+                        move_record["moveNumber"],
+                        player_type,
+                    ),
+                )
+            )
+        board.push_usi(move_record["moveUsi"])
+
+    semaphore = asyncio.Semaphore(max(1, COMMENTARY_CONCURRENCY))
 
-async def generate_ai_game(max_moves=30):
-    """AI同士の対局を生成"""
+    async def comment(window):
+        async with semaphore:
+            commentaries = await generate_ai_commentary_batch(
+                [item for _, item in window]
+            )
+        for (move_record, _), commentary in zip(window, commentaries):
+            move_record["commentary"] = commentary
+            move_record.pop("commentaryDeferred", None)
+            notify(on_event, "commentary", move_record)
+
+    await asyncio.gather(
+        *(
+            comment(items[i : i + commentary_batch_size])
+            for i in range(0, len(items), commentary_batch_size)
+        )
+    )
+    return len(items)
+
+
+def notify(on_event, event, move_record):
+    """進捗通知のコールバックを呼ぶ（通知側のエラーは対局生成に影響させない）"""
+    if on_event is None:
+        return
     try:
+        on_event(event, move_record)
+    except Exception as e:
+        logger.exception("進捗通知エラー: %s", e)
+
+
+async def generate_ai_game(
+    max_moves=30,
+    commentary_concurrency=None,
+    game_id=None,
+    on_event=None,
+    player_types=None,
+    commentary_batch_size=None,
+    use_opening_book=True,
+):
+    """AI同士の対局を生成
+
+    player_typesで先手・後手それぞれの指し手の選び方（PLAYER_TYPES）を指定する。
+    commentary_batch_sizeが2以上の場合は、その手数ごとにまとめて解説を生成する。
+    use_opening_bookが真なら、定跡にある局面ではエンジンやLLMを呼ばずに定跡手を指す。
+
+    解説は手の選択に影響しないため、n手目の解説生成とn+1手目の手の選択を
+    並行して実行する（同時実行数はcommentary_concurrencyで制限）。
+    on_eventを渡すと、手を指すたびに("move", 手の記録)、解説が付くたびに
+    ("commentary", 手の記録)で呼び出される。
+    """
+    if commentary_concurrency is None:
+        commentary_concurrency = COMMENTARY_CONCURRENCY
+    if game_id is None:
         game_id = f"20250827-{uuid.uuid4().hex[:8]}"
+    if player_types is None:
+        player_types = {"sente": "llm", "gote": "llm"}
+    if commentary_batch_size is None:
+        commentary_batch_size = COMMENTARY_BATCH_SIZE
+    commentary_batch_size = max(1, commentary_batch_size)
+    commentary_tasks = []
+
+    try:
 
         # プレイヤー設定
         players = {"sente": "宗太郎君 AI", "gote": "四五六君 AI"}
 
-        # AIが有効でない場合はサンプルデータを返す
-        if not client:
-            print("AIクライアントが無効のため、サンプルデータを使用します")
-            print(f"Returning sample data with game_id: {game_id}")
+        # LLMの対局者がいるのにAIが有効でない場合はサンプルデータを返す
+        if not llm_available() and "llm" in player_types.values():
+            logger.info(
+                "AIクライアントが無効のため、サンプルデータを使用します",
+                extra={"gameId": game_id},
+            )
+            SAMPLE_FALLBACKS.inc(route="generate_ai_game")
             sample_data = SAMPLE_GAME_DATA.copy()
             sample_data["gameId"] = game_id
 
@@ -591,10 +1353,84 @@ async def generate_ai_game(max_moves=30):
             return sample_data
 
         # AI対局を生成
-        board = shogi.Board()
+        board = new_board()
         moves = []
+        # この対局のLLM呼び出しを集計（解説のタスクにも引き継がれる）
+        usage = LLMUsage()
+        current_llm_usage.set(usage)
+        engines = {"sente": Engine(), "gote": Engine()}
+        semaphore = asyncio.Semaphore(max(1, commentary_concurrency))
+
+        def defer(move_record):
+            # 持ち時間内に返らなかった解説は空のまま印を付け、対局の保存後に生成する
+            move_record["commentaryDeferred"] = True
+            logger.info(
+                "%d手目の解説を後回しにします",
+                move_record["moveNumber"],
+                extra={"gameId": game_id},
+            )
 
-        print(f"AI対局を生成中... (最大{max_moves}手)")
+        async def comment(board_before, move_record, player_type):
+            async with semaphore:
+                commentary = await within_deadline(
+                    generate_ai_commentary(
+                        board_before,
+                        move_record["moveUsi"],
+                        move_record["moveNumber"],
+                        player_type,
+                    ),
+                    COMMENTARY_DEADLINE,
+                    "commentary",
+                )
+            if commentary is None:
+                defer(move_record)
+                return
+            move_record["commentary"] = commentary
+            logger.debug(
+                "%d手目の解説: %s...",
+                move_record["moveNumber"],
+                move_record["commentary"][:30],
+                extra={"gameId": game_id},
+            )
+            notify(on_event, "commentary", move_record)
+
+        async def comment_batch(window):
+            async with semaphore:
+                commentaries = await within_deadline(
+                    generate_ai_commentary_batch(
+                        [
+                            (
+                                board_before,
+                                move_record["moveUsi"],
+                                move_record["moveNumber"],
+                                player_type,
+                            )
+                            for board_before, move_record, player_type in window
+                        ]
+                    ),
+                    COMMENTARY_DEADLINE,
+                    "commentary",
+                )
+            if commentaries is None:
+                for _, move_record, _ in window:
+                    defer(move_record)
+                return
+            for (_, move_record, _), commentary in zip(window, commentaries):
+                move_record["commentary"] = commentary
+                logger.debug(
+                    "%d手目の解説: %s...",
+                    move_record["moveNumber"],
+                    commentary[:30],
+                    extra={"gameId": game_id},
+                )
+                notify(on_event, "commentary", move_record)
+
+        # まとめて解説する手の待ち行列
+        window = []
+
+        logger.info(
+            "AI対局を生成中... (最大%d手)", max_moves, extra={"gameId": game_id}
+        )
 
         for move_number in range(1, max_moves + 1):
             if board.is_game_over():
@@ -606,175 +1442,631 @@ async def generate_ai_game(max_moves=30):
             )
             player_type = "先手" if board.turn == shogi.BLACK else "後手"
 
-            print(f"  {move_number}手目を生成中... ({player_type})")
-
-            # AIが手を生成
-            ai_move = await generate_ai_move(board, move_number, current_player)
+            # 定跡にある局面では定跡手を、なければAIが手を生成
+            side = "sente" if board.turn == shogi.BLACK else "gote"
+            book_move = None
+            if use_opening_book and move_number <= OPENING_BOOK_MAX_PLY:
+                book_move = await asyncio.to_thread(opening_book.choose, board)
+            if book_move is not None:
+                ai_move = book_move.move
+            else:
+                start = time.perf_counter()
+                ai_move = await select_move(
+                    board,
+                    move_number,
+                    current_player,
+                    player_types[side],
+                    engines[side],
+                )
+                PLY_DURATION.observe(
+                    time.perf_counter() - start, player=player_types[side]
+                )
 
             if ai_move is None:
-                print(f"  {move_number}手目: 合法手が見つかりません")
+                logger.info(
+                    "%d手目: 合法手が見つかりません",
+                    move_number,
+                    extra={"gameId": game_id},
+                )
                 break
 
-            # 手を適用
+            # 手の日本語表記を生成（駒の種類を得るため指す前の盤面を使う）
             move_usi = ai_move.usi()
-            board.push(ai_move)
-
-            # AI解説を生成
-            commentary = await generate_ai_commentary(
-                board, move_usi, move_number, player_type
-            )
-
-            # 手の日本語表記を生成
             move_notation = convert_usi_to_japanese(move_usi, board)
+            board_before = new_board(board.sfen())
 
-            # 手を記録
-            moves.append(
-                {
-                    "moveNumber": move_number,
-                    "moveUsi": move_usi,
-                    "moveNotation": move_notation,
-                    "commentary": commentary,
-                }
-            )
+            # 手を適用
+            board.push(ai_move)
 
-            print(f"  {move_number}手目: {move_usi} - {commentary[:30]}...")
+            # 手を記録（解説は生成完了後に埋める）
+            move_record = {
+                "moveNumber": move_number,
+                "moveUsi": move_usi,
+                "moveNotation": move_notation,
+                "commentary": "",
+            }
+            moves.append(move_record)
+            notify(on_event, "move", move_record)
+
+            # 定跡の解説があればそのまま使い、なければAI解説を次の手の選択と並行して
+            # 生成する（まとめる場合は手数が揃ってから）
+            if book_move is not None and book_move.commentary:
+                move_record["commentary"] = book_move.commentary
+                notify(on_event, "commentary", move_record)
+            elif commentary_batch_size == 1:
+                commentary_tasks.append(
+                    asyncio.create_task(comment(board_before, move_record, player_type))
+                )
+            else:
+                window.append((board_before, move_record, player_type))
+                if len(window) >= commentary_batch_size:
+                    commentary_tasks.append(asyncio.create_task(comment_batch(window)))
+                    window = []
+
+            logger.debug(
+                "%d手目: %s (%s)",
+                move_number,
+                move_usi,
+                player_type,
+                extra={"gameId": game_id},
+            )
 
-            # 少し待機（API制限対策）
-            await asyncio.sleep(0.5)
+        # 揃わなかった残りの手をまとめて解説し、すべての解説生成を待つ
+        if window:
+            commentary_tasks.append(asyncio.create_task(comment_batch(window)))
+        await asyncio.gather(*commentary_tasks)
 
         game_data = {
             "gameId": game_id,
             "sente": players["sente"],
             "gote": players["gote"],
+            "senteType": player_types["sente"],
+            "goteType": player_types["gote"],
             "moves": moves,
             "result": "",
             "winReason": "",
+            "llmUsage": usage.to_dict(len(moves)),
         }
 
-        print(f"AI対局生成完了: {len(moves)}手")
+        logger.info("AI対局生成完了: %d手", len(moves), extra={"gameId": game_id})
         return game_data
 
     except Exception as e:
-        print(f"AI対局生成エラー: {e}")
+        logger.exception("AI対局生成エラー: %s", e, extra={"gameId": game_id})
+        for task in commentary_tasks:
+            task.cancel()
         # エラーの場合はサンプルデータを返す
         sample_data = SAMPLE_GAME_DATA.copy()
-        sample_data["gameId"] = f"20250827-{uuid.uuid4().hex[:8]}"
+        sample_data["gameId"] = game_id
         return sample_data
 
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """ルートごとの処理時間を記録（SSEはストリーム開始までの時間）"""
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            route=route,
+            method=request.method,
+            status=str(response.status_code),
+        )
+    return response
+
+
+@app.after_request
+def compress(response):
+    """JSON・テキストのレスポンスをgzip・brotliで圧縮"""
+    return compress_response(response, COMPRESS_MIN_SIZE, COMPRESS_LEVEL)
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
 
 
+def game_digest(game_data):
+    """指し手の列から決まる対局の内容のハッシュ（盤面のETagに使う）"""
+    return strong_etag(*(move_data["moveUsi"] for move_data in game_data["moves"]))
+
+
+def board_cache_control(game_id, stored):
+    """盤面のCache-Control（保存済みで配信が終わった対局の盤面は変わらない）"""
+    channel = game_hub.get(game_id)
+    if stored and (channel is None or channel.closed):
+        return IMMUTABLE
+    return REVALIDATE
+
+
+def publish_move(game_id, move_record, moves_usi):
+    """指し手とその局面を観戦者に配信"""
+    board, _ = position_cache.get_board(game_id, moves_usi, len(moves_usi))
+    payload = dict(move_record)
+    payload["position"] = describe_position(board)
+    game_hub.publish(game_id, "move", payload)
+
+
+def game_summary(game_data):
+    """指し手以外の対局情報"""
+    return {key: value for key, value in game_data.items() if key != "moves"}
+
+
+async def generate_game_for_job(job, on_event):
+    """対局を生成して保存（失敗時はサンプルデータで代替）"""
+    max_moves = job.params["maxMoves"]
+    try:
+        game_data = await generate_ai_game(
+            max_moves,
+            game_id=job.game_id,
+            on_event=on_event,
+            player_types=job.params["playerTypes"],
+            commentary_batch_size=job.params.get("commentaryBatchSize"),
+            use_opening_book=job.params.get("useOpeningBook", True),
+        )
+    except Exception as e:
+        logger.exception("対局生成エラー: %s", e, extra={"gameId": job.game_id})
+        # エラーの場合はサンプルデータを返す
+        game_data = SAMPLE_GAME_DATA.copy()
+        game_data["gameId"] = job.game_id
+
+        # 要求された手数に合わせてサンプルデータを調整
+        if max_moves < len(game_data["moves"]):
+            game_data["moves"] = game_data["moves"][:max_moves]
+            game_data["result"] = ""
+            game_data["winReason"] = ""
+        game_data["note"] = "サンプルデータを使用"
+
+    # 生成されたゲームデータを保存（全局面も同時に計算するのでループの外で行う）
+    await asyncio.to_thread(store_game, game_data)
+    logger.info("Game saved to game store", extra={"gameId": game_data["gameId"]})
+    if any(move_data.get("commentaryDeferred") for move_data in game_data["moves"]):
+        deferred_job = submit_deferred_commentary(
+            game_data, job.params.get("commentaryBatchSize")
+        )
+        if deferred_job is None:
+            # 生成をあきらめた解説は代わりの文で埋め、印を消して保存し直す
+            game_data = copy.deepcopy(game_data)
+            settle_deferred_commentary(game_data)
+            await asyncio.to_thread(store_game, game_data)
+    return game_data
+
+
+def submit_deferred_commentary(game_data, commentary_batch_size=None):
+    """後回しにした解説を生成するジョブを投入（対局の保存後に呼ぶ。保存し直すと印が消える）
+
+    キューが満杯で投入できない場合はNoneを返す。
+    """
+    try:
+        job = import_jobs.submit(
+            {
+                "maxMoves": len(game_data["moves"]),
+                "commentaryBatchSize": commentary_batch_size,
+            },
+            game_data["gameId"],
+        )
+    except QueueFullError:
+        logger.warning(
+            "解説生成キューが満杯のため、後回しにした解説を生成できません",
+            extra={"gameId": game_data["gameId"]},
+        )
+        return None
+    logger.info(
+        "後回しにした解説の生成ジョブを投入しました",
+        extra={"gameId": game_data["gameId"], "jobId": job.job_id},
+    )
+    return job
+
+
+def settle_deferred_commentary(game_data):
+    """後回しにした解説を生成できなかった手に代わりの解説を書いて印を消し、その手数を返す"""
+    settled = 0
+    for move_record in game_data["moves"]:
+        if move_record.pop("commentaryDeferred", None):
+            if not move_record.get("commentary"):
+                move_record["commentary"] = (
+                    f"{move_record['moveNumber']}手目の手です。"
+                    "AI解説を生成できませんでした。"
+                )
+            settled += 1
+    return settled
+
+
+async def run_game_job(job):
+    """対局を生成して保存し、観戦者に配信"""
+    published = []
+    # 配信（局面の計算を含む）はイベントループの外で、発生した順に1件ずつ行う
+    deliveries = asyncio.Queue()
+
+    async def deliver():
+        while True:
+            delivery = await deliveries.get()
+            if delivery is None:
+                return
+            try:
+                await asyncio.to_thread(*delivery)
+            except Exception as e:
+                logger.warning(
+                    "観戦者への配信エラー: %s", e, extra={"gameId": job.game_id}
+                )
+
+    def on_event(event, move_record):
+        job.record_event(event, move_record)
+        if event == "move":
+            published.append(move_record["moveUsi"])
+            deliveries.put_nowait(
+                (publish_move, job.game_id, move_record, tuple(published))
+            )
+        else:
+            deliveries.put_nowait(
+                (game_hub.publish, job.game_id, event, dict(move_record))
+            )
+
+    deliverer = asyncio.create_task(deliver())
+    try:
+        game_data = await generate_game_for_job(job, on_event)
+    except Exception as e:
+        deliveries.put_nowait(None)
+        await deliverer
+        game_hub.close(job.game_id, "failed", {"error": str(e)})
+        raise
+    deliveries.put_nowait(None)
+    await deliverer
+
+    # 配信済みの手と最終的な棋譜が食い違う場合（サンプルデータで代替した場合など）は
+    # 観戦者に棋譜の破棄を通知して配信し直す
+    final_usi = [move_data["moveUsi"] for move_data in game_data["moves"]]
+    if final_usi[: len(published)] != published:
+        game_hub.publish(job.game_id, "reset", {"gameId": job.game_id})
+        position_cache.invalidate(job.game_id)
+        published.clear()
+
+    # 逐次配信されなかった手をまとめて配信
+    await asyncio.to_thread(publish_remaining_moves, job.game_id, game_data, published)
+
+    game_hub.close(job.game_id, "done", game_summary(game_data))
+    return game_data
+
+
+def publish_remaining_moves(game_id, game_data, published):
+    """配信済みの手（published）より後の手を順に配信"""
+    for move_record in game_data["moves"][len(published) :]:
+        published.append(move_record["moveUsi"])
+        publish_move(game_id, move_record, published)
+
+
+def run_in_new_loop(coro):
+    """新しいイベントループでコルーチンを最後まで実行（threadsの実行方式で使う）"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(close_async_client())
+        loop.close()
+
+
+# shared_loopの実行方式で全ての対局が共有するイベントループ
+llm_loop = EventLoopThread("llm-loop")
+
+
+def make_job_queue(runner, workers, concurrent, max_queue):
+    """GAME_EXECUTIONに応じたジョブキューを作成（runnerはGameJobを受け取るコルーチン関数）"""
+    if GAME_EXECUTION == "threads":
+        return GameJobQueue(
+            lambda job: run_in_new_loop(runner(job)), workers, max_queue
+        )
+    return AsyncGameJobQueue(runner, llm_loop, concurrent, max_queue)
+
+
+game_jobs = make_job_queue(
+    run_game_job, GAME_WORKERS, GAME_CONCURRENCY, GAME_QUEUE_SIZE
+)
+
+
+async def run_import_job(job):
+    """取り込んだ対局に解説を付けて保存し直す"""
+    entry = await asyncio.to_thread(game_store.load, job.game_id)
+    if entry is None:
+        raise ValueError("対局が見つかりません")
+    # 対局ストアが返す対局データは応答中の他のリクエストと共有しているため、複製して書き換える
+    game_data, positions = copy.deepcopy(entry[0]), entry[1]
+
+    annotated = await annotate_game(game_data, job.params.get("commentaryBatchSize"))
+    # LLMを使えず後回しにした解説が残った場合は、再試行せず代わりの文で確定させる
+    settled = settle_deferred_commentary(game_data)
+    if settled:
+        logger.warning(
+            "後回しにした解説を生成できなかったため代わりの文を設定: %d手",
+            settled,
+            extra={"gameId": job.game_id},
+        )
+
+    await asyncio.to_thread(game_store.put, game_data, positions)
+    logger.info(
+        "取り込んだ対局の解説を生成: %d手", annotated, extra={"gameId": job.game_id}
+    )
+    return game_data
+
+
+import_jobs = make_job_queue(
+    run_import_job, IMPORT_WORKERS, IMPORT_WORKERS, IMPORT_QUEUE_SIZE
+)
+
+
 @app.route("/api/start_game", methods=["POST"])
 def start_game():
-    """新しい対局を開始"""
+    """新しい対局の生成ジョブを投入
+
+    includePositionsを真にすると、完了後の/api/jobs/<job_id>の応答に
+    対局データ（gameData）と一緒に事前計算した全局面（positions）が付く。
+    """
     try:
         # リクエストから手数パラメータを取得
         data = request.get_json() or {}
         max_moves = data.get("maxMoves", 30)  # デフォルト30手
+        include_positions = bool(data.get("includePositions", False))
 
         # 手数の範囲チェック
         if not isinstance(max_moves, int) or max_moves < 1 or max_moves > 200:
             max_moves = 30
 
-        print(f"対局開始: 最大{max_moves}手")
-
-        # AI対局を非同期で生成
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            print(f"Generating AI game with max_moves: {max_moves}")
-            game_data = loop.run_until_complete(generate_ai_game(max_moves))
-            # 生成されたゲームデータを保存
-            generated_games[game_data["gameId"]] = game_data
-            print(f"Game {game_data['gameId']} saved to memory")
-            print(f"Generated games count: {len(generated_games)}")
-        finally:
-            loop.close()
-
-        return jsonify({"success": True, "gameData": game_data})
-    except Exception as first_error:
-        print(f"対局生成エラー: {first_error}")
-        import traceback
+        # 解説をまとめて生成する手数（省略・不正な値はサーバーの設定を使う）
+        commentary_batch_size = data.get("commentaryBatchSize")
+        if (
+            not isinstance(commentary_batch_size, int)
+            or commentary_batch_size < 1
+            or commentary_batch_size > MAX_COMMENTARY_BATCH_SIZE
+        ):
+            commentary_batch_size = COMMENTARY_BATCH_SIZE
+
+        # 定跡を使うかどうか（省略時は使う）
+        use_opening_book = bool(data.get("useOpeningBook", True))
+
+        # 対局者の種類（不正な値はLLMとして扱う）
+        player_types = {}
+        for side in ("sente", "gote"):
+            player_kind = data.get(f"{side}Type", "llm")
+            player_types[side] = player_kind if player_kind in PLAYER_TYPES else "llm"
+
+        logger.info(
+            "対局開始: 最大%d手 (%s vs %s)",
+            max_moves,
+            player_types["sente"],
+            player_types["gote"],
+        )
 
-        traceback.print_exc()
+        # 観戦者がすぐに接続できるよう、ジョブ投入前に配信チャンネルを用意する
+        game_id = f"20250827-{uuid.uuid4().hex[:8]}"
+        game_hub.open(game_id)
+        game_hub.publish(
+            game_id,
+            "start",
+            {
+                "gameId": game_id,
+                "sente": "宗太郎君 AI",
+                "gote": "四五六君 AI",
+                "maxMoves": max_moves,
+                "position": describe_position(new_board()),
+            },
+        )
         try:
-            # エラーの場合はサンプルデータを返す
-            sample_data = SAMPLE_GAME_DATA.copy()
-            error_game_id = f"20250827-{uuid.uuid4().hex[:8]}"
-            sample_data["gameId"] = error_game_id
-
-            # 要求された手数に合わせてサンプルデータを調整
-            if max_moves < len(sample_data["moves"]):
-                sample_data["moves"] = sample_data["moves"][:max_moves]
-                sample_data["result"] = ""
-                sample_data["winReason"] = ""
+            job = game_jobs.submit(
+                {
+                    "maxMoves": max_moves,
+                    "includePositions": include_positions,
+                    "playerTypes": player_types,
+                    "commentaryBatchSize": commentary_batch_size,
+                    "useOpeningBook": use_opening_book,
+                },
+                game_id,
+            )
+        except QueueFullError:
+            game_hub.discard(game_id)
+            raise
 
-            # サンプルデータも保存
-            generated_games[error_game_id] = sample_data
-            print(f"Error fallback: Using sample data with game ID {error_game_id}")
-            return jsonify(
+        return (
+            jsonify(
                 {
                     "success": True,
-                    "gameData": sample_data,
-                    "note": "サンプルデータを使用",
+                    "jobId": job.job_id,
+                    "gameId": job.game_id,
+                    "status": job.status,
                 }
-            )
-        except Exception as second_error:
-            return jsonify({"success": False, "error": str(second_error)}), 500
+            ),
+            202,
+        )
+    except QueueFullError as e:
+        # 待ち行列が満杯の場合は時間をおいて再試行してもらう
+        response = jsonify(
+            {"success": False, "error": str(e), "queue": game_jobs.stats()}
+        )
+        response.headers["Retry-After"] = "10"
+        return response, 429
+    except Exception as e:
+        logger.exception("対局生成エラー: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/jobs/<job_id>")
+def get_job(job_id):
+    """対局生成・解説生成ジョブの状態と途中経過を取得"""
+    jobs = game_jobs
+    job = game_jobs.get(job_id)
+    if job is None:
+        jobs = import_jobs
+        job = import_jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "ジョブが見つかりません"}), 404
+
+    response = {"success": True, "job": job.to_dict(), "queue": jobs.stats()}
+    if job.status == "done":
+        response["gameData"] = job.result
+        # start_gameでincludePositionsを指定した場合は全局面も返す
+        if job.params.get("includePositions"):
+            response["positions"] = game_store.get_positions(job.game_id)
+    return jsonify(response)
+
+
+@app.route("/api/stats")
+def get_stats():
+    """キャッシュ・ジョブキュー・配信ハブ・レート制限の状態を取得"""
+    return jsonify(
+        {
+            "success": True,
+            "positionCache": position_cache.stats(),
+            "commentaryCache": commentary_cache.stats(),
+            "openingBook": opening_book.stats(),
+            "gameStore": game_store.stats(),
+            "jobs": game_jobs.stats(),
+            "importJobs": import_jobs.stats(),
+            "hub": game_hub.stats(),
+            "rateLimiter": llm_rate_limiter.stats(),
+            "llm": llm_health.stats(),
+        }
+    )
+
+
+def _stats_samples(stats, keys, **labels):
+    """stats()の辞書から指定したキーの値を (ラベル, 値) のリストにする"""
+    return [({**labels, "stat": key}, stats[key]) for key in keys if key in stats]
+
+
+def _game_store_samples():
+    stats = game_store.stats()
+    tiers = [stats[tier] for tier in ("memory", "sqlite") if tier in stats] or [stats]
+    return [({"backend": tier["backend"]}, tier["games"]) for tier in tiers]
+
+
+metrics_registry.callback(
+    "cache_hits_total",
+    "キャッシュのヒット・ミス数",
+    lambda: _stats_samples(position_cache.stats(), ("hits", "misses"), cache="position")
+    + _stats_samples(
+        commentary_cache.stats(),
+        ("memoryHits", "diskHits", "misses"),
+        cache="commentary",
+    )
+    + _stats_samples(opening_book.stats(), ("hits", "misses"), cache="opening_book"),
+    type_name="counter",
+)
+metrics_registry.callback(
+    "cache_hit_ratio",
+    "キャッシュのヒット率",
+    lambda: [
+        ({"cache": "commentary"}, commentary_cache.stats()["hitRate"]),
+        ({"cache": "opening_book"}, opening_book.stats()["hitRate"]),
+    ],
+)
+metrics_registry.callback(
+    "cache_entries",
+    "キャッシュ・定跡の件数",
+    lambda: [
+        ({"cache": "position"}, position_cache.stats()["games"]),
+        ({"cache": "commentary"}, commentary_cache.stats()["memoryEntries"]),
+        ({"cache": "opening_book"}, opening_book.stats()["positions"]),
+    ],
+)
+metrics_registry.callback(
+    "game_store_games", "対局ストアに保存されている対局数", _game_store_samples
+)
+metrics_registry.callback(
+    "game_jobs",
+    "対局生成ジョブキューの状態",
+    lambda: _stats_samples(game_jobs.stats(), ("workers", "running", "queued", "jobs")),
+)
+metrics_registry.callback(
+    "import_jobs",
+    "取り込んだ棋譜の解説生成ジョブキューの状態",
+    lambda: _stats_samples(
+        import_jobs.stats(), ("workers", "running", "queued", "jobs")
+    ),
+)
+metrics_registry.callback(
+    "llm_available",
+    "LLMを使えるか（1: LLMモード、0: オフラインモード。stateは接続確認の結果）",
+    lambda: [({"state": llm_health.state}, int(llm_health.available))],
+)
+metrics_registry.callback(
+    "game_hub_channels",
+    "観戦配信チャンネル数",
+    lambda: _stats_samples(game_hub.stats(), ("channels", "open")),
+)
+
+
+metrics_registry.callback(
+    "llm_rate_limiter_waiting",
+    "レート制限の順番待ちをしているLLM呼び出し数（優先度ごと）",
+    lambda: [
+        ({"priority": name}, count)
+        for name, count in llm_rate_limiter.stats()["waiting"].items()
+    ],
+)
+metrics_registry.callback(
+    "llm_rate_limited_total",
+    "429（レート制限）が返された回数",
+    lambda: [({}, llm_rate_limiter.stats()["rateLimited"])],
+    type_name="counter",
+)
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheusのテキスト形式でメトリクスを出力"""
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/api/board_state/<game_id>/<int:move_number>")
 def get_board_state(game_id, move_number):
     """指定した手数の盤面状態と持ち駒を取得"""
     try:
-        print(f"Getting board state for game {game_id}, move {move_number}")
-        print(f"Available games in memory: {list(generated_games.keys())}")
-
         # 保存されたゲームデータを取得
-        if game_id in generated_games:
-            game_data = generated_games[game_id]
-            print(f"Using generated game data for {game_id}")
-            print(f"Game data has {len(game_data.get('moves', []))} moves")
-        else:
+        game_data = game_store.get(game_id)
+        stored = game_data is not None
+        if game_data is None:
             # フォールバック: サンプルデータを使用
             game_data = SAMPLE_GAME_DATA
-            print(f"Game {game_id} not found, using sample data")
-            print(f"Sample data has {len(game_data.get('moves', []))} moves")
+            SAMPLE_FALLBACKS.inc(route="board_state")
+            logger.info("Game not found, using sample data", extra={"gameId": game_id})
 
-        # 新しいゲームインスタンスを作成
-        game = ShogiGame()
+        # 同じ内容の盤面を持っているクライアントには盤面を復元せずに304を返す
+        etag = strong_etag(
+            APP_VERSION, "board_state", game_digest(game_data), move_number
+        )
+        cache_control = board_cache_control(game_id, stored)
+        cached = not_modified(etag, cache_control)
+        if cached is not None:
+            return cached
 
-        # 指定した手数まで指し手を適用
-        for i, move_data in enumerate(game_data["moves"]):
-            if i < move_number:
-                try:
-                    print(f"Applying move {i+1}: {move_data['moveUsi']}")
-                    game.board.push_usi(move_data["moveUsi"])
-                    game.moves.append(move_data["moveUsi"])
-                except Exception as e:
-                    print(f"Error applying move {i+1}: {e}")
-                    break
+        # キャッシュ済みのチェックポイントから指定した手数の盤面を復元
+        game = ShogiGame()
+        moves_usi = [move_data["moveUsi"] for move_data in game_data["moves"]]
+        game.board, applied = position_cache.get_board(
+            game_data["gameId"], moves_usi, move_number
+        )
+        game.moves = moves_usi[:applied]
 
         # 盤面の文字列表現を取得（日本語で）
         try:
             board_str = game.board_to_japanese_string(game.board)
-            print("Board string generated successfully")
         except Exception as e:
-            print(f"Error generating board string: {e}")
+            logger.exception("Error generating board string: %s", e)
             board_str = "盤面表示エラー"
 
         # 持ち駒を取得
         try:
-            captured_pieces = game.get_captured_pieces(move_number)
-            print("Captured pieces retrieved successfully")
+            captured_pieces = game.get_captured_pieces(board=game.board)
         except Exception as e:
-            print(f"Error getting captured pieces: {e}")
+            logger.exception("Error getting captured pieces: %s", e)
             captured_pieces = {"sente": {}, "gote": {}}
 
-        return jsonify(
+        response = jsonify(
             {
                 "success": True,
                 "boardState": board_str,
@@ -782,14 +2074,357 @@ def get_board_state(game_id, move_number):
                 "currentTurn": "先手" if game.board.turn == shogi.BLACK else "後手",
             }
         )
+        return set_cache_headers(response, etag, cache_control)
     except Exception as e:
-        print(f"Error in get_board_state: {str(e)}")
-        import traceback
+        logger.exception("Error in get_board_state: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+def board_delta(game, board_from, board_to, moves_usi):
+    """2つの局面の差分（変わったマス・持ち駒・手番）
 
-        traceback.print_exc()
+    変わりうるマスは間の指し手の移動元と移動先だけなので、それ以外は比較しない。
+    squaresは [段, 列, 表示文字列] のリストで、持ち駒は変わった駒の枚数（0で無し）。
+    """
+    candidates = set()
+    for move_usi in moves_usi:
+        move = shogi.Move.from_usi(move_usi)
+        candidates.add(move.to_square)
+        if move.from_square is not None:
+            candidates.add(move.from_square)
+
+    squares = []
+    for square in sorted(candidates):
+        if board_from.piece_at(square) != board_to.piece_at(square):
+            rank, file = divmod(square, 9)
+            squares.append([rank, 8 - file, game.square_to_japanese(board_to, square)])
+
+    hands = {}
+    for color, side in ((shogi.BLACK, "sente"), (shogi.WHITE, "gote")):
+        changed = {}
+        for piece_type in shogi.PIECE_TYPES:
+            count = board_to.pieces_in_hand[color][piece_type]
+            if board_from.pieces_in_hand[color][piece_type] != count:
+                changed[shogi.PIECE_JAPANESE_SYMBOLS[piece_type]] = count
+        if changed:
+            hands[side] = changed
+    return {
+        "squares": squares,
+        "capturedPieces": hands,
+        "currentTurn": "先手" if board_to.turn == shogi.BLACK else "後手",
+    }
+
+
+@app.route("/api/board_delta/<game_id>/<int:from_move>/<int:to_move>")
+def get_board_delta(game_id, from_move, to_move):
+    """from手目からto手目への盤面の差分を取得（手数は適用できた範囲に丸める）"""
+    try:
+        game_data = game_store.get(game_id)
+        stored = game_data is not None
+        if game_data is None:
+            # フォールバック: サンプルデータを使用
+            game_data = SAMPLE_GAME_DATA
+            SAMPLE_FALLBACKS.inc(route="board_delta")
+            logger.info("Game not found, using sample data", extra={"gameId": game_id})
+
+        etag = strong_etag(
+            APP_VERSION, "board_delta", game_digest(game_data), from_move, to_move
+        )
+        cache_control = board_cache_control(game_id, stored)
+        cached = not_modified(etag, cache_control)
+        if cached is not None:
+            return cached
+
+        # 両方の局面をキャッシュ済みのチェックポイントから復元
+        moves_usi = [move_data["moveUsi"] for move_data in game_data["moves"]]
+        board_from, applied_from = position_cache.get_board(
+            game_data["gameId"], moves_usi, from_move
+        )
+        board_to, applied_to = position_cache.get_board(
+            game_data["gameId"], moves_usi, to_move
+        )
+        start, end = sorted((applied_from, applied_to))
+        delta = board_delta(ShogiGame(), board_from, board_to, moves_usi[start:end])
+
+        response = jsonify(
+            {"success": True, "from": applied_from, "to": applied_to, **delta}
+        )
+        return set_cache_headers(response, etag, cache_control)
+    except Exception as e:
+        logger.exception("Error in get_board_delta: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/game/<game_id>/positions")
+def get_game_positions(game_id):
+    """対局の全局面を一括で取得"""
+    try:
+        # 再検証（If-None-Match）は対局データだけで答え、全局面は応答本文を返すときだけ読む
+        game_data = game_store.get(game_id)
+        if game_data is None:
+            return jsonify({"success": False, "error": "対局が見つかりません"}), 404
+        etag = strong_etag(APP_VERSION, "positions", game_digest(game_data))
+        cache_control = board_cache_control(game_id, True)
+        cached = not_modified(etag, cache_control)
+        if cached is not None:
+            return cached
+        positions = game_store.get_positions(game_id)
+        if positions is None:
+            positions = store_game(game_data)
+
+        response = jsonify({"success": True, "gameId": game_id, "positions": positions})
+        return set_cache_headers(response, etag, cache_control)
+    except Exception as e:
+        logger.exception("Error in get_game_positions: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/game/<game_id>/export")
+def export_game_record(game_id):
+    """対局を棋譜ファイル（kif・csa・usi・sfen）として書き出す"""
+    export_format = request.args.get("format", "kif").lower()
+    if export_format not in FORMATS:
+        return jsonify({"success": False, "error": "未対応の形式です"}), 400
+    game_data = game_store.get(game_id)
+    if game_data is None:
+        return jsonify({"success": False, "error": "対局が見つかりません"}), 404
+
+    # 解説は後から付くことがあるため、解説を含めた内容から作るETagで毎回検証させる
+    etag = strong_etag(
+        APP_VERSION,
+        "export",
+        export_format,
+        json.dumps(game_data, ensure_ascii=False, sort_keys=True),
+    )
+    cached = not_modified(etag, REVALIDATE)
+    if cached is not None:
+        return cached
+
+    extension, mimetype = FORMATS[export_format]
+    response = Response(
+        export_game(game_data, export_format).encode("utf-8"),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{game_id}.{extension}"'
+        },
+    )
+    return set_cache_headers(response, etag, REVALIDATE)
+
+
+@app.route("/api/import", methods=["POST"])
+def import_games():
+    """KIF・CSAの棋譜を取り込んで対局ストアに保存する
+
+    multipartのfiles（複数可）か、リクエスト本文そのものを棋譜として読む。
+    ファイルは行ごとに読み進め、1局ずつ検証して保存する。
+    commentary=1なら解説のない手のAI解説を1局1ジョブで生成する。
+    """
+    export_format = request.args.get("format")
+    if export_format not in (None, "kif", "csa"):
+        return jsonify({"success": False, "error": "未対応の形式です"}), 400
+    encoding = request.args.get("encoding") or None
+    commentary = request.args.get("commentary", "0").lower() in ("1", "true", "yes")
+    commentary_batch_size = request.args.get("commentaryBatchSize", type=int)
+    if (
+        commentary_batch_size is not None
+        and not 1 <= commentary_batch_size <= MAX_COMMENTARY_BATCH_SIZE
+    ):
+        commentary_batch_size = None
+
+    uploads = [
+        (storage.filename, storage.stream) for storage in request.files.getlist("files")
+    ]
+    if not uploads and not request.files:
+        uploads = [(request.args.get("filename"), request.stream)]
+
+    imported, errors = [], []
+    truncated = False
+    try:
+        for filename, stream in uploads:
+            for parsed in read_kifu(stream, filename, export_format, encoding):
+                if len(imported) + len(errors) >= IMPORT_MAX_GAMES:
+                    truncated = True
+                    break
+                if parsed.error:
+                    errors.append(
+                        {
+                            "file": filename,
+                            "game": parsed.index + 1,
+                            "error": parsed.error,
+                        }
+                    )
+                    continue
+                game_data = parsed.to_game_data(new_game_id(), convert_usi_to_japanese)
+                store_game(game_data)
+                entry = {
+                    "gameId": game_data["gameId"],
+                    "file": filename,
+                    "game": parsed.index + 1,
+                    "sente": game_data["sente"],
+                    "gote": game_data["gote"],
+                    "plies": len(game_data["moves"]),
+                    "result": game_data["result"],
+                    # 保存済みの対局は観戦画面で先頭から再生できる
+                    "viewerUrl": f"/viewer?game={game_data['gameId']}",
+                }
+                needs_commentary = any(
+                    not move_data["commentary"] for move_data in game_data["moves"]
+                )
+                if commentary and llm_available() and needs_commentary:
+                    try:
+                        job = import_jobs.submit(
+                            {
+                                "maxMoves": len(game_data["moves"]),
+                                "commentaryBatchSize": commentary_batch_size,
+                            },
+                            game_data["gameId"],
+                        )
+                        entry["jobId"] = job.job_id
+                    except QueueFullError:
+                        # 対局は保存済みなので、解説だけ後から付け直せる
+                        entry["jobId"] = None
+                imported.append(entry)
+            if truncated:
+                break
+    except Exception as e:
+        logger.exception("棋譜の取り込みエラー: %s", e)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+    logger.info("棋譜の取り込み: %d局（エラー%d局）", len(imported), len(errors))
+    return jsonify(
+        {
+            "success": bool(imported) or not errors,
+            "imported": imported,
+            "errors": errors,
+            "truncated": truncated,
+            "queue": import_jobs.stats(),
+        }
+    )
+
+
+@app.route("/api/games/export")
+def export_games():
+    """保存済みの対局をまとめてzipで書き出す（1局ずつ圧縮しながら送信）
+
+    idsで対局IDをカンマ区切りで指定し、省略時は保存されているすべての対局。
+    limitで書き出す対局数の上限を指定できる。
+    """
+    export_format = request.args.get("format", "kif").lower()
+    if export_format not in FORMATS:
+        return jsonify({"success": False, "error": "未対応の形式です"}), 400
+    try:
+        limit = int(request.args.get("limit", 0))
+    except ValueError:
+        return (
+            jsonify({"success": False, "error": "limitは整数で指定してください"}),
+            400,
+        )
+
+    ids = [game_id for game_id in request.args.get("ids", "").split(",") if game_id]
+    if ids:
+        games = (game_store.get(game_id) for game_id in ids)
+        games = (game_data for game_data in games if game_data is not None)
+    else:
+        games = game_store.iter_games()
+    if limit > 0:
+        games = itertools.islice(games, limit)
+
+    return Response(
+        stream_with_context(stream_zip(games, export_format)),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="games_{export_format}.zip"'
+        },
+    )
+
+
+def format_sse(event, data, event_id=None):
+    """Server-Sent Eventsの1イベント分の文字列を生成"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def replay_stored_game(game_data, start=0, include_positions=True):
+    """保存済みの対局を配信イベントの列として返す
+
+    include_positionsが偽なら指し手に局面を付けない（開始局面だけを送る）。
+    """
+    if include_positions:
+        positions = game_store.get_positions(game_data["gameId"])
+        if positions is None:
+            positions = store_game(game_data)
+    else:
+        positions = [describe_position(new_board())]
+
+    events = [
+        (
+            "start",
+            {
+                "gameId": game_data["gameId"],
+                "sente": game_data["sente"],
+                "gote": game_data["gote"],
+                "maxMoves": len(game_data["moves"]),
+                "position": positions[0],
+            },
+        )
+    ]
+    for index, move_data in enumerate(game_data["moves"], 1):
+        payload = dict(move_data)
+        if index < len(positions):
+            payload["position"] = positions[index]
+        events.append(("move", payload))
+    events.append(("done", game_summary(game_data)))
+
+    for index, (event, data) in enumerate(events):
+        if index >= start:
+            yield index, event, data
+
+
+@app.route("/api/games/<game_id>/stream")
+def stream_game(game_id):
+    """対局の指し手をServer-Sent Eventsで配信（途中から接続した場合は先頭から再送）
+
+    保存済みの対局は、positions=0を指定した場合やREPLAY_POSITIONS_MAX_MOVESを超える
+    場合は指し手に局面を付けずに送る。
+    """
+    last_event_id = request.headers.get("Last-Event-ID", request.args.get("from"))
+    try:
+        start = int(last_event_id) + 1 if last_event_id is not None else 0
+    except ValueError:
+        start = 0
+
+    if game_hub.get(game_id) is not None:
+        events = game_hub.subscribe(game_id, start)
+    else:
+        game_data = game_store.get(game_id)
+        if game_data is None:
+            return jsonify({"success": False, "error": "対局が見つかりません"}), 404
+        include_positions = (
+            request.args.get("positions") != "0"
+            and len(game_data["moves"]) <= REPLAY_POSITIONS_MAX_MOVES
+        )
+        events = replay_stored_game(game_data, start, include_positions)
+
+    def generate():
+        for item in events:
+            if item is None:
+                # 接続維持のためのコメント行
+                yield ": keep-alive\n\n"
+                continue
+            index, event, data = item
+            yield format_sse(event, data, index)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/viewer")
 def viewer():
     return render_template("viewer.html")
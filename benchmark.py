@@ -0,0 +1,749 @@
+"""app.pyのホットパスのベンチマーク（オフラインで実行可能）
+
+各処理の1秒あたりの実行回数とレイテンシのパーセンタイルを計測し、
+結果をJSONで出力する。--compareで以前の結果と比較できる。
+
+使い方:
+    python benchmark.py                          # すべて実行して表を表示
+    python benchmark.py --output before.json     # 結果をJSONに保存
+    python benchmark.py --compare before.json    # 以前の結果と比較
+    python benchmark.py --only replay --only api_board_state
+    python benchmark.py --latency 0.1 --game-iterations 5
+    python benchmark.py --only concurrent_games_threads --only concurrent_games_shared_loop
+    python benchmark.py --only startup --startup-base-url http://10.255.255.1/v1
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import shogi
+
+# ベンチマークはオフラインで実行する（.envのAPIキーも使わない）
+os.environ.setdefault("OPENAI_API_KEY", "")
+# 計測結果の出力に混ざらないよう、ログは警告以上を標準エラーに出す
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as shogi_app
+from commentary_cache import CommentaryCache
+from engine import Engine, rank_moves
+from fake_openai import answer
+from game_jobs import AsyncGameJobQueue, EventLoopThread, GameJobQueue
+from game_store import MemoryGameStore
+from logging_config import setup_logging
+from rate_limiter import RateLimiter
+
+setup_logging(stream=sys.stderr)
+
+
+class FakeCompletions:
+    """chat.completions.createの代わりに、指定したレイテンシで応答を返す
+
+    slow_rateの割合の呼び出しはslow_latency秒かかる（応答時間の裾の長さを再現する）。
+    """
+
+    def __init__(self, latency, jitter, seed, slow_rate=0.0, slow_latency=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.with_raw_response = FakeRawCompletions(self)
+
+    async def create(self, model=None, messages=None, max_tokens=None, **kwargs):
+        self.calls += 1
+        delay = self.latency
+        if self.jitter:
+            delay = max(0.0, self.rng.gauss(self.latency, self.jitter))
+        if self.slow_rate and self.rng.random() < self.slow_rate:
+            delay = self.slow_latency
+        await asyncio.sleep(delay)
+
+        # 応答の本文とトークン数は偽サーバー（fake_openai.py）と同じ規則で作る
+        content = answer(messages, kwargs.get("response_format"), self.rng)
+        message = type("Message", (), {"content": content})()
+        choice = type("Choice", (), {"message": message})()
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages or ())
+        usage = type(
+            "Usage",
+            (),
+            {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content),
+                "total_tokens": prompt_tokens + len(content),
+            },
+        )()
+        return type("Completion", (), {"choices": [choice], "usage": usage})()
+
+
+class FakeRawResponse:
+    """with_raw_responseの応答（レート制限ヘッダなし）"""
+
+    headers = {}
+
+    def __init__(self, completion):
+        self.completion = completion
+
+    def parse(self):
+        return self.completion
+
+
+class FakeRawCompletions:
+    """chat.completions.with_raw_response.createの代わり"""
+
+    def __init__(self, completions):
+        self.completions = completions
+
+    async def create(self, **kwargs):
+        return FakeRawResponse(await self.completions.create(**kwargs))
+
+
+class FakeAsyncClient:
+    """AsyncOpenAIの代わりに使う偽のクライアント"""
+
+    def __init__(
+        self, latency=0.05, jitter=0.0, seed=0, slow_rate=0.0, slow_latency=0.0
+    ):
+        self.completions = FakeCompletions(
+            latency, jitter, seed, slow_rate, slow_latency
+        )
+        self.chat = type("Chat", (), {"completions": self.completions})()
+
+    async def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def stub_llm(latency=0.05, jitter=0.0, seed=0, slow_rate=0.0, slow_latency=0.0):
+    """app.pyのLLM呼び出しを偽のクライアントに差し替える"""
+    fake = FakeAsyncClient(latency, jitter, seed, slow_rate, slow_latency)
+    original = shogi_app.llm_available, shogi_app.get_async_client
+    shogi_app.llm_available = lambda: True
+    shogi_app.get_async_client = lambda: fake
+    try:
+        yield fake
+    finally:
+        shogi_app.llm_available, shogi_app.get_async_client = original
+
+
+@contextlib.contextmanager
+def quiet():
+    """計測中はapp.pyのログ出力を捨てる"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def percentile(sorted_values, fraction):
+    """線形補間によるパーセンタイル"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    weight = position - lower
+    return sorted_values[lower] * (1 - weight) + sorted_values[upper] * weight
+
+
+def summarize(samples, **extra):
+    """計測値（秒）を集計してミリ秒単位の辞書にする"""
+    samples = sorted(samples)
+    total = sum(samples)
+    result = {
+        "iterations": len(samples),
+        "opsPerSec": round(len(samples) / total, 2) if total > 0 else 0.0,
+        "meanMs": round(statistics.fmean(samples) * 1000, 4),
+        "p50Ms": round(percentile(samples, 0.50) * 1000, 4),
+        "p90Ms": round(percentile(samples, 0.90) * 1000, 4),
+        "p99Ms": round(percentile(samples, 0.99) * 1000, 4),
+        "minMs": round(samples[0] * 1000, 4),
+        "maxMs": round(samples[-1] * 1000, 4),
+    }
+    result.update(extra)
+    return result
+
+
+def measure(func, iterations, warmup=None):
+    """funcをiterations回呼んで1回ごとの所要時間を計測"""
+    if warmup is None:
+        warmup = max(1, iterations // 10)
+    with quiet():
+        for i in range(warmup):
+            func(i)
+        samples = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            func(i)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def random_game(plies, seed):
+    """ランダムな合法手でN手の対局データを作る（ベンチマーク用の棋譜）"""
+    rng = random.Random(seed)
+    board = shogi.Board()
+    moves = []
+    with quiet():
+        for move_number in range(1, plies + 1):
+            legal_moves = list(board.legal_moves)
+            if not legal_moves:
+                break
+            move = rng.choice(legal_moves)
+            moves.append(
+                {
+                    "moveNumber": move_number,
+                    "moveUsi": move.usi(),
+                    "moveNotation": shogi_app.convert_usi_to_japanese(
+                        move.usi(), board
+                    ),
+                    "commentary": "",
+                }
+            )
+            board.push(move)
+    return {
+        "gameId": f"bench-{seed}",
+        "sente": "先手",
+        "gote": "後手",
+        "moves": moves,
+        "result": "",
+        "winReason": "",
+    }
+
+
+def replay_boards(game_data):
+    """各手を指す前の盤面のリスト"""
+    board = shogi_app.new_board()
+    boards = []
+    for move_data in game_data["moves"]:
+        boards.append(shogi_app.new_board(board.sfen()))
+        board.push_usi(move_data["moveUsi"])
+    boards.append(board)
+    return boards
+
+
+# ---- 各ベンチマーク ----
+
+
+def bench_replay(args, game_data):
+    game = shogi_app.ShogiGame()
+    game.moves = [move_data["moveUsi"] for move_data in game_data["moves"]]
+    plies = len(game.moves)
+    samples = measure(lambda i: game.get_board_state(plies), args.iterations)
+    return summarize(samples, plies=plies)
+
+
+def bench_board_to_japanese_string(args, game_data):
+    boards = replay_boards(game_data)
+    game = shogi_app.ShogiGame()
+    samples = measure(
+        lambda i: game.board_to_japanese_string(boards[i % len(boards)]),
+        args.iterations,
+    )
+    return summarize(samples)
+
+
+def bench_get_captured_pieces(args, game_data):
+    boards = replay_boards(game_data)
+    game = shogi_app.ShogiGame()
+    samples = measure(
+        lambda i: game.get_captured_pieces(board=boards[i % len(boards)]),
+        args.iterations,
+    )
+    return summarize(samples)
+
+
+def bench_convert_usi_to_japanese(args, game_data):
+    boards = replay_boards(game_data)
+    moves = [move_data["moveUsi"] for move_data in game_data["moves"]]
+    samples = measure(
+        lambda i: shogi_app.convert_usi_to_japanese(
+            moves[i % len(moves)], boards[i % len(moves)]
+        ),
+        args.iterations,
+    )
+    return summarize(samples)
+
+
+def bench_legal_moves(args, game_data):
+    boards = replay_boards(game_data)
+    samples = measure(
+        lambda i: list(boards[i % len(boards)].legal_moves), args.iterations
+    )
+    return summarize(samples)
+
+
+def bench_api_board_state(args, game_data):
+    rng = random.Random(args.seed)
+    plies = len(game_data["moves"])
+    targets = [rng.randint(0, plies) for _ in range(args.iterations + 1)]
+    with quiet():
+        shogi_app.store_game(game_data)
+    shogi_app.position_cache.invalidate(game_data["gameId"])
+    test_client = shogi_app.app.test_client()
+    sizes = []
+
+    def request(i):
+        response = test_client.get(
+            f"/api/board_state/{game_data['gameId']}/{targets[i % len(targets)]}"
+        )
+        assert response.status_code == 200
+        sizes.append(len(response.data))
+
+    samples = measure(request, args.iterations)
+    return summarize(samples, avgBytes=round(statistics.mean(sizes), 1))
+
+
+def bench_api_board_delta(args, game_data):
+    # 矢印キーで1手ずつ進める・戻す操作を想定した隣り合う手数の差分
+    plies = len(game_data["moves"])
+    with quiet():
+        shogi_app.store_game(game_data)
+    shogi_app.position_cache.invalidate(game_data["gameId"])
+    test_client = shogi_app.app.test_client()
+    sizes = []
+
+    def request(i):
+        step = i % (2 * plies)
+        start = step if step < plies else 2 * plies - step
+        end = start + 1 if step < plies else start - 1
+        response = test_client.get(
+            f"/api/board_delta/{game_data['gameId']}/{start}/{end}"
+        )
+        assert response.status_code == 200
+        sizes.append(len(response.data))
+
+    samples = measure(request, args.iterations)
+    return summarize(samples, avgBytes=round(statistics.mean(sizes), 1))
+
+
+def bench_api_start_game(args, game_data):
+    # ジョブは即座に完了させ、エンドポイント自体の処理時間だけを計測する
+    original = shogi_app.game_jobs
+    shogi_app.game_jobs = GameJobQueue(
+        lambda job: shogi_app.game_hub.close(job.game_id),
+        workers=1,
+        max_queue=args.iterations * 2 + 10,
+    )
+    test_client = shogi_app.app.test_client()
+
+    def request(i):
+        response = test_client.post("/api/start_game", json={"maxMoves": 20})
+        assert response.status_code == 202
+
+    try:
+        with stub_llm(args.latency, args.jitter, args.seed):
+            samples = measure(request, args.iterations)
+    finally:
+        shogi_app.game_jobs = original
+    return summarize(samples)
+
+
+def bench_generate_ai_game(args, game_data):
+    results = []
+
+    def generate(i):
+        results.append(
+            asyncio.run(
+                shogi_app.generate_ai_game(
+                    args.game_plies, commentary_batch_size=args.batch_size
+                )
+            )
+        )
+
+    with stub_llm(args.latency, args.jitter, args.seed) as fake:
+        samples = measure(generate, args.game_iterations, warmup=0)
+    games = len(samples)
+    usages = [result["llmUsage"] for result in results if "llmUsage" in result]
+    return summarize(
+        samples,
+        plies=args.game_plies,
+        latencyMs=args.latency * 1000,
+        commentaryBatchSize=args.batch_size,
+        llmCalls=fake.completions.calls // max(1, games),
+        pliesPerSec=round(args.game_plies * games / sum(samples), 2),
+        tokensPerPly=(
+            round(statistics.fmean(usage["tokensPerPly"] for usage in usages), 1)
+            if usages
+            else 0.0
+        ),
+        commentaryCache=shogi_app.commentary_cache.stats(),
+    )
+
+
+def bench_move_candidates(args, game_data):
+    # LLMに渡す候補手の絞り込み: 全合法手の順位付けの時間と、浅い探索の最善手が
+    # 候補に入る割合（従来の「生成順の最初のk手」と比較）
+    k = shogi_app.LLM_MOVE_CANDIDATES
+    boards = [
+        shogi.Board(board.sfen())
+        for board in replay_boards(game_data)
+        if not board.is_game_over()
+    ]
+    engine = Engine(seed=args.seed)
+    best_moves = [engine.search(board, 3600.0, 2).move for board in boards]
+    ranked_hits = first_hits = 0
+    for board, best in zip(boards, best_moves):
+        ranked_hits += best in [ranked.move for ranked in rank_moves(board, k)]
+        first_hits += best in list(board.legal_moves)[:k]
+    samples = measure(lambda i: rank_moves(boards[i % len(boards)]), args.iterations)
+    prompt_tokens = [
+        len(shogi_app.build_move_prompt(board, 1, rank_moves(board, k)))
+        for board in boards
+    ]
+    return summarize(
+        samples,
+        candidates=k,
+        positions=len(boards),
+        bestMoveRecall=round(ranked_hits / len(boards), 3),
+        generatorOrderRecall=round(first_hits / len(boards), 3),
+        promptChars=round(statistics.fmean(prompt_tokens), 1),
+    )
+
+
+def run_ai_moves(args, game_data, deadline, hedge_after):
+    """棋譜の各局面でgenerate_ai_moveを呼び、1手ごとの所要時間を計測"""
+    boards = [board for board in replay_boards(game_data) if not board.is_game_over()]
+    original = shogi_app.MOVE_DEADLINE, shogi_app.MOVE_HEDGE_AFTER
+    shogi_app.MOVE_DEADLINE, shogi_app.MOVE_HEDGE_AFTER = deadline, hedge_after
+    misses = shogi_app.LLM_DEADLINE_MISSES.value(kind="move")
+    loop = asyncio.new_event_loop()
+    try:
+        with stub_llm(
+            args.latency, args.jitter, args.seed, args.slow_rate, args.slow_latency
+        ) as fake:
+            samples = measure(
+                lambda i: loop.run_until_complete(
+                    shogi_app.generate_ai_move(boards[i % len(boards)], i + 1, "先手")
+                ),
+                args.move_iterations,
+                warmup=0,
+            )
+    finally:
+        loop.close()
+        shogi_app.MOVE_DEADLINE, shogi_app.MOVE_HEDGE_AFTER = original
+    return summarize(
+        samples,
+        latencyMs=args.latency * 1000,
+        slowRate=args.slow_rate,
+        slowLatencyMs=args.slow_latency * 1000,
+        deadlineMs=deadline * 1000,
+        hedgeAfterMs=hedge_after * 1000,
+        llmCalls=fake.completions.calls,
+        deadlineMisses=shogi_app.LLM_DEADLINE_MISSES.value(kind="move") - misses,
+    )
+
+
+def bench_ai_move_no_deadline(args, game_data):
+    # 持ち時間なし: 遅い応答はそのまま1手の時間になる
+    return run_ai_moves(args, game_data, 0.0, 0.0)
+
+
+def bench_ai_move_deadline(args, game_data):
+    # 持ち時間あり: 遅ければ同じ要求をもう1つ送り、それでも間に合わなければ評価最上位の手
+    return run_ai_moves(args, game_data, args.move_deadline, args.hedge_after)
+
+
+def run_concurrent_games(args, make_queue, worker_threads):
+    """args.concurrent_games局を一度に投入し、全て終わるまでの時間と同時に進んだ対局数を計測"""
+
+    async def runner(job):
+        return await shogi_app.generate_ai_game(
+            args.game_plies,
+            game_id=job.game_id,
+            commentary_batch_size=args.batch_size,
+            use_opening_book=False,
+        )
+
+    jobs_queue = make_queue(runner)
+    # レート制限で待たされないようにし、実行方式の違いだけを計測する
+    original_limiter = shogi_app.llm_rate_limiter
+    shogi_app.llm_rate_limiter = RateLimiter(0, 0)
+    peak = 0
+    try:
+        with stub_llm(args.latency, args.jitter, args.seed), quiet():
+            start = time.perf_counter()
+            jobs = [
+                jobs_queue.submit({}, f"bench-{i}")
+                for i in range(args.concurrent_games)
+            ]
+            while any(job.status not in ("done", "failed") for job in jobs):
+                peak = max(peak, jobs_queue.stats()["running"])
+                time.sleep(0.005)
+            elapsed = time.perf_counter() - start
+    finally:
+        shogi_app.llm_rate_limiter = original_limiter
+
+    failed = sum(job.status == "failed" for job in jobs)
+    result = summarize(
+        [job.finished_at - job.started_at for job in jobs],
+        games=len(jobs),
+        failed=failed,
+        plies=args.game_plies,
+        latencyMs=args.latency * 1000,
+        wallSeconds=round(elapsed, 3),
+        workerThreads=worker_threads,
+        peakConcurrentGames=peak,
+        concurrentGamesPerWorker=round(peak / worker_threads, 2),
+    )
+    # 1局あたりの時間ではなく、全体で1秒あたりに生成できた対局数
+    result["opsPerSec"] = round(len(jobs) / elapsed, 2)
+    return result
+
+
+def bench_concurrent_games_threads(args, game_data):
+    # 従来の方式: ワーカースレッドごとにイベントループを作って1局ずつ生成する
+    return run_concurrent_games(
+        args,
+        lambda runner: GameJobQueue(
+            lambda job: shogi_app.run_in_new_loop(runner(job)),
+            workers=args.game_workers,
+            max_queue=args.concurrent_games,
+        ),
+        args.game_workers,
+    )
+
+
+def bench_concurrent_games_shared_loop(args, game_data):
+    # 全ての対局を常駐するイベントループ1つで多重化する
+    return run_concurrent_games(
+        args,
+        lambda runner: AsyncGameJobQueue(
+            runner,
+            EventLoopThread("bench-loop"),
+            concurrent=args.concurrent_games,
+            max_queue=args.concurrent_games,
+        ),
+        1,
+    )
+
+
+# 別プロセスでapp.pyを読み込み、最初のリクエストを処理するまでの時間を計測するスクリプト
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get("/api/board_state/startup/0")
+assert response.status_code == 200, response.status_code
+print(json.dumps({"import": imported - start, "firstRequest": time.perf_counter() - imported}))
+"""
+
+
+def bench_startup(args, game_data):
+    # APIキーを設定した状態で起動し、接続先が応答しなくても起動が待たされないことを確認する
+    import_samples, request_samples = [], []
+    for i in range(args.startup_iterations):
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(
+                os.environ,
+                DATA_DIR=data_dir,
+                OPENAI_API_KEY="sk-benchmark",
+                OPENAI_BASE_URL=args.startup_base_url,
+                LOG_LEVEL="ERROR",
+            )
+            completed = subprocess.run(
+                [sys.executable, "-c", STARTUP_SCRIPT],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        timings = json.loads(completed.stdout.strip().splitlines()[-1])
+        import_samples.append(timings["import"])
+        request_samples.append(timings["firstRequest"])
+    samples = [a + b for a, b in zip(import_samples, request_samples)]
+    return summarize(
+        samples,
+        importMs=round(statistics.median(import_samples) * 1000, 1),
+        firstRequestMs=round(statistics.median(request_samples) * 1000, 1),
+        baseUrl=args.startup_base_url,
+    )
+
+
+BENCHMARKS = [
+    ("startup", bench_startup),
+    ("replay", bench_replay),
+    ("board_to_japanese_string", bench_board_to_japanese_string),
+    ("get_captured_pieces", bench_get_captured_pieces),
+    ("convert_usi_to_japanese", bench_convert_usi_to_japanese),
+    ("legal_moves", bench_legal_moves),
+    ("api_board_state", bench_api_board_state),
+    ("api_board_delta", bench_api_board_delta),
+    ("api_start_game", bench_api_start_game),
+    ("generate_ai_game", bench_generate_ai_game),
+    ("move_candidates", bench_move_candidates),
+    ("ai_move_no_deadline", bench_ai_move_no_deadline),
+    ("ai_move_deadline", bench_ai_move_deadline),
+    ("concurrent_games_threads", bench_concurrent_games_threads),
+    ("concurrent_games_shared_loop", bench_concurrent_games_shared_loop),
+]
+
+
+def run(args):
+    shogi_app.BOARD_BACKEND = args.backend
+    # 解説キャッシュはディスクに書かず、実行ごとに空の状態から始める
+    shogi_app.commentary_cache = CommentaryCache(None)
+    shogi_app.game_store = MemoryGameStore()
+    game_data = random_game(args.plies, args.seed)
+    results = {}
+    for name, func in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        print(f"{name} ...", file=sys.stderr, flush=True)
+        results[name] = func(args, game_data)
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "plies": len(game_data["moves"]),
+            "iterations": args.iterations,
+            "gamePlies": args.game_plies,
+            "gameIterations": args.game_iterations,
+            "latency": args.latency,
+            "commentaryBatchSize": args.batch_size,
+            "concurrentGames": args.concurrent_games,
+            "gameWorkers": args.game_workers,
+            "seed": args.seed,
+        },
+        "benchmarks": results,
+    }
+
+
+def print_table(report, baseline=None):
+    header = f"{'benchmark':<26} {'ops/sec':>12} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10}"
+    if baseline:
+        header += f" {'vs base':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, result in report["benchmarks"].items():
+        line = (
+            f"{name:<26} {result['opsPerSec']:>12.2f} {result['p50Ms']:>10.3f} "
+            f"{result['p90Ms']:>10.3f} {result['p99Ms']:>10.3f}"
+        )
+        base = (baseline or {}).get("benchmarks", {}).get(name)
+        if base and base["opsPerSec"]:
+            line += f" {result['opsPerSec'] / base['opsPerSec']:>8.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.pyのホットパスのベンチマーク")
+    parser.add_argument("--only", action="append", help="実行するベンチマーク名")
+    parser.add_argument("--plies", type=int, default=80, help="再生する棋譜の手数")
+    parser.add_argument("--iterations", type=int, default=200, help="計測回数")
+    parser.add_argument(
+        "--game-plies", type=int, default=20, help="generate_ai_gameの手数"
+    )
+    parser.add_argument(
+        "--game-iterations", type=int, default=3, help="generate_ai_gameの計測回数"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="偽LLMの応答時間（秒）"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="偽LLMの応答時間のばらつき（秒）"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1, help="解説をまとめて生成する手数"
+    )
+    parser.add_argument(
+        "--move-iterations",
+        type=int,
+        default=100,
+        help="ai_move_*でgenerate_ai_moveを呼ぶ回数",
+    )
+    parser.add_argument(
+        "--slow-rate",
+        type=float,
+        default=0.05,
+        help="ai_move_*で偽LLMの応答が遅くなる割合",
+    )
+    parser.add_argument(
+        "--slow-latency",
+        type=float,
+        default=2.0,
+        help="ai_move_*で遅くなった応答の時間（秒）",
+    )
+    parser.add_argument(
+        "--move-deadline",
+        type=float,
+        default=0.3,
+        help="ai_move_deadlineの指し手の持ち時間（秒）",
+    )
+    parser.add_argument(
+        "--hedge-after",
+        type=float,
+        default=0.15,
+        help="ai_move_deadlineで同じ要求をもう1つ送るまでの時間（秒）",
+    )
+    parser.add_argument(
+        "--concurrent-games",
+        type=int,
+        default=32,
+        help="concurrent_games_*で一度に投入する対局数",
+    )
+    parser.add_argument(
+        "--game-workers",
+        type=int,
+        default=shogi_app.GAME_WORKERS,
+        help="concurrent_games_threadsのワーカースレッド数",
+    )
+    parser.add_argument(
+        "--startup-iterations", type=int, default=3, help="startupの計測回数"
+    )
+    parser.add_argument(
+        "--startup-base-url",
+        default="http://127.0.0.1:9/v1",
+        help="startupで設定するOpenAI APIの接続先（応答しない接続先でも計測できる）",
+    )
+    parser.add_argument("--seed", type=int, default=1, help="乱数シード")
+    parser.add_argument(
+        "--backend",
+        choices=("fast", "python-shogi"),
+        default=shogi_app.BOARD_BACKEND,
+        help="盤面の実装",
+    )
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較対象のJSONファイル")
+    parser.add_argument(
+        "--json", action="store_true", help="結果のJSONを標準出力に出す"
+    )
+    args = parser.parse_args()
+
+    names = [name for name, _ in BENCHMARKS]
+    for name in args.only or []:
+        if name not in names:
+            parser.error(f"unknown benchmark: {name} (choose from {', '.join(names)})")
+
+    report = run(args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        baseline = None
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                baseline = json.load(f)
+        print_table(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def position_key(sfen):
+    """SFENから手数を除いた局面のキー（同じ局面なら手数が違っても同じキー）"""
+    return " ".join(sfen.split()[:3])
+
+
+class CommentaryCache:
+    """局面と指し手ごとのAI解説キャッシュ
+
+    キーは (指す前の局面のSFEN（手数を除く）, USIの指し手, プロンプト・モデルのバージョン)。
+    メモリ上のLRUと、プロセス再起動後も残るSQLiteの2段構成で、
+    SQLiteで見つかった解説はメモリにも載せる。
+    ttl秒を過ぎた解説は使わずに破棄し、SQLiteの行数がmax_rowsを超えたら
+    最後に使われたのが古い順に削除する。pathがNoneの場合はメモリのみで動作する。
+    """
+
+    # SQLiteの掃除を行う書き込み回数の間隔
+    PRUNE_INTERVAL = 256
+
+    def __init__(self, path=None, max_entries=4096, ttl=None, max_rows=100000):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.max_rows = max(1, max_rows)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        """SQLiteに接続（初回使用時のみ）"""
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS commentary ("
+                " key TEXT PRIMARY KEY,"
+                " commentary TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS commentary_accessed_at"
+                " ON commentary (accessed_at)"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    @staticmethod
+    def make_key(sfen, move_usi, version):
+        return f"{version}|{position_key(sfen)}|{move_usi}"
+
+    def get(self, sfen, move_usi, version):
+        """キャッシュされた解説を取得（なければNone）"""
+        key = self.make_key(sfen, move_usi, version)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                commentary, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return commentary
+                del self._memory[key]
+                self.evictions += 1
+
+            if self.path is not None:
+                try:
+                    db = self._connect()
+                    row = db.execute(
+                        "SELECT commentary, created_at FROM commentary WHERE key = ?",
+                        (key,),
+                    ).fetchone()
+                    if row is not None:
+                        commentary, created_at = row
+                        if not self._expired(created_at, now):
+                            db.execute(
+                                "UPDATE commentary SET accessed_at = ? WHERE key = ?",
+                                (now, key),
+                            )
+                            db.commit()
+                            self._remember(key, commentary, created_at)
+                            self.disk_hits += 1
+                            return commentary
+                        db.execute("DELETE FROM commentary WHERE key = ?", (key,))
+                        db.commit()
+                        self.evictions += 1
+                except sqlite3.Error as e:
+                    logger.warning("解説キャッシュの読み込みエラー: %s", e)
+
+            self.misses += 1
+            return None
+
+    def put(self, sfen, move_usi, version, commentary):
+        """解説をキャッシュに保存"""
+        key = self.make_key(sfen, move_usi, version)
+        now = time.time()
+        with self._lock:
+            self._remember(key, commentary, now)
+            if self.path is None:
+                return
+            try:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO commentary"
+                    " (key, commentary, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, commentary, now, now),
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_INTERVAL == 0:
+                    self._prune(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning("解説キャッシュの書き込みエラー: %s", e)
+
+    def _remember(self, key, commentary, created_at):
+        """メモリのLRUに追加（上限を超えたら古い順に破棄）"""
+        self._memory[key] = (commentary, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _prune(self, db, now):
+        """期限切れの行と、行数の上限を超えた古い行を削除"""
+        if self.ttl is not None:
+            cursor = db.execute(
+                "DELETE FROM commentary WHERE created_at < ?", (now - self.ttl,)
+            )
+            self.evictions += max(0, cursor.rowcount)
+        (rows,) = db.execute("SELECT COUNT(*) FROM commentary").fetchone()
+        overflow = rows - self.max_rows
+        if overflow > 0:
+            cursor = db.execute(
+                "DELETE FROM commentary WHERE key IN ("
+                " SELECT key FROM commentary ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += max(0, cursor.rowcount)
+
+    def clear(self):
+        """すべての解説を破棄"""
+        with self._lock:
+            self._memory.clear()
+            if self.path is not None:
+                db = self._connect()
+                db.execute("DELETE FROM commentary")
+                db.commit()
+
+    def stats(self):
+        """キャッシュの統計情報を取得"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memoryEntries": len(self._memory),
+                "memoryHits": self.memory_hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+            }
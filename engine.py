@@ -0,0 +1,428 @@
+import random
+import time
+
+import shogi
+
+# 駒の価値（python-shogiの駒種番号で引く）
+PIECE_VALUES = [
+    0,
+    100,
+    300,
+    350,
+    500,
+    550,
+    800,
+    1000,
+    0,
+    550,
+    550,
+    550,
+    550,
+    1050,
+    1250,
+]
+# 持ち駒は打てる自由度がある分だけ少し高く評価する
+HAND_VALUES = [0, 110, 330, 385, 550, 605, 880, 1100]
+
+MATE_SCORE = 100000
+INFINITY = 1000000
+# これより絶対値の大きい評価値は詰みまでの手数を含む
+MATE_BOUND = MATE_SCORE - 1000
+
+# 置換表のエントリ種別
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+# 時間切れの確認間隔（ノード数）
+# 1秒に1万ノード程度なので、数ミリ秒ごとに確認して持ち時間の超過を抑える
+TIME_CHECK_INTERVAL = 32
+
+# 静止探索で読む取り合いの最大手数
+QUIESCENCE_DEPTH = 4
+
+# 候補手の順位付けで王手に与える加点
+CHECK_BONUS = 150
+
+
+def _advance(square, color):
+    """自陣から見た前進度（0〜8）"""
+    rank = shogi.rank_index(square)
+    return 8 - rank if color == shogi.BLACK else rank
+
+
+def _build_piece_square_tables():
+    """駒の位置評価テーブルを作成（[駒種][手番][升]）"""
+    tables = [[[0] * 81 for _ in shogi.COLORS] for _ in range(15)]
+    for color in shogi.COLORS:
+        for square in shogi.SQUARES:
+            advance = _advance(square, color)
+            center = 4 - abs(shogi.file_index(square) - 4)
+            tables[shogi.PAWN][color][square] = advance * 4
+            tables[shogi.LANCE][color][square] = advance * 2
+            tables[shogi.KNIGHT][color][square] = advance * 3 + center * 2
+            tables[shogi.SILVER][color][square] = min(advance, 5) * 5 + center * 2
+            tables[shogi.GOLD][color][square] = min(advance, 3) * 3 + center * 2
+            tables[shogi.BISHOP][color][square] = center * 3
+            tables[shogi.ROOK][color][square] = advance * 2
+            # 玉は自陣の奥・端にいるほど安全
+            tables[shogi.KING][color][square] = -advance * 12 - center * 4
+            for piece_type in range(shogi.PROM_PAWN, shogi.PROM_SILVER + 1):
+                tables[piece_type][color][square] = advance * 4 + center * 2
+            tables[shogi.PROM_BISHOP][color][square] = center * 4
+            tables[shogi.PROM_ROOK][color][square] = advance * 2 + center * 2
+    return tables
+
+
+PIECE_SQUARE_TABLES = _build_piece_square_tables()
+
+
+def evaluate(board):
+    """駒得と駒の位置による静的評価（手番側から見た値）"""
+    score = 0
+    black_mask = board.occupied[shogi.BLACK]
+    pieces = board.pieces
+    for square in shogi.SQUARES:
+        piece_type = pieces[square]
+        if not piece_type:
+            continue
+        if black_mask & (1 << square):
+            score += (
+                PIECE_VALUES[piece_type] + PIECE_SQUARE_TABLES[piece_type][0][square]
+            )
+        else:
+            score -= (
+                PIECE_VALUES[piece_type] + PIECE_SQUARE_TABLES[piece_type][1][square]
+            )
+
+    for piece_type, count in board.pieces_in_hand[shogi.BLACK].items():
+        score += HAND_VALUES[piece_type] * count
+    for piece_type, count in board.pieces_in_hand[shogi.WHITE].items():
+        score -= HAND_VALUES[piece_type] * count
+
+    return score if board.turn == shogi.BLACK else -score
+
+
+class SearchTimeout(Exception):
+    """探索の持ち時間切れ"""
+
+
+class SearchResult:
+    """探索結果"""
+
+    def __init__(self, move, score, depth, nodes, elapsed):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    @property
+    def nodes_per_second(self):
+        return int(self.nodes / self.elapsed) if self.elapsed > 0 else 0
+
+    def __repr__(self):
+        move = self.move.usi() if self.move else None
+        return (
+            f"SearchResult(move={move}, score={self.score}, depth={self.depth}, "
+            f"nodes={self.nodes}, nps={self.nodes_per_second})"
+        )
+
+
+def _score_to_tt(score, ply):
+    """詰みの評価値を探索開始局面からの手数でなく、その局面からの手数に直して置換表に入れる"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score, ply):
+    """置換表の詰みの評価値を、いまの局面の手数（ply）から見た値に戻す"""
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Engine:
+    """反復深化アルファベータ探索による将棋エンジン
+
+    駒得+駒の位置評価、置換表（Zobristハッシュ）、手の並べ替え
+    （置換表の手・MVV-LVA・キラー手）を使い、1手ごとの持ち時間内で最善手を返す。
+    同じ評価の手が複数ある場合はseedに応じてランダムに選ぶ。
+    """
+
+    def __init__(self, tt_size=1 << 18, seed=None):
+        self.tt_size = tt_size
+        self.tt = {}
+        self.rng = random.Random(seed)
+        self.killers = {}
+        self.nodes = 0
+        self._deadline = None
+
+    def search(self, board, time_limit=1.0, max_depth=32):
+        """持ち時間time_limit秒で最善手を探索してSearchResultを返す"""
+        start = time.perf_counter()
+        self._deadline = start + time_limit
+        self.nodes = 0
+        self.killers = {}
+
+        root_moves = self._legal_moves(board)
+        if not root_moves:
+            return SearchResult(None, -MATE_SCORE, 0, 0, time.perf_counter() - start)
+        self.rng.shuffle(root_moves)
+
+        best_move, best_score, completed_depth = root_moves[0], -INFINITY, 0
+        for depth in range(1, max_depth + 1):
+            try:
+                move, score = self._search_root(board, root_moves, depth)
+            except SearchTimeout:
+                break
+            best_move, best_score, completed_depth = move, score, depth
+            # 最善手を次の反復で最初に読む
+            root_moves.remove(move)
+            root_moves.insert(0, move)
+            if abs(score) >= MATE_SCORE - max_depth:
+                break
+
+        return SearchResult(
+            best_move,
+            best_score,
+            completed_depth,
+            self.nodes,
+            time.perf_counter() - start,
+        )
+
+    def _legal_moves(self, board):
+        moves = []
+        for move in board.pseudo_legal_moves:
+            if self._make(board, move):
+                board.pop()
+                moves.append(move)
+        return moves
+
+    def _make(self, board, move):
+        """手を指し、自玉を取られる手・打ち歩詰めなら戻してFalseを返す"""
+        board.push(move)
+        if board.was_suicide() or board.was_check_by_dropping_pawn(move):
+            board.pop()
+            return False
+        return True
+
+    def _check_time(self):
+        self.nodes += 1
+        if (
+            self.nodes % TIME_CHECK_INTERVAL == 0
+            and time.perf_counter() > self._deadline
+        ):
+            raise SearchTimeout()
+
+    def _search_root(self, board, root_moves, depth):
+        alpha, beta = -INFINITY, INFINITY
+        best_move, best_score = root_moves[0], -INFINITY
+        for move in root_moves:
+            board.push(move)
+            try:
+                score = -self._negamax(board, depth - 1, -beta, -alpha, 1)
+            finally:
+                board.pop()
+            if score > best_score:
+                best_move, best_score = move, score
+            alpha = max(alpha, score)
+        self._store(board.zobrist_hash(), depth, best_score, EXACT, best_move)
+        return best_move, best_score
+
+    def _negamax(self, board, depth, alpha, beta, ply):
+        self._check_time()
+
+        key = board.zobrist_hash()
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            entry_depth, entry_score, entry_flag, tt_move = entry
+            entry_score = _score_from_tt(entry_score, ply)
+            if entry_depth >= depth:
+                if entry_flag == EXACT:
+                    return entry_score
+                if entry_flag == LOWER_BOUND:
+                    alpha = max(alpha, entry_score)
+                elif entry_flag == UPPER_BOUND:
+                    beta = min(beta, entry_score)
+                if alpha >= beta:
+                    return entry_score
+
+        if depth <= 0:
+            return self._quiesce(board, alpha, beta, QUIESCENCE_DEPTH)
+
+        original_alpha = alpha
+        best_score, best_move = -INFINITY, None
+        legal = 0
+        for move in self._ordered_moves(board, tt_move, ply):
+            if not self._make(board, move):
+                continue
+            legal += 1
+            try:
+                score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                board.pop()
+
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if board.piece_type_at(move.to_square) == shogi.NONE:
+                    self._add_killer(ply, move)
+                break
+
+        if legal == 0:
+            # 指せる手がない＝詰み（近い詰みほど高く評価）
+            return -MATE_SCORE + ply
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self._store(key, depth, _score_to_tt(best_score, ply), flag, best_move)
+        return best_score
+
+    def _quiesce(self, board, alpha, beta, depth):
+        """駒を取る手だけを読んで局面を落ち着かせる"""
+        self._check_time()
+
+        stand_pat = evaluate(board)
+        if stand_pat >= beta or depth <= 0:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+
+        enemy = board.occupied[board.turn ^ 1]
+        captures = [
+            move
+            for move in board.pseudo_legal_moves
+            if move.from_square is not None and enemy & (1 << move.to_square)
+        ]
+        captures.sort(key=lambda move: self._capture_order(board, move), reverse=True)
+
+        for move in captures:
+            if not self._make(board, move):
+                continue
+            try:
+                score = -self._quiesce(board, -beta, -alpha, depth - 1)
+            finally:
+                board.pop()
+            if score >= beta:
+                return score
+            alpha = max(alpha, score)
+        return alpha
+
+    def _capture_order(self, board, move):
+        """MVV-LVA（価値の高い駒を価値の低い駒で取る手を優先）"""
+        victim = PIECE_VALUES[board.piece_type_at(move.to_square)]
+        attacker = (
+            PIECE_VALUES[board.piece_type_at(move.from_square)]
+            if move.from_square is not None
+            else 0
+        )
+        return victim * 10 - attacker // 10 + (50 if move.promotion else 0)
+
+    def _ordered_moves(self, board, tt_move, ply):
+        killers = self.killers.get(ply, ())
+        scored = []
+        for move in board.pseudo_legal_moves:
+            if move == tt_move:
+                order = 1000000
+            elif board.piece_type_at(move.to_square):
+                order = 100000 + self._capture_order(board, move)
+            elif move in killers:
+                order = 50000
+            elif move.promotion:
+                order = 10000
+            else:
+                order = 0
+            scored.append((order, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for _, move in scored]
+
+    def _add_killer(self, ply, move):
+        killers = self.killers.setdefault(ply, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+
+    def _store(self, key, depth, score, flag, move):
+        if len(self.tt) >= self.tt_size:
+            self.tt.clear()
+        self.tt[key] = (depth, score, flag, move)
+
+
+class RankedMove:
+    """静的評価で順位付けした候補手"""
+
+    __slots__ = ("move", "score", "capture", "check", "mate", "promotion", "hanging")
+
+    def __init__(self, move, score, capture, check, mate, promotion, hanging):
+        self.move = move
+        self.score = score
+        self.capture = capture
+        self.check = check
+        self.mate = mate
+        self.promotion = promotion
+        self.hanging = hanging
+
+    def __repr__(self):
+        return f"<RankedMove {self.move.usi()} score={self.score}>"
+
+
+def _exchange_loss(board, square, color):
+    """colorの駒がいるsquareを相手に取られた場合に失う駒の価値の見積もり（取られなければ0）"""
+    enemy = color ^ 1
+    if not board.is_attacked_by(enemy, square):
+        return 0
+    value = PIECE_VALUES[board.piece_type_at(square)]
+    if not board.is_attacked_by(color, square):
+        return value
+    # 紐が付いていれば、一番安い駒で取り返した場合の差だけ損をする（玉では取れない）
+    attackers = [
+        PIECE_VALUES[board.piece_type_at(attacker)]
+        for attacker in board.attackers(enemy, square)
+        if board.piece_type_at(attacker) != shogi.KING
+    ]
+    return max(0, value - min(attackers)) if attackers else 0
+
+
+def rank_moves(board, limit=None):
+    """全ての合法手を1手指した後の静的評価（駒得・駒の位置・王手・駒取り・浮き駒）で
+    順位付けし、評価の高い順にRankedMoveのリストを返す（limitで上位だけに絞る）
+
+    探索はしないので全合法手でも数ミリ秒で済み、LLMに渡す候補手の絞り込みに使う。
+    """
+    color = board.turn
+    ranked = []
+    for move in board.legal_moves:
+        capture = not move.drop_piece_type and bool(board.piece_type_at(move.to_square))
+        board.push(move)
+        try:
+            score = -evaluate(board)
+            check = board.is_check()
+            mate = check and board.is_checkmate()
+            loss = _exchange_loss(board, move.to_square, color)
+            if mate:
+                score = MATE_SCORE
+            elif check:
+                score += CHECK_BONUS
+            score -= loss
+        finally:
+            board.pop()
+        ranked.append(
+            RankedMove(move, score, capture, check, mate, move.promotion, loss > 0)
+        )
+    ranked.sort(key=lambda item: item.score, reverse=True)
+    return ranked[:limit] if limit else ranked
+
+
+def best_move(board, time_limit=1.0, seed=None):
+    """盤面に対する最善手を返す（合法手がない場合はNone）"""
+    return Engine(seed=seed).search(board, time_limit).move
@@ -0,0 +1,297 @@
+"""負荷試験用のOpenAI互換の偽サーバー（APIを呼ばずに対局生成を試せる）
+
+/v1/chat/completions と /v1/models だけを実装する。
+指し手の要求には合法手を返し（候補手の一覧があればその中から、なければプロンプトに
+SFENがあればその局面の合法手、なければプロンプトに並んだ手から選ぶ）、
+解説の要求には定型文を返す。
+応答時間の分布と、エラー（500）・レート制限（429）の発生率、
+指し手の要求に不正な手（"9a9z"）を返す割合を指定できる。
+
+使い方:
+    python fake_openai.py --port 8081 --latency 0.3 --jitter 0.1 --rate-limit-rate 0.05
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:8081/v1 python app.py
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fastboard import Position
+
+USI_PATTERN = re.compile(r"\b(?:[1-9][a-i][1-9][a-i]\+?|[PLNSGBR]\*[1-9][a-i])\b")
+SFEN_PATTERN = re.compile(
+    r"[lnsgkrbpLNSGKRBP+1-9]+(?:/[lnsgkrbpLNSGKRBP+1-9]+){8} [bw] (?:-|[0-9RBGSNLPrbgsnlp]+)(?: \d+)?"
+)
+MOVE_NUMBER_PATTERN = re.compile(r"手数: (\d+)手目")
+COMMENTARY_TEXT = "駒の働きを高める手で、相手の出方を見ながら陣形を整えている。"
+
+
+def legal_candidates(prompt):
+    """プロンプトから選んでよい手を取り出す（候補手の一覧、SFENの局面の合法手の順に探す）"""
+    if "候補手" in prompt:
+        # 「候補手」の行より後に1行1手で並んだ手
+        listed = USI_PATTERN.findall(prompt.split("候補手", 1)[1])
+        if listed:
+            return listed
+    match = SFEN_PATTERN.search(prompt)
+    if match:
+        try:
+            return [move.usi() for move in Position(match.group(0)).legal_moves]
+        except Exception:
+            pass
+    # 手を含む最初の行（合法手の一覧）から選ぶ。「例：7g7f」などの行は使わない
+    return next(
+        (
+            USI_PATTERN.findall(line)
+            for line in prompt.splitlines()
+            if USI_PATTERN.search(line)
+        ),
+        [],
+    )
+
+
+def last_prompt(messages):
+    return messages[-1]["content"] if messages else ""
+
+
+def is_move_prompt(prompt):
+    """指し手の要求か（合法手・候補手の一覧を含むプロンプト）"""
+    return "合法手" in prompt or "候補手" in prompt
+
+
+def answer(messages, response_format=None, rng=random):
+    """chat completionの要求に対する応答の本文を作成"""
+    prompt = last_prompt(messages)
+    candidates = legal_candidates(prompt)
+    if is_move_prompt(prompt) and candidates:
+        return rng.choice(candidates)
+    if response_format:
+        # まとめて解説する要求には手数ごとの解説をJSONで返す
+        return json.dumps(
+            {
+                "commentaries": [
+                    {"moveNumber": int(number), "commentary": COMMENTARY_TEXT}
+                    for number in MOVE_NUMBER_PATTERN.findall(prompt)
+                ]
+            },
+            ensure_ascii=False,
+        )
+    return COMMENTARY_TEXT
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """応答時間の分布とエラーの発生率を持つ偽サーバー"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency=0.2,
+        jitter=0.0,
+        distribution="normal",
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        illegal_rate=0.0,
+        retry_after=1.0,
+        seed=None,
+    ):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.illegal_rate = illegal_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0, "rateLimited": 0, "illegal": 0}
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def draw(self):
+        """(応答時間, 結果) を抽選する（結果はok・error・rate_limited・illegal）"""
+        with self._lock:
+            if self.distribution == "fixed":
+                delay = self.latency
+            elif self.distribution == "exponential":
+                delay = self.rng.expovariate(1 / self.latency) if self.latency else 0.0
+            elif self.distribution == "lognormal" and self.latency:
+                # 平均がlatency、標準偏差がjitterになる対数正規分布
+                sigma2 = math.log1p((self.jitter / self.latency) ** 2)
+                mu = math.log(self.latency) - sigma2 / 2
+                delay = self.rng.lognormvariate(mu, sigma2**0.5)
+            else:
+                delay = self.rng.gauss(self.latency, self.jitter)
+            roll = self.rng.random()
+        outcome = "ok"
+        if roll < self.rate_limit_rate:
+            outcome = "rate_limited"
+        elif roll < self.rate_limit_rate + self.error_rate:
+            outcome = "error"
+        elif roll < self.rate_limit_rate + self.error_rate + self.illegal_rate:
+            outcome = "illegal"
+        return max(0.0, delay), outcome
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {"id": "gpt-4o-mini", "object": "model", "owned_by": "fake"}
+                    ],
+                },
+            )
+        elif self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, dict(self.server.counts))
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        server = self.server
+        server.count("requests")
+        delay, outcome = server.draw()
+        time.sleep(delay)
+
+        if outcome == "rate_limited":
+            server.count("rateLimited")
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                {
+                    "retry-after-ms": str(int(server.retry_after * 1000)),
+                    "x-ratelimit-remaining-requests": "0",
+                    "x-ratelimit-reset-requests": f"{server.retry_after}s",
+                },
+            )
+            return
+        if outcome == "error":
+            server.count("errors")
+            self.send_json(500, {"error": {"message": "injected server error"}})
+            return
+
+        messages = request.get("messages") or []
+        # 不正な手は指し手の要求にだけ返す（解説の要求は通常どおり答える）
+        if outcome == "illegal" and is_move_prompt(last_prompt(messages)):
+            server.count("illegal")
+            content = "9a9z"
+        else:
+            with server._lock:
+                content = answer(messages, request.get("response_format"), server.rng)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages)
+        completion_tokens = len(content)
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-4o-mini"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI互換の偽サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.2, help="平均応答時間（秒）")
+    parser.add_argument(
+        "--jitter", type=float, default=0.05, help="応答時間の標準偏差（秒）"
+    )
+    parser.add_argument(
+        "--distribution",
+        choices=("fixed", "normal", "lognormal", "exponential"),
+        default="normal",
+        help="応答時間の分布",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500を返す割合")
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=0.0, help="429を返す割合"
+    )
+    parser.add_argument(
+        "--illegal-rate",
+        type=float,
+        default=0.0,
+        help="指し手の要求に不正な手を返す割合",
+    )
+    parser.add_argument(
+        "--retry-after", type=float, default=1.0, help="429で指示する待機秒数"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        distribution=args.distribution,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        illegal_rate=args.illegal_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    print(f"偽のOpenAIサーバーを起動しました: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,621 @@
+import collections
+import random
+
+import shogi
+
+# 升の番号はpython-shogiと同じ（0 = 9a, 80 = 1i）
+RANKS = [square // 9 for square in shogi.SQUARES]
+FILES = [square % 9 for square in shogi.SQUARES]
+
+# 駒コード = 駒種 | 手番 << 4（0は空き升）
+PIECE_CODES = [pt | (color << 4) for color in shogi.COLORS for pt in shogi.PIECE_TYPES]
+
+PROMOTE = [0] * 15
+UNPROMOTE = list(range(15))
+for _piece_type, _promoted in enumerate(shogi.PIECE_PROMOTED):
+    if _promoted:
+        PROMOTE[_piece_type] = _promoted
+        UNPROMOTE[_promoted] = _piece_type
+
+PROMOTABLE = {
+    shogi.PAWN,
+    shogi.LANCE,
+    shogi.KNIGHT,
+    shogi.SILVER,
+    shogi.BISHOP,
+    shogi.ROOK,
+}
+HAND_PIECE_TYPES = range(shogi.PAWN, shogi.KING)
+
+# 方向（段の増分, 筋番号の増分）。先手の前方は段が減る方向
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+UP, DOWN = 0, 1
+ORTHOGONAL = [0, 1, 2, 3]
+DIAGONAL = [4, 5, 6, 7]
+OPPOSITE = [1, 0, 3, 2, 7, 6, 5, 4]
+
+# 先手から見た各駒の1マスの利き（後手は段の増分を反転）
+_GOLD_STEPS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, 0)]
+_STEP_DELTAS = {
+    shogi.PAWN: [(-1, 0)],
+    shogi.KNIGHT: [(-2, -1), (-2, 1)],
+    shogi.SILVER: [(-1, -1), (-1, 0), (-1, 1), (1, -1), (1, 1)],
+    shogi.GOLD: _GOLD_STEPS,
+    shogi.KING: DIRECTIONS,
+    shogi.PROM_PAWN: _GOLD_STEPS,
+    shogi.PROM_LANCE: _GOLD_STEPS,
+    shogi.PROM_KNIGHT: _GOLD_STEPS,
+    shogi.PROM_SILVER: _GOLD_STEPS,
+    shogi.PROM_BISHOP: [DIRECTIONS[d] for d in ORTHOGONAL],
+    shogi.PROM_ROOK: [DIRECTIONS[d] for d in DIAGONAL],
+}
+_SLIDE_DIRECTIONS = {
+    shogi.BISHOP: DIAGONAL,
+    shogi.ROOK: ORTHOGONAL,
+    shogi.PROM_BISHOP: DIAGONAL,
+    shogi.PROM_ROOK: ORTHOGONAL,
+}
+
+
+def _square(rank, file):
+    if 0 <= rank < 9 and 0 <= file < 9:
+        return rank * 9 + file
+    return None
+
+
+def _build_tables():
+    rays = [
+        [
+            [
+                s
+                for s in (
+                    _square(RANKS[sq] + dr * i, FILES[sq] + df * i) for i in range(1, 9)
+                )
+                if s is not None
+            ]
+            for dr, df in DIRECTIONS
+        ]
+        for sq in shogi.SQUARES
+    ]
+
+    steps = [[[] for _ in shogi.SQUARES] for _ in range(32)]
+    slides = [[] for _ in range(32)]
+    for color in shogi.COLORS:
+        sign = 1 if color == shogi.BLACK else -1
+        for piece_type in shogi.PIECE_TYPES:
+            code = piece_type | (color << 4)
+            for sq in shogi.SQUARES:
+                for dr, df in _STEP_DELTAS.get(piece_type, []):
+                    s = _square(RANKS[sq] + dr * sign, FILES[sq] + df)
+                    if s is not None:
+                        steps[code][sq].append(s)
+            if piece_type == shogi.LANCE:
+                slides[code] = [UP if color == shogi.BLACK else DOWN]
+            else:
+                slides[code] = list(_SLIDE_DIRECTIONS.get(piece_type, []))
+
+    # ある升に1マスの利きを持つ駒の位置と駒コード（手番別）
+    step_attackers = [[[] for _ in shogi.SQUARES] for _ in shogi.COLORS]
+    for color in shogi.COLORS:
+        for sq in shogi.SQUARES:
+            by_square = collections.defaultdict(set)
+            for piece_type in shogi.PIECE_TYPES:
+                code = piece_type | (color << 4)
+                for frm in shogi.SQUARES:
+                    if sq in steps[code][frm]:
+                        by_square[frm].add(code)
+            step_attackers[color][sq] = [
+                (frm, frozenset(codes)) for frm, codes in by_square.items()
+            ]
+
+    # 方向dに進んで最初に当たった駒が、逆方向に走る利きを持つかどうか（手番別）
+    slide_attackers = [[set() for _ in DIRECTIONS] for _ in shogi.COLORS]
+    for color in shogi.COLORS:
+        for piece_type in shogi.PIECE_TYPES:
+            code = piece_type | (color << 4)
+            for d in slides[code]:
+                slide_attackers[color][OPPOSITE[d]].add(code)
+
+    return rays, steps, slides, step_attackers, slide_attackers
+
+
+RAYS, STEPS, SLIDES, STEP_ATTACKERS, SLIDE_ATTACKERS = _build_tables()
+
+# Zobristハッシュ用の乱数（再現性のため固定シード）
+_zobrist_random = random.Random(0x5A0B)
+ZOBRIST_PIECES = [
+    [_zobrist_random.getrandbits(64) for _ in shogi.SQUARES] for _ in range(32)
+]
+ZOBRIST_HANDS = [
+    [[_zobrist_random.getrandbits(64) for _ in range(19)] for _ in range(8)]
+    for _ in shogi.COLORS
+]
+ZOBRIST_WHITE_TO_MOVE = _zobrist_random.getrandbits(64)
+
+# 駒オブジェクトはpiece_atで毎回作らずに共有する
+_PIECES = [None] * 32
+for _code in PIECE_CODES:
+    _PIECES[_code] = shogi.Piece(_code & 15, _code >> 4)
+
+
+def encode_move(move):
+    """shogi.Moveを16ビットの手コードに変換
+
+    下位7ビットが移動先、次の7ビットが移動元（駒打ちは81+駒種）、
+    最上位ビットが成り。python-shogiのMove.__hash__と同じ値になる。
+    """
+    if move.drop_piece_type:
+        return move.to_square | (81 + move.drop_piece_type) << 7
+    return move.to_square | move.from_square << 7 | int(move.promotion) << 14
+
+
+def decode_move(code):
+    """16ビットの手コードをshogi.Moveに変換"""
+    to_square = code & 127
+    from_code = (code >> 7) & 127
+    if from_code >= 81:
+        return shogi.Move(None, to_square, False, from_code - 81)
+    return shogi.Move(from_code, to_square, bool(code >> 14))
+
+
+def usi_to_code(usi):
+    """USI記法の指し手を手コードに変換"""
+    return encode_move(shogi.Move.from_usi(usi))
+
+
+def code_to_usi(code):
+    """手コードをUSI記法に変換"""
+    return decode_move(code).usi()
+
+
+class Position:
+    """配列ベースの高速な局面クラス
+
+    python-shogiのBoardのうち、盤面表示・棋譜再生・合法手生成で使う部分
+    （piece_at, pieces_in_hand, turn, push/push_usi/pop, legal_moves, sfen,
+    is_check, is_game_over など）と互換のインターフェースを持つ。
+    内部では駒コードの配列と16ビットの手コードで処理する。
+    合法手の判定（打ち歩詰めの扱いを含む）はpython-shogiに合わせている。
+    """
+
+    def __init__(self, sfen=None):
+        if sfen is None:
+            sfen = shogi.STARTING_SFEN
+        self.set_sfen(sfen)
+
+    # ---- 局面の設定・出力 ----
+
+    def set_sfen(self, sfen):
+        """SFENから局面を設定"""
+        parts = sfen.split()
+        if len(parts) != 4:
+            raise ValueError(f"sfen string should consist of 4 parts: {sfen!r}")
+
+        board = [0] * 81
+        rows = parts[0].split("/")
+        if len(rows) != 9:
+            raise ValueError(f"invalid board part in sfen: {sfen!r}")
+        for rank, row in enumerate(rows):
+            file = 0
+            promoted = False
+            for char in row:
+                if char.isdigit():
+                    file += int(char)
+                elif char == "+":
+                    promoted = True
+                else:
+                    piece = shogi.Piece.from_symbol(("+" if promoted else "") + char)
+                    board[rank * 9 + file] = piece.piece_type | (piece.color << 4)
+                    promoted = False
+                    file += 1
+            if file != 9:
+                raise ValueError(f"invalid board part in sfen: {sfen!r}")
+
+        hands = [[0] * 15, [0] * 15]
+        if parts[2] != "-":
+            count = ""
+            for char in parts[2]:
+                if char.isdigit():
+                    count += char
+                else:
+                    piece = shogi.Piece.from_symbol(char)
+                    hands[piece.color][piece.piece_type] += int(count) if count else 1
+                    count = ""
+
+        self.board = board
+        self.hands = hands
+        self.turn = shogi.WHITE if parts[1] == "w" else shogi.BLACK
+        self.move_number = int(parts[3])
+        self.king_squares = [None, None]
+        for square, code in enumerate(board):
+            if code & 15 == shogi.KING:
+                self.king_squares[code >> 4] = square
+        self.move_stack = []
+        self._undo_stack = []
+        self.hash = self._compute_hash()
+        self.transpositions = collections.Counter((self.hash,))
+
+    def sfen(self):
+        """SFEN文字列を取得（python-shogiと同じ書式）"""
+        rows = []
+        for rank in range(9):
+            row = []
+            empty = 0
+            for code in self.board[rank * 9 : rank * 9 + 9]:
+                if not code:
+                    empty += 1
+                    continue
+                if empty:
+                    row.append(str(empty))
+                    empty = 0
+                row.append(_PIECES[code].symbol())
+            if empty:
+                row.append(str(empty))
+            rows.append("".join(row))
+
+        hand = []
+        for color in shogi.COLORS:
+            for piece_type in range(shogi.ROOK, shogi.NONE, -1):
+                count = self.hands[color][piece_type]
+                if count:
+                    if count > 1:
+                        hand.append(str(count))
+                    hand.append(_PIECES[piece_type | (color << 4)].symbol())
+
+        return "{0} {1} {2} {3}".format(
+            "/".join(rows),
+            "w" if self.turn == shogi.WHITE else "b",
+            "".join(hand) or "-",
+            self.move_number,
+        )
+
+    def copy(self):
+        """履歴を含まない局面の複製"""
+        return Position(self.sfen())
+
+    def _compute_hash(self):
+        h = ZOBRIST_WHITE_TO_MOVE if self.turn == shogi.WHITE else 0
+        for square, code in enumerate(self.board):
+            if code:
+                h ^= ZOBRIST_PIECES[code][square]
+        for color in shogi.COLORS:
+            for piece_type in HAND_PIECE_TYPES:
+                h ^= ZOBRIST_HANDS[color][piece_type][self.hands[color][piece_type]]
+        return h
+
+    def zobrist_hash(self):
+        return self.hash
+
+    # ---- python-shogi互換のアクセサ ----
+
+    def piece_at(self, square):
+        return _PIECES[self.board[square]]
+
+    def piece_type_at(self, square):
+        return self.board[square] & 15
+
+    @property
+    def pieces_in_hand(self):
+        return self.hands
+
+    @property
+    def legal_moves(self):
+        return [decode_move(code) for code in self.legal_move_codes()]
+
+    @property
+    def pseudo_legal_moves(self):
+        return [decode_move(code) for code in self.pseudo_legal_move_codes()]
+
+    # ---- 利きの判定 ----
+
+    def is_attacked_by(self, color, square):
+        """squareがcolorの駒に利かされているか"""
+        if square is None:
+            return False
+        board = self.board
+        for frm, codes in STEP_ATTACKERS[color][square]:
+            if board[frm] in codes:
+                return True
+        slide_attackers = SLIDE_ATTACKERS[color]
+        for d, ray in enumerate(RAYS[square]):
+            for s in ray:
+                code = board[s]
+                if code:
+                    if code in slide_attackers[d]:
+                        return True
+                    break
+        return False
+
+    def is_check(self):
+        return self.is_attacked_by(self.turn ^ 1, self.king_squares[self.turn])
+
+    # ---- 指し手生成 ----
+
+    def pseudo_legal_move_codes(self):
+        """疑似合法手（自玉の安全を考慮しない手）の手コードを生成"""
+        color = self.turn
+        board = self.board
+        moves = []
+        append = moves.append
+        black = color == shogi.BLACK
+
+        for frm in shogi.SQUARES:
+            code = board[frm]
+            if not code or code >> 4 != color:
+                continue
+            piece_type = code & 15
+            promotable = piece_type in PROMOTABLE
+            from_zone = RANKS[frm] <= 2 if black else RANKS[frm] >= 6
+            targets = [
+                to
+                for to in STEPS[code][frm]
+                if not board[to] or board[to] >> 4 != color
+            ]
+            for d in SLIDES[code]:
+                for to in RAYS[frm][d]:
+                    target = board[to]
+                    if target:
+                        if target >> 4 != color:
+                            targets.append(to)
+                        break
+                    targets.append(to)
+
+            base = frm << 7
+            for to in targets:
+                rank = RANKS[to]
+                if promotable:
+                    if black:
+                        must = (piece_type <= shogi.LANCE and rank == 0) or (
+                            piece_type == shogi.KNIGHT and rank <= 1
+                        )
+                        zone = from_zone or rank <= 2
+                    else:
+                        must = (piece_type <= shogi.LANCE and rank == 8) or (
+                            piece_type == shogi.KNIGHT and rank >= 7
+                        )
+                        zone = from_zone or rank >= 6
+                    if not must:
+                        append(to | base)
+                    if zone:
+                        append(to | base | 0x4000)
+                else:
+                    append(to | base)
+
+        # 持ち駒を打つ手
+        hand = self.hands[color]
+        droppable = [pt for pt in HAND_PIECE_TYPES if hand[pt]]
+        if droppable:
+            pawn_files = set()
+            if hand[shogi.PAWN]:
+                own_pawn = shogi.PAWN | (color << 4)
+                pawn_files = {FILES[s] for s in shogi.SQUARES if board[s] == own_pawn}
+            for to in shogi.SQUARES:
+                if board[to]:
+                    continue
+                rank = RANKS[to]
+                last = rank == 0 if black else rank == 8
+                last_two = rank <= 1 if black else rank >= 7
+                for piece_type in droppable:
+                    if piece_type == shogi.PAWN:
+                        if last or FILES[to] in pawn_files:
+                            continue
+                    elif piece_type == shogi.LANCE:
+                        if last:
+                            continue
+                    elif piece_type == shogi.KNIGHT:
+                        if last_two:
+                            continue
+                    append(to | (81 + piece_type) << 7)
+        return moves
+
+    def legal_move_codes(self):
+        """合法手の手コードを生成"""
+        legal = []
+        for code in self.pseudo_legal_move_codes():
+            self.push_code(code)
+            if not self._was_illegal(code):
+                legal.append(code)
+            self.pop_code()
+        return legal
+
+    def _was_illegal(self, code):
+        """直前の手が自玉を取られる手か打ち歩詰めか"""
+        mover = self.turn ^ 1
+        if self.is_attacked_by(self.turn, self.king_squares[mover]):
+            return True
+        if (code >> 7) & 127 == 81 + shogi.PAWN:
+            return self._was_check_by_dropping_pawn(code & 127)
+        return False
+
+    def _was_check_by_dropping_pawn(self, pawn_square):
+        # python-shogiのwas_check_by_dropping_pawnと同じ判定（玉を元の升に置いたまま逃げ道を調べる）
+        color = self.turn
+        king_square = self.king_squares[color]
+        if king_square is None:
+            return False
+        if king_square not in STEPS[shogi.PAWN | ((color ^ 1) << 4)][pawn_square]:
+            return False
+
+        board = self.board
+        king_code = shogi.KING | (color << 4)
+        for to in STEPS[king_code][king_square]:
+            target = board[to]
+            if target and target >> 4 == color:
+                continue
+            if not self.is_attacked_by(color ^ 1, to):
+                return False
+
+        # 玉以外の駒で打った歩を取れるか（玉の升は相手の駒で塞いで玉自身の利きだけを除く）
+        board[king_square] = shogi.KING | ((color ^ 1) << 4)
+        try:
+            if self.is_attacked_by(color, pawn_square):
+                return False
+        finally:
+            board[king_square] = king_code
+        return True
+
+    # ---- 指す・戻す ----
+
+    def push_code(self, code):
+        """手コードで指す（合法性は検証しない）"""
+        board = self.board
+        color = self.turn
+        to = code & 127
+        frm = (code >> 7) & 127
+        h = self.hash
+        captured = board[to]
+
+        if frm >= 81:
+            piece_type = frm - 81
+            hand = self.hands[color]
+            h ^= ZOBRIST_HANDS[color][piece_type][hand[piece_type]]
+            hand[piece_type] -= 1
+            h ^= ZOBRIST_HANDS[color][piece_type][hand[piece_type]]
+            moved = piece_type | (color << 4)
+        else:
+            piece = board[frm]
+            board[frm] = 0
+            h ^= ZOBRIST_PIECES[piece][frm]
+            moved = PROMOTE[piece & 15] | (color << 4) if code & 0x4000 else piece
+            if captured:
+                h ^= ZOBRIST_PIECES[captured][to]
+                if captured & 15 == shogi.KING:
+                    self.king_squares[color ^ 1] = None
+                captured_type = UNPROMOTE[captured & 15]
+                hand = self.hands[color]
+                h ^= ZOBRIST_HANDS[color][captured_type][hand[captured_type]]
+                hand[captured_type] += 1
+                h ^= ZOBRIST_HANDS[color][captured_type][hand[captured_type]]
+            if moved & 15 == shogi.KING:
+                self.king_squares[color] = to
+
+        board[to] = moved
+        h ^= ZOBRIST_PIECES[moved][to] ^ ZOBRIST_WHITE_TO_MOVE
+
+        self._undo_stack.append((code, captured, self.hash))
+        self.hash = h
+        self.turn = color ^ 1
+        self.move_number += 1
+        self.transpositions[h] += 1
+
+    def pop_code(self):
+        """直前の手を戻して手コードを返す"""
+        code, captured, previous_hash = self._undo_stack.pop()
+        self.transpositions[self.hash] -= 1
+        board = self.board
+        color = self.turn ^ 1
+        to = code & 127
+        frm = (code >> 7) & 127
+        moved = board[to]
+
+        if frm >= 81:
+            self.hands[color][frm - 81] += 1
+        else:
+            piece = UNPROMOTE[moved & 15] | (color << 4) if code & 0x4000 else moved
+            board[frm] = piece
+            if piece & 15 == shogi.KING:
+                self.king_squares[color] = frm
+            if captured:
+                self.hands[color][UNPROMOTE[captured & 15]] -= 1
+                if captured & 15 == shogi.KING:
+                    self.king_squares[color ^ 1] = to
+
+        board[to] = captured
+        self.hash = previous_hash
+        self.turn = color
+        self.move_number -= 1
+        return code
+
+    def push(self, move):
+        """shogi.Moveまたは手コードで指す
+
+        動かす駒・持ち駒・移動先の升の最低限の整合性だけを確認し、
+        崩れた棋譜で局面が壊れる前にValueErrorを送出する。
+        """
+        code = move if isinstance(move, int) else encode_move(move)
+        to = code & 127
+        frm = (code >> 7) & 127
+        target = self.board[to]
+        if frm >= 81:
+            if target or not self.hands[self.turn][frm - 81]:
+                raise ValueError(f"illegal drop: {code_to_usi(code)}")
+        else:
+            piece = self.board[frm]
+            if not piece or piece >> 4 != self.turn:
+                raise ValueError(f"no piece to move: {code_to_usi(code)}")
+            if target and target >> 4 == self.turn:
+                raise ValueError(f"cannot capture own piece: {code_to_usi(code)}")
+            if code & 0x4000 and not PROMOTE[piece & 15]:
+                raise ValueError(f"piece cannot promote: {code_to_usi(code)}")
+        self.push_code(code)
+        self.move_stack.append(code)
+
+    def push_usi(self, usi):
+        """USI記法の手を指してshogi.Moveを返す"""
+        move = shogi.Move.from_usi(usi)
+        self.push(move)
+        return move
+
+    def pop(self):
+        """直前の手を戻してshogi.Moveを返す"""
+        self.move_stack.pop()
+        return decode_move(self.pop_code())
+
+    def peek(self):
+        return decode_move(self.move_stack[-1])
+
+    # ---- 終局判定 ----
+
+    def is_fourfold_repetition(self):
+        return self.transpositions[self.hash] >= 4
+
+    def has_legal_move(self):
+        for code in self.pseudo_legal_move_codes():
+            self.push_code(code)
+            illegal = self._was_illegal(code)
+            self.pop_code()
+            if not illegal:
+                return True
+        return False
+
+    def is_checkmate(self):
+        return self.is_check() and not self.has_legal_move()
+
+    def is_stalemate(self):
+        return not self.is_check() and not self.has_legal_move()
+
+    def is_game_over(self):
+        return not self.has_legal_move() or self.is_fourfold_repetition()
+
+    def __repr__(self):
+        return f"Position('{self.sfen()}')"
+
+    def __str__(self):
+        lines = []
+        for rank in range(9):
+            cells = []
+            for code in self.board[rank * 9 : rank * 9 + 9]:
+                if not code:
+                    cells.append(" .")
+                else:
+                    piece = _PIECES[code]
+                    cells.append(
+                        piece.symbol() if piece.is_promoted() else " " + piece.symbol()
+                    )
+            lines.append(" ".join(cells))
+        return "\n".join(lines)
+
+
+def perft(position, depth):
+    """指定した深さまでの合法手の総数（指し手生成の検証用）"""
+    if depth == 0:
+        return 1
+    codes = position.legal_move_codes()
+    if depth == 1:
+        return len(codes)
+    total = 0
+    for code in codes:
+        position.push_code(code)
+        total += perft(position, depth - 1)
+        position.pop_code()
+    return total
@@ -0,0 +1,119 @@
+import threading
+import time
+
+
+class GameChannel:
+    """1対局分のイベントログ（購読者は各自の読み出し位置だけを持つ）"""
+
+    def __init__(self):
+        self.events = []
+        self.closed = False
+        self.closed_at = None
+        self.condition = threading.Condition()
+
+
+class GameHub:
+    """対局イベントのプロセス内pub/subハブ
+
+    イベントは対局ごとのログに一度だけ追記され、全購読者がそのログを共有する。
+    購読者ごとのキューや再計算は持たないため、途中から接続した観戦者も
+    ログの先頭から読むだけで追いつける。
+    """
+
+    def __init__(self, retention=300, max_channels=1000):
+        self.retention = retention
+        self.max_channels = max(1, max_channels)
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def open(self, game_id):
+        """対局のチャンネルを作成（既にあればそれを返す）"""
+        with self._lock:
+            self._prune()
+            channel = self._channels.get(game_id)
+            if channel is None:
+                channel = GameChannel()
+                self._channels[game_id] = channel
+            return channel
+
+    def discard(self, game_id):
+        """チャンネルを破棄"""
+        with self._lock:
+            self._channels.pop(game_id, None)
+
+    def get(self, game_id):
+        """対局のチャンネルを取得（存在しない場合はNone）"""
+        with self._lock:
+            return self._channels.get(game_id)
+
+    def publish(self, game_id, event, data):
+        """イベントをログに追記して購読者を起こす"""
+        channel = self.get(game_id)
+        if channel is None:
+            return
+        with channel.condition:
+            if channel.closed:
+                return
+            channel.events.append((event, data))
+            channel.condition.notify_all()
+
+    def close(self, game_id, event=None, data=None):
+        """最後のイベントを追記してチャンネルを閉じる"""
+        channel = self.get(game_id)
+        if channel is None:
+            return
+        with channel.condition:
+            if channel.closed:
+                return
+            if event is not None:
+                channel.events.append((event, data))
+            channel.closed = True
+            channel.closed_at = time.time()
+            channel.condition.notify_all()
+
+    def subscribe(self, game_id, start=0, heartbeat=15):
+        """start番目以降のイベントを (番号, イベント名, データ) で順に返すジェネレータ
+
+        heartbeat秒間イベントがなければNoneを返す（接続維持用）。
+        チャンネルが閉じられ、全イベントを返し終えたら終了する。
+        """
+        channel = self.get(game_id)
+        if channel is None:
+            return
+        index = max(0, start)
+        while True:
+            with channel.condition:
+                if index >= len(channel.events) and not channel.closed:
+                    channel.condition.wait(heartbeat)
+                events = channel.events[index:]
+                closed = channel.closed
+
+            if not events:
+                if closed:
+                    return
+                yield None
+                continue
+
+            for event, data in events:
+                yield index, event, data
+                index += 1
+
+    def stats(self):
+        """ハブの状態を取得"""
+        with self._lock:
+            return {
+                "channels": len(self._channels),
+                "open": sum(1 for c in self._channels.values() if not c.closed),
+            }
+
+    def _prune(self):
+        """保持期間を過ぎた、または上限を超えた終了済みチャンネルを破棄"""
+        now = time.time()
+        closed = sorted(
+            (c.closed_at, game_id) for game_id, c in self._channels.items() if c.closed
+        )
+        overflow = len(self._channels) - self.max_channels + 1
+        for closed_at, game_id in closed:
+            if now - closed_at > self.retention or overflow > 0:
+                del self._channels[game_id]
+                overflow -= 1
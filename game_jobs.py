@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """ジョブキューが満杯の場合の例外"""
+
+
+class GameJob:
+    """対局生成ジョブ（進捗と途中経過の指し手を保持）"""
+
+    def __init__(self, params, game_id):
+        self.job_id = uuid.uuid4().hex
+        self.game_id = game_id
+        self.params = params
+        self.status = "queued"
+        self.moves = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def record_event(self, event, move_record):
+        """generate_ai_gameからの進捗通知を記録"""
+        with self._lock:
+            if event == "move":
+                self.moves.append(move_record)
+
+    def to_dict(self):
+        """APIレスポンス用の辞書に変換"""
+        with self._lock:
+            return {
+                "jobId": self.job_id,
+                "gameId": self.game_id,
+                "status": self.status,
+                "maxMoves": self.params.get("maxMoves"),
+                "pliesCompleted": len(self.moves),
+                "moves": [dict(move) for move in self.moves],
+                "error": self.error,
+                "createdAt": self.created_at,
+                "startedAt": self.started_at,
+                "finishedAt": self.finished_at,
+            }
+
+
+class GameJobQueue:
+    """対局生成ジョブのキューとワーカースレッドプール
+
+    runnerはGameJobを受け取って対局データを返す関数で、各ワーカースレッドで実行される。
+    待ち行列がmax_queueを超える場合はQueueFullErrorを送出する。
+    """
+
+    def __init__(self, runner, workers=2, max_queue=8, history_limit=200):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.history_limit = max(1, history_limit)
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+
+    def _ensure_workers(self):
+        """ワーカースレッドを起動（初回投入時のみ）"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"game-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, params, game_id):
+        """ジョブを投入してGameJobを返す"""
+        self._ensure_workers()
+        job = GameJob(params, game_id)
+        # ワーカーが取り出す前（投入直後の状態取得より前）に登録しておく
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._evict_finished()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            raise QueueFullError("対局生成キューが満杯です")
+        return job
+
+    def get(self, job_id):
+        """ジョブを取得（存在しない場合はNone）"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """キューの状態を取得"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._queue.qsize(),
+                "maxQueue": self._queue.maxsize,
+                "jobs": len(self._jobs),
+                "mode": "threads",
+            }
+
+    def _evict_finished(self):
+        """保持上限を超えた完了済みジョブを古い順に破棄"""
+        overflow = len(self._jobs) - self.history_limit
+        if overflow <= 0:
+            return
+        for job_id in list(self._jobs):
+            if overflow <= 0:
+                break
+            if self._jobs[job_id].status in ("done", "failed"):
+                del self._jobs[job_id]
+                overflow -= 1
+
+    def _start(self, job):
+        """ジョブを実行中にする"""
+        with self._lock:
+            self._running += 1
+        with job._lock:
+            job.status = "running"
+            job.started_at = time.time()
+
+    def _finish(self, job, result=None, error=None):
+        """ジョブを完了（errorがあれば失敗）にする"""
+        with job._lock:
+            if error is None:
+                job.result = result
+                job.status = "done"
+            else:
+                job.error = str(error)
+                job.status = "failed"
+            job.finished_at = time.time()
+        with self._lock:
+            self._running -= 1
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            self._start(job)
+            try:
+                self._finish(job, result=self.runner(job))
+            except Exception as e:
+                logger.exception(
+                    "対局生成ジョブエラー: %s", e, extra={"jobId": job.job_id}
+                )
+                self._finish(job, error=e)
+            finally:
+                self._queue.task_done()
+
+
+class EventLoopThread:
+    """常駐するイベントループとそれを回すスレッド（最初に使うときに起動）
+
+    別のスレッドからコルーチンを投入でき、投入されたコルーチンは全てこの1つのループで多重化される。
+    """
+
+    def __init__(self, name="event-loop"):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """イベントループ（未起動なら起動する）"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro):
+        """コルーチンをループで実行し、concurrent.futures.Futureを返す"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """コルーチンをループで実行して結果を待つ（ループのスレッド以外から呼ぶ）"""
+        return self.submit(coro).result(timeout)
+
+
+class AsyncGameJobQueue(GameJobQueue):
+    """対局生成ジョブを常駐イベントループのタスクとして実行するキュー
+
+    runnerはGameJobを受け取って対局データを返すコルーチン関数。ジョブごとにスレッドを
+    使わず、同時に実行するジョブをconcurrent個までに抑えて1つのループで多重化する。
+    実行待ちがmax_queueを超える場合はQueueFullErrorを送出する。
+    """
+
+    def __init__(
+        self, runner, loop_thread, concurrent=16, max_queue=8, history_limit=200
+    ):
+        self.runner = runner
+        self.loop_thread = loop_thread
+        self.workers = max(1, concurrent)
+        self.max_queue = max(1, max_queue)
+        self.history_limit = max(1, history_limit)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._semaphore = None
+
+    def submit(self, params, game_id):
+        """ジョブを投入してGameJobを返す"""
+        job = GameJob(params, game_id)
+        with self._lock:
+            if self._queued >= self.max_queue:
+                raise QueueFullError("対局生成キューが満杯です")
+            self._queued += 1
+            self._jobs[job.job_id] = job
+            self._evict_finished()
+        self.loop_thread.submit(self._run(job))
+        return job
+
+    def stats(self):
+        """キューの状態を取得"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._queued,
+                "maxQueue": self.max_queue,
+                "jobs": len(self._jobs),
+                "mode": "shared_loop",
+            }
+
+    async def _run(self, job):
+        if self._semaphore is None:
+            # セマフォはループのスレッドで作る
+            self._semaphore = asyncio.Semaphore(self.workers)
+        async with self._semaphore:
+            with self._lock:
+                self._queued -= 1
+            self._start(job)
+            try:
+                self._finish(job, result=await self.runner(job))
+            except Exception as e:
+                logger.exception(
+                    "対局生成ジョブエラー: %s", e, extra={"jobId": job.job_id}
+                )
+                self._finish(job, error=e)
@@ -0,0 +1,421 @@
+"""対局のコンパクトな表現とアーカイブファイル
+
+GameRecordは指し手を16ビットの手コードの配列（array('H')）で持ち、
+解説は文字列表（StringTable）の番号で持つ。文字列表は対局ごとに作るか、同じアーカイブから
+読んだ対局どうしで共有する（プロセス全体で共有する表は持たないので、使い終えた文字列は解放される）。日本語表記は保存せず、
+必要になったときに初期局面から再生して作る（再生で作れない表記だけは文字列表に持つ）。
+ルートが使う対局データのJSON形式（moveNumber・moveUsi・moveNotation・commentary）と相互に変換できる。
+
+アーカイブファイル（リトルエンディアン）:
+    ヘッダ   : マジック"SGRC", バージョン(u16), 予約(u16)
+    レコード : 長さ(u32) と本体を追記していく
+    本体     : 手数(u16), 文字列数(u16), メタデータ長(u32), メタデータ(JSON),
+               手コード(u16)×手数, 解説の番号(u16)×手数, 表記の番号(u16)×手数,
+               文字列の開始位置(u32)×(文字列数+1), UTF-8の文字列を連結したもの
+    番号0xFFFFは解説なし・表記は再生して作ることを表す。
+
+使い方:
+    python game_record.py pack games.jsonl -o data/games.sgr   # 対局データ（JSONL）を追記
+    python game_record.py unpack data/games.sgr                # 対局データのJSONLを出力
+    python game_record.py stats data/games.sgr
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from fastboard import Position, code_to_usi, usi_to_code
+
+MAGIC = b"SGRC"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sHH")
+LENGTH = struct.Struct("<I")
+RECORD_HEADER = struct.Struct("<HHI")
+NONE = 0xFFFF
+# 1局の文字列表・手数の上限（番号をu16で持つため）
+MAX_STRINGS = NONE
+MAX_MOVES = NONE
+
+
+class StringTable:
+    """同じ文字列を1つにまとめて番号で参照する表（スレッドセーフ）"""
+
+    def __init__(self):
+        self._strings = []
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._strings)
+
+    def intern(self, text):
+        """文字列の番号を取得（初めての文字列は追加する）"""
+        with self._lock:
+            index = self._index.get(text)
+            if index is None:
+                index = self._index[text] = len(self._strings)
+                self._strings.append(text)
+            return index
+
+    def get(self, index):
+        return self._strings[index]
+
+
+def replay_notations(moves_usi, notation, sfen=None):
+    """初期局面から指し手を再生して各手の日本語表記を作る
+
+    notationは (USIの指し手, 指す前の盤面) を受け取って表記を返す関数。
+    指せない手があった場合、それ以降はNoneになる。
+    """
+    board = Position(sfen)
+    notations = []
+    for move_usi in moves_usi:
+        if board is None:
+            notations.append(None)
+            continue
+        notations.append(notation(move_usi, board))
+        try:
+            board.push_usi(move_usi)
+        except ValueError:
+            board = None
+    return notations
+
+
+class GameRecord:
+    """1局分のコンパクトな対局記録"""
+
+    __slots__ = ("metadata", "moves", "commentary", "notations", "strings")
+
+    def __init__(
+        self, metadata=None, moves=None, commentary=None, notations=None, strings=None
+    ):
+        self.metadata = metadata or {}
+        self.moves = moves if moves is not None else array("H")
+        self.commentary = commentary if commentary is not None else array("I")
+        # 再生で作れない表記だけを持つ（手の番号 → 文字列表の番号）
+        self.notations = notations or {}
+        self.strings = strings if strings is not None else StringTable()
+
+    def __len__(self):
+        return len(self.moves)
+
+    @classmethod
+    def from_game_data(cls, game_data, notation=None, strings=None):
+        """対局データ（JSON形式）から作成
+
+        表記はnotationで再生して作ったもの（notationを渡さない場合はUSI記法）と
+        違う場合だけ文字列表に持つ。stringsを渡さない場合はこの対局だけの文字列表を作る。
+        """
+        strings = strings if strings is not None else StringTable()
+        moves_data = game_data.get("moves", [])
+        if len(moves_data) > MAX_MOVES:
+            raise ValueError(f"too many moves: {len(moves_data)}")
+        moves_usi = [move_data["moveUsi"] for move_data in moves_data]
+        derived = (
+            replay_notations(moves_usi, notation, game_data.get("startSfen"))
+            if notation is not None
+            else moves_usi
+        )
+
+        record = cls(
+            {key: value for key, value in game_data.items() if key != "moves"},
+            array("H", (usi_to_code(move_usi) for move_usi in moves_usi)),
+            strings=strings,
+        )
+        for index, move_data in enumerate(moves_data):
+            text = move_data.get("commentary")
+            record.commentary.append(strings.intern(text) if text else 0xFFFFFFFF)
+            stored = move_data.get("moveNotation")
+            if stored is not None and stored != derived[index]:
+                record.notations[index] = strings.intern(stored)
+        return record
+
+    def move_usi(self, index):
+        return code_to_usi(self.moves[index])
+
+    def commentary_at(self, index):
+        string_id = self.commentary[index]
+        return None if string_id == 0xFFFFFFFF else self.strings.get(string_id)
+
+    def iter_moves(self, notation=None):
+        """JSON形式の指し手の辞書を順に返す（表記は必要な分だけ再生して作る）"""
+        board = Position(self.metadata.get("startSfen"))
+        for index, code in enumerate(self.moves):
+            move_usi = code_to_usi(code)
+            if index in self.notations:
+                move_notation = self.strings.get(self.notations[index])
+            elif notation is not None and board is not None:
+                move_notation = notation(move_usi, board)
+            else:
+                move_notation = move_usi
+            if board is not None:
+                try:
+                    board.push_usi(move_usi)
+                except ValueError:
+                    board = None
+            yield {
+                "moveNumber": index + 1,
+                "moveUsi": move_usi,
+                "moveNotation": move_notation,
+                "commentary": self.commentary_at(index) or "",
+            }
+
+    def to_game_data(self, notation=None):
+        """ルートが使う対局データ（JSON形式）に変換"""
+        game_data = dict(self.metadata)
+        game_data["moves"] = list(self.iter_moves(notation))
+        return game_data
+
+    def to_bytes(self):
+        """アーカイブのレコード本体（長さを除く）に変換"""
+        local = []
+        local_index = {}
+
+        def local_id(string_id):
+            if string_id == 0xFFFFFFFF:
+                return NONE
+            text = self.strings.get(string_id)
+            index = local_index.get(text)
+            if index is None:
+                if len(local) >= MAX_STRINGS:
+                    raise ValueError("too many distinct strings in one record")
+                index = local_index[text] = len(local)
+                local.append(text)
+            return index
+
+        commentary = array("H", (local_id(i) for i in self.commentary))
+        notations = array("H", [NONE] * len(self.moves))
+        for index, string_id in self.notations.items():
+            notations[index] = local_id(string_id)
+
+        metadata = json.dumps(self.metadata, ensure_ascii=False).encode("utf-8")
+        blobs = [text.encode("utf-8") for text in local]
+        offsets = array("I", [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        parts = [
+            RECORD_HEADER.pack(len(self.moves), len(local), len(metadata)),
+            metadata,
+            _little_endian(self.moves),
+            _little_endian(commentary),
+            _little_endian(notations),
+            _little_endian(offsets),
+        ]
+        return b"".join(parts + blobs)
+
+    @classmethod
+    def from_bytes(cls, data, strings=None):
+        """アーカイブのレコード本体から作成（文字列はstrings、なければ新しい文字列表に登録する）"""
+        strings = strings if strings is not None else StringTable()
+        count, string_count, metadata_length = RECORD_HEADER.unpack_from(data, 0)
+        position = RECORD_HEADER.size
+        metadata = json.loads(bytes(data[position : position + metadata_length]))
+        position += metadata_length
+
+        def read_array(typecode, length):
+            nonlocal position
+            values = array(typecode)
+            size = values.itemsize * length
+            values.frombytes(bytes(data[position : position + size]))
+            if sys.byteorder == "big":
+                values.byteswap()
+            position += size
+            return values
+
+        moves = read_array("H", count)
+        commentary = read_array("H", count)
+        notations = read_array("H", count)
+        offsets = read_array("I", string_count + 1)
+        base = position
+        string_ids = [
+            strings.intern(
+                bytes(data[base + offsets[i] : base + offsets[i + 1]]).decode("utf-8")
+            )
+            for i in range(string_count)
+        ]
+        return cls(
+            metadata,
+            moves,
+            array(
+                "I", (0xFFFFFFFF if i == NONE else string_ids[i] for i in commentary)
+            ),
+            {index: string_ids[i] for index, i in enumerate(notations) if i != NONE},
+            strings,
+        )
+
+
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class GameArchiveWriter:
+    """アーカイブファイルにレコードを追記する"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, 0))
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        """レコードを追記してその位置を返す"""
+        data = record.to_bytes()
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(LENGTH.pack(len(data)) + data)
+            return offset
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameArchive:
+    """mmapで開いたアーカイブファイル（レコードは読み出すときに1つずつ復元する）
+
+    復元した対局はアーカイブごとの文字列表を共有し、同じ解説を1つにまとめる。
+    """
+
+    def __init__(self, path, strings=None):
+        self.path = path
+        self.strings = strings if strings is not None else StringTable()
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        )
+        if size and (
+            size < FILE_HEADER.size
+            or FILE_HEADER.unpack_from(self._mm, 0)[:2] != (MAGIC, VERSION)
+        ):
+            self.close()
+            raise ValueError(f"not a game record archive: {path}")
+
+    def offsets(self):
+        """各レコードの位置を順に返す（途中で切れたレコードは無視する）"""
+        if self._mm is None:
+            return
+        position = FILE_HEADER.size
+        size = len(self._mm)
+        while position + LENGTH.size <= size:
+            (length,) = LENGTH.unpack_from(self._mm, position)
+            if position + LENGTH.size + length > size:
+                break
+            yield position
+            position += LENGTH.size + length
+
+    def read(self, offset):
+        """位置offsetのレコードを復元"""
+        (length,) = LENGTH.unpack_from(self._mm, offset)
+        start = offset + LENGTH.size
+        with memoryview(self._mm) as view:
+            return GameRecord.from_bytes(view[start : start + length], self.strings)
+
+    def __iter__(self):
+        for offset in self.offsets():
+            yield self.read(offset)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="対局記録のアーカイブ")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pack = commands.add_parser(
+        "pack", help="対局データ（JSONL・JSON）をアーカイブに追記"
+    )
+    pack.add_argument("files", nargs="+", help="1行1局のJSONL、または対局データのJSON")
+    pack.add_argument("-o", "--output", required=True, help="アーカイブファイル")
+
+    unpack = commands.add_parser("unpack", help="アーカイブを対局データのJSONLで出力")
+    unpack.add_argument("archive")
+
+    stats = commands.add_parser("stats", help="アーカイブの対局数・手数・サイズを表示")
+    stats.add_argument("archive")
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        games = 0
+        with GameArchiveWriter(args.output) as writer:
+            for path in args.files:
+                for game_data in _read_games(path):
+                    writer.append(GameRecord.from_game_data(game_data))
+                    games += 1
+        print(f"{games}局を追記しました: {args.output}")
+    elif args.command == "unpack":
+        with GameArchive(args.archive) as archive:
+            for record in archive:
+                print(json.dumps(record.to_game_data(), ensure_ascii=False))
+    else:
+        games = plies = 0
+        with GameArchive(args.archive) as archive:
+            for record in archive:
+                games += 1
+                plies += len(record)
+        size = os.path.getsize(args.archive)
+        print(
+            f"{games}局 {plies}手 {size}バイト"
+            + (f"（1手あたり{size / plies:.1f}バイト）" if plies else "")
+        )
+    return 0
+
+
+def _read_games(path):
+    """JSONL（1行1局）またはJSON（1局・対局のリスト）から対局データを読む"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            data = json.load(f)
+            yield from data if isinstance(data, list) else [data]
+            return
+        for line in f:
+            if line.strip():
+                game_data = json.loads(line)
+                if (
+                    "moves" in game_data
+                    and game_data["moves"]
+                    and isinstance(game_data["moves"][0], str)
+                ):
+                    # tournament.pyのJSONL（movesがUSIのリスト）
+                    game_data = dict(game_data)
+                    game_data["moves"] = [
+                        {"moveNumber": i + 1, "moveUsi": usi}
+                        for i, usi in enumerate(game_data["moves"])
+                    ]
+                yield game_data
+
+
+if __name__ == "__main__":
+    sys.exit(main())
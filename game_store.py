@@ -0,0 +1,391 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryGameStore:
+    """プロセス内のLRUによる対局ストア
+
+    対局データと事前計算した全局面を対局IDごとに保持する。
+    max_gamesを超えたら最後に使われたのが古い順に、max_age秒を過ぎたら保存が古い順に破棄する。
+    返す対局データ・全局面は保存したものと同じオブジェクトなので、呼び出し側は書き換えない
+    （書き換えて保存し直す場合は複製してから書き換える）。
+    """
+
+    def __init__(self, max_games=256, max_age=None):
+        self.max_games = max(1, max_games)
+        self.max_age = max_age
+        self._games = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, game_data, positions=None, stored_at=None):
+        """対局を保存"""
+        with self._lock:
+            game_id = game_data["gameId"]
+            self._games[game_id] = (game_data, positions, stored_at or time.time())
+            self._games.move_to_end(game_id)
+            self._prune()
+
+    def load_entry(self, game_id):
+        """(対局データ, 全局面, 保存時刻) を取得（存在しない場合はNone）"""
+        with self._lock:
+            entry = self._games.get(game_id)
+            if entry is not None and self._expired(entry[2]):
+                del self._games[game_id]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._games.move_to_end(game_id)
+            self.hits += 1
+            return entry
+
+    def load(self, game_id):
+        """(対局データ, 全局面) を取得（存在しない場合はNone）"""
+        entry = self.load_entry(game_id)
+        return entry[:2] if entry else None
+
+    def get(self, game_id):
+        """対局データを取得（存在しない場合はNone）"""
+        entry = self.load(game_id)
+        return entry[0] if entry else None
+
+    def get_positions(self, game_id):
+        """事前計算した全局面を取得（存在しない場合はNone）"""
+        entry = self.load(game_id)
+        return entry[1] if entry else None
+
+    def delete(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def iter_games(self):
+        """保存されている対局データを順に返す（LRUの順序・ヒット数は変えない）"""
+        with self._lock:
+            entries = list(self._games.values())
+        for game_data, _, stored_at in entries:
+            if not self._expired(stored_at):
+                yield game_data
+
+    def _expired(self, stored_at):
+        return self.max_age is not None and time.time() - stored_at > self.max_age
+
+    def _prune(self):
+        while len(self._games) > self.max_games:
+            self._games.popitem(last=False)
+            self.evictions += 1
+        if self.max_age is not None:
+            for game_id in [g for g, e in self._games.items() if self._expired(e[2])]:
+                del self._games[game_id]
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "games": len(self._games),
+                "maxGames": self.max_games,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class SQLiteGameStore:
+    """SQLite（WALモード）による対局ストア
+
+    同じファイルを開いた複数のワーカープロセスから読み書きできる。
+    接続はスレッドごとに持ち、書き込みのたびにコミットする。
+    max_age秒を過ぎた対局と、max_gamesを超えた分（最後に読まれたのが古い順）は
+    一定回数の書き込みごとに削除する。
+    最後に読まれた時刻は、読み出しのたびに書き込まないようTOUCH_INTERVAL秒ごとにだけ更新する。
+    """
+
+    # 掃除を行う書き込み回数の間隔
+    PRUNE_INTERVAL = 32
+    # 最後に読まれた時刻（accessed_at）を更新する最短の間隔（秒）
+    TOUCH_INTERVAL = 60.0
+
+    def __init__(self, path, max_games=10000, max_age=None, busy_timeout=5.0):
+        self.path = path
+        self.max_games = max(1, max_games)
+        self.max_age = max_age
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        """このスレッドの接続を取得（初回のみテーブルを作成）"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS games ("
+                " game_id TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " positions TEXT,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS games_accessed_at ON games (accessed_at)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS games_created_at ON games (created_at)"
+            )
+            db.commit()
+            self._local.db = db
+        return db
+
+    def put(self, game_data, positions=None, stored_at=None):
+        """対局を保存（同じIDの対局は上書き）"""
+        now = stored_at or time.time()
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO games"
+            " (game_id, data, positions, created_at, accessed_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                game_data["gameId"],
+                json.dumps(game_data, ensure_ascii=False),
+                json.dumps(positions, ensure_ascii=False) if positions else None,
+                now,
+                now,
+            ),
+        )
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self.PRUNE_INTERVAL == 0
+        if prune:
+            self._prune(db, now)
+        db.commit()
+
+    def _read(self, game_id, columns):
+        """指定した列と (created_at, accessed_at) を読む（期限切れは削除してNone）"""
+        db = self._connect()
+        row = db.execute(
+            f"SELECT {columns}, created_at, accessed_at FROM games WHERE game_id = ?",
+            (game_id,),
+        ).fetchone()
+        now = time.time()
+        if (
+            row is not None
+            and self.max_age is not None
+            and now - row[-2] > self.max_age
+        ):
+            db.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+            db.commit()
+            with self._lock:
+                self.evictions += 1
+            row = None
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if now - row[-1] >= self.TOUCH_INTERVAL:
+            db.execute(
+                "UPDATE games SET accessed_at = ? WHERE game_id = ?", (now, game_id)
+            )
+            db.commit()
+        with self._lock:
+            self.hits += 1
+        return row
+
+    def load_entry(self, game_id):
+        """(対局データ, 全局面, 保存時刻) を取得（存在しない場合はNone）"""
+        row = self._read(game_id, "data, positions")
+        if row is None:
+            return None
+        return json.loads(row[0]), json.loads(row[1]) if row[1] else None, row[2]
+
+    def load(self, game_id):
+        """(対局データ, 全局面) を取得（存在しない場合はNone）"""
+        entry = self.load_entry(game_id)
+        return entry[:2] if entry else None
+
+    def get(self, game_id):
+        """対局データを取得（全局面は読まない）"""
+        row = self._read(game_id, "data")
+        return json.loads(row[0]) if row else None
+
+    def get_positions(self, game_id):
+        """事前計算した全局面を取得"""
+        row = self._read(game_id, "positions")
+        return json.loads(row[0]) if row and row[0] else None
+
+    def version(self, game_id):
+        """対局の保存時刻（保存し直すと変わる。存在しない場合はNone）"""
+        row = (
+            self._connect()
+            .execute("SELECT created_at FROM games WHERE game_id = ?", (game_id,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def delete(self, game_id):
+        db = self._connect()
+        db.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+        db.commit()
+
+    # iter_gamesで一度に読み出す対局数
+    ITER_BATCH = 200
+
+    def iter_games(self):
+        """保存されている対局データを古い順に返す（accessed_atは更新しない）
+
+        rowidで区切って少しずつ読むため、対局数が多くても使うメモリは一定。
+        """
+        db = self._connect()
+        last_rowid = 0
+        cutoff = time.time() - self.max_age if self.max_age is not None else None
+        while True:
+            rows = db.execute(
+                "SELECT rowid, data, created_at FROM games"
+                " WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, self.ITER_BATCH),
+            ).fetchall()
+            if not rows:
+                return
+            for rowid, data, created_at in rows:
+                last_rowid = rowid
+                if cutoff is None or created_at >= cutoff:
+                    yield json.loads(data)
+
+    def _prune(self, db, now):
+        """期限切れの対局と、上限を超えた古い対局を削除"""
+        removed = 0
+        if self.max_age is not None:
+            removed += db.execute(
+                "DELETE FROM games WHERE created_at < ?", (now - self.max_age,)
+            ).rowcount
+        (count,) = db.execute("SELECT COUNT(*) FROM games").fetchone()
+        overflow = count - self.max_games
+        if overflow > 0:
+            removed += db.execute(
+                "DELETE FROM games WHERE game_id IN ("
+                " SELECT game_id FROM games ORDER BY accessed_at LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        with self._lock:
+            self.evictions += max(0, removed)
+
+    def count(self):
+        (count,) = self._connect().execute("SELECT COUNT(*) FROM games").fetchone()
+        return count
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "backend": "sqlite",
+                "maxGames": self.max_games,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+        stats["games"] = self.count()
+        return stats
+
+
+class TieredGameStore:
+    """メモリのLRU（hot）をSQLite（cold）の前段に置いた対局ストア
+
+    保存は両方に書き、読み出しはhotになければcoldから読んでhotに載せる。
+    他のワーカープロセスが保存し直した対局を古いまま返し続けないよう、hotの対局は
+    revalidate_after秒ごとにcoldの保存時刻と比べ、変わっていればcoldから読み直す。
+    """
+
+    def __init__(self, hot, cold, revalidate_after=2.0):
+        self.hot = hot
+        self.cold = cold
+        self.revalidate_after = revalidate_after
+        # 対局IDごとの最後にcoldと比べた時刻
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def put(self, game_data, positions=None, stored_at=None):
+        # 両方に同じ保存時刻を書き、hotの対局が最新かをcoldの保存時刻で判定できるようにする
+        stored_at = stored_at or time.time()
+        self.cold.put(game_data, positions, stored_at)
+        self.hot.put(game_data, positions, stored_at)
+        with self._lock:
+            self._checked[game_data["gameId"]] = time.monotonic()
+
+    def _fresh(self, game_id, stored_at):
+        """hotの対局がcoldと同じ版か（revalidate_after秒以内に確認済みなら確認しない）"""
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(game_id)
+            if checked is not None and now - checked < self.revalidate_after:
+                return True
+        if self.cold.version(game_id) != stored_at:
+            return False
+        with self._lock:
+            self._checked[game_id] = now
+            if len(self._checked) > 4 * self.hot.max_games:
+                # hotから消えた対局の確認時刻を捨てる
+                self._checked.clear()
+        return True
+
+    def load(self, game_id):
+        entry = self.hot.load_entry(game_id)
+        if entry is not None and not self._fresh(game_id, entry[2]):
+            self.hot.delete(game_id)
+            entry = None
+        if entry is None:
+            entry = self.cold.load_entry(game_id)
+            if entry is None:
+                return None
+            self.hot.put(*entry)
+            with self._lock:
+                self._checked[game_id] = time.monotonic()
+        return entry[0], entry[1]
+
+    def get(self, game_id):
+        entry = self.load(game_id)
+        return entry[0] if entry else None
+
+    def get_positions(self, game_id):
+        entry = self.load(game_id)
+        return entry[1] if entry else None
+
+    def delete(self, game_id):
+        self.cold.delete(game_id)
+        self.hot.delete(game_id)
+
+    def iter_games(self):
+        # hotに載っている対局はすべてcoldにも保存されている
+        return self.cold.iter_games()
+
+    def stats(self):
+        return {
+            "backend": "tiered",
+            "memory": self.hot.stats(),
+            "sqlite": self.cold.stats(),
+        }
+
+
+def create_game_store(path=None, memory_size=256, max_games=10000, max_age=None):
+    """設定に応じた対局ストアを作成（pathがなければメモリのみ）"""
+    if not path:
+        return MemoryGameStore(memory_size, max_age)
+    return TieredGameStore(
+        MemoryGameStore(memory_size, max_age),
+        SQLiteGameStore(path, max_games, max_age),
+    )
@@ -0,0 +1,93 @@
+"""HTTPキャッシュ（ETag・Cache-Control・304）とレスポンス圧縮（gzip・brotli）
+
+ETagは内容から決まる強い検証子で、圧縮したレスポンスには符号化方式を付けた別のETagを使う
+（If-None-Matchにはどちらが来ても一致とみなす）。
+brotliはbrotliパッケージがインストールされている場合のみ使う。
+"""
+
+import gzip
+import hashlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 終局済みの対局の盤面など、内容が変わらないレスポンスのCache-Control
+IMMUTABLE = "public, max-age=31536000, immutable"
+# 内容が変わりうるレスポンス（毎回ETagで再検証させる）
+REVALIDATE = "no-cache"
+
+# 圧縮する方式（優先順）と、圧縮するMIMEタイプ
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html", "text/csv")
+
+
+def strong_etag(*parts):
+    """内容を表す値の列から強いETag（引用符なし）を作成"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def _variants(etag):
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+def not_modified(etag, cache_control):
+    """If-None-MatchがETagに一致すれば304のレスポンスを、しなければNoneを返す"""
+    for candidate in _variants(etag):
+        if request.if_none_match.contains(candidate):
+            response = Response(status=304)
+            response.set_etag(candidate)
+            response.headers["Cache-Control"] = cache_control
+            response.vary.add("Accept-Encoding")
+            return response
+    return None
+
+
+def set_cache_headers(response, etag, cache_control):
+    """レスポンスにETagとCache-Controlを付ける（200の場合のみ）"""
+    if response.status_code == 200:
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def compress_response(response, min_size=1024, level=6):
+    """クライアントが受け付ける方式でレスポンス本文を圧縮（after_requestから呼ぶ）
+
+    ストリーミング・圧縮済み・小さい・圧縮しても縮まない種類のレスポンスはそのまま返す。
+    """
+    if (
+        response.status_code != 200
+        or response.is_streamed
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    if encoding == "br":
+        # テキスト用のモードで、gzipの既定と同程度の速さになる品質を使う
+        body = brotli.compress(data, mode=brotli.MODE_TEXT, quality=min(level, 11))
+    else:
+        # mtimeを固定して同じ内容からは同じバイト列を作る
+        body = gzip.compress(data, compresslevel=level, mtime=0)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
@@ -0,0 +1,195 @@
+"""対局データの棋譜形式（KIF・CSA・USI・SFEN）への書き出しと、zipでの一括書き出し
+
+対局データはルートが使うJSON形式（movesにmoveUsiとcommentary）。
+zipは1局ずつ圧縮しながらチャンクを返すジェネレータで作るため、
+何万局でもメモリに全体を持たずにストリーミングできる。
+"""
+
+import zipfile
+
+import shogi
+import shogi.CSA
+import shogi.KIF
+
+from fastboard import Position
+
+# 棋譜に書ける終局理由（KIFの終局の指し手とCSAの特殊な手）
+END_REASONS = {
+    "投了": "%TORYO",
+    "千日手": "%SENNICHITE",
+    "持将棋": "%JISHOGI",
+    "切れ負け": "%TIME_UP",
+    "入玉勝ち": "%KACHI",
+}
+
+# 形式ごとの (拡張子, MIMEタイプ)
+FORMATS = {
+    "kif": ("kif", "text/plain; charset=utf-8"),
+    "csa": ("csa", "text/plain; charset=utf-8"),
+    "usi": ("usi", "text/plain; charset=utf-8"),
+    "sfen": ("sfen", "text/plain; charset=utf-8"),
+}
+
+
+def replay(game_data, board):
+    """初期局面のboardに指し手を指しながら (指す前の盤面, shogi.Move, 指し手の辞書) を順に返す
+
+    指せない手があればそこで打ち切る。最後まで回すとboardは終局の盤面になる。
+    """
+    for move_data in game_data.get("moves", []):
+        try:
+            move = shogi.Move.from_usi(move_data["moveUsi"])
+        except ValueError:
+            return
+        if move not in board.legal_moves:
+            return
+        yield board, move, move_data
+        board.push(move)
+
+
+def export_kif(game_data):
+    """KIF形式（UTF-8）。解説は指し手の後のコメント行（*）に書く"""
+    lines = [
+        "#KIF version=2.0 encoding=UTF-8",
+        "手合割：平手",
+        f"先手：{game_data.get('sente', '')}",
+        f"後手：{game_data.get('gote', '')}",
+        "手数----指手---------消費時間--",
+    ]
+    board = Position()
+    previous_to = None
+    plies = 0
+    for _, move, move_data in replay(game_data, board):
+        notation = shogi.KIF.Exporter.kif_move_from(move.usi(), board)
+        if move.to_square == previous_to:
+            # 直前の手と同じ位置への移動は「同」で表す
+            notation = "同　" + notation[2:]
+        previous_to = move.to_square
+        plies += 1
+        lines.append(f"{plies:>4} {notation}")
+        commentary = move_data.get("commentary")
+        if commentary:
+            lines.extend("*" + line for line in commentary.splitlines())
+
+    reason = game_data.get("winReason")
+    if board.is_checkmate():
+        winner = "後手" if board.turn == shogi.BLACK else "先手"
+        lines.append(f"{plies + 1:>4} 詰み")
+        lines.append(f"まで{plies}手で{winner}の勝ち")
+    elif reason in END_REASONS:
+        # 取り込んだ棋譜の終局理由
+        result = game_data.get("result") or ""
+        lines.append(f"{plies + 1:>4} {reason}")
+        lines.append(
+            f"まで{plies}手で{result if result.endswith('の勝ち') else reason}"
+        )
+    else:
+        lines.append(f"{plies + 1:>4} 中断")
+        lines.append(f"まで{plies}手で中断")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def export_csa(game_data):
+    """CSA形式（V2.2）。解説は「'*」のコメント行に書く"""
+    lines = [
+        "V2.2",
+        f"N+{game_data.get('sente', '')}",
+        f"N-{game_data.get('gote', '')}",
+        f"$EVENT:{game_data.get('gameId', '')}",
+        "PI",
+        "+",
+    ]
+    board = Position()
+    for _, move, move_data in replay(game_data, board):
+        sign = "+" if board.turn == shogi.BLACK else "-"
+        if move.drop_piece_type:
+            from_name = "00"
+            piece_type = move.drop_piece_type
+        else:
+            from_name = shogi.CSA.SQUARE_NAMES[move.from_square]
+            piece_type = board.piece_type_at(move.from_square)
+            if move.promotion:
+                piece_type = shogi.PIECE_PROMOTED[piece_type]
+        lines.append(
+            sign
+            + from_name
+            + shogi.CSA.SQUARE_NAMES[move.to_square]
+            + shogi.CSA.PIECE_SYMBOLS[piece_type]
+        )
+        commentary = move_data.get("commentary")
+        if commentary:
+            lines.extend("'*" + line for line in commentary.splitlines())
+
+    if board.is_checkmate():
+        lines.append("%TSUMI")
+    else:
+        lines.append(END_REASONS.get(game_data.get("winReason"), "%CHUDAN"))
+    return "\n".join(lines) + "\n"
+
+
+def export_usi(game_data):
+    """USIのpositionコマンド（1行）"""
+    moves = [move.usi() for _, move, _ in replay(game_data, Position())]
+    return "position startpos" + (" moves " + " ".join(moves) if moves else "") + "\n"
+
+
+def export_sfen(game_data):
+    """初期局面から各手の後までの局面のSFEN（1行1局面）"""
+    board = Position()
+    lines = []
+    for _, _, _ in replay(game_data, board):
+        lines.append(board.sfen())
+    lines.append(board.sfen())
+    return "\n".join(lines) + "\n"
+
+
+EXPORTERS = {
+    "kif": export_kif,
+    "csa": export_csa,
+    "usi": export_usi,
+    "sfen": export_sfen,
+}
+
+
+def export_game(game_data, export_format):
+    """対局データを指定した形式の文字列にする（未対応の形式はValueError）"""
+    exporter = EXPORTERS.get(export_format)
+    if exporter is None:
+        raise ValueError(f"unsupported format: {export_format}")
+    return exporter(game_data)
+
+
+class _ChunkBuffer:
+    """zipfileが書き込んだバイト列をためておき、チャンクとして取り出す（シーク不可）"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(games, export_format):
+    """対局データのイテラブルを1局1ファイルのzipにして、バイト列のチャンクを順に返す"""
+    extension = FORMATS[export_format][0]
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for game_data in games:
+            text = export_game(game_data, export_format)
+            name = f"{game_data.get('gameId', 'game')}.{extension}"
+            archive.writestr(name, text.encode("utf-8"))
+            chunk = buffer.take()
+            if chunk:
+                yield chunk
+    chunk = buffer.take()
+    if chunk:
+        yield chunk
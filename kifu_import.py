@@ -0,0 +1,537 @@
+"""KIF・CSA形式の棋譜の読み込み（ストリーミング）と一括取り込み
+
+ファイルは行ごとに読み進め、1局読み終わるたびにParsedGameを返すため、
+多数の対局を連結したCSAファイル（"/"区切り）でもメモリに全体を持たない。
+指し手は1手ずつ合法手か確かめ、反則手や読めない行があればその対局をerror付きで返す。
+平手の初期局面から始まる対局のみ対応する。
+
+使い方:
+    python kifu_import.py kifu/*.kif --dry-run
+    python kifu_import.py kifu/ --commentary --concurrency 8
+    python kifu_import.py games.csa --url http://127.0.0.1:8080 --commentary
+"""
+
+import argparse
+import asyncio
+import codecs
+import json
+import os
+import re
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import shogi
+import shogi.CSA
+import shogi.KIF
+
+from fastboard import Position, usi_to_code
+
+# 取り込める拡張子と形式
+EXTENSIONS = {".kif": "kif", ".kifu": "kif", ".csa": "csa"}
+
+# 文字コードの判定に使う先頭のバイト数
+SNIFF_BYTES = 64 * 1024
+
+# KIFの終局を表す指し手
+KIF_SPECIAL_RE = re.compile(
+    r"\A *[0-9]+\s+(中断|投了|持将棋|千日手|詰み|不詰|切れ負け|反則勝ち|反則負け|入玉勝ち)"
+)
+KIF_MOVE_LINE_RE = re.compile(r"\A *[0-9]+\s+\S")
+
+# CSAの終局を表す行と、手番側から見た勝敗（"lose"・"win"・"draw"）
+CSA_SPECIAL = {
+    "%TORYO": ("投了", "lose"),
+    "%TSUMI": ("詰み", "lose"),
+    "%TIME_UP": ("時間切れ", "lose"),
+    "%ILLEGAL_MOVE": ("反則", "lose"),
+    "%+ILLEGAL_ACTION": ("反則", None),
+    "%-ILLEGAL_ACTION": ("反則", None),
+    "%KACHI": ("入玉勝ち", "win"),
+    "%SENNICHITE": ("千日手", "draw"),
+    "%JISHOGI": ("持将棋", "draw"),
+    "%HIKIWAKE": ("引き分け", "draw"),
+    "%CHUDAN": ("中断", None),
+}
+KIF_SPECIAL = {
+    "投了": "lose",
+    "詰み": "lose",
+    "切れ負け": "lose",
+    "反則負け": "lose",
+    "反則勝ち": "win",
+    "入玉勝ち": "win",
+    "千日手": "draw",
+    "持将棋": "draw",
+}
+
+# 平手の初期局面（CSAのP1〜P9）
+CSA_HIRATE_ROWS = [
+    "P1-KY-KE-GI-KI-OU-KI-GI-KE-KY",
+    "P2 * -HI *  *  *  *  * -KA * ",
+    "P3-FU-FU-FU-FU-FU-FU-FU-FU-FU",
+    "P4 *  *  *  *  *  *  *  *  * ",
+    "P5 *  *  *  *  *  *  *  *  * ",
+    "P6 *  *  *  *  *  *  *  *  * ",
+    "P7+FU+FU+FU+FU+FU+FU+FU+FU+FU",
+    "P8 * +KA *  *  *  *  * +HI * ",
+    "P9+KY+KE+GI+KI+OU+KI+GI+KE+KY",
+]
+
+
+class KifuImportError(ValueError):
+    """棋譜を読み込めない場合の例外"""
+
+
+class ParsedGame:
+    """読み込んだ1局分の棋譜（errorがあれば取り込まない）"""
+
+    def __init__(self, index, source=None):
+        self.index = index
+        self.source = source
+        self.sente = None
+        self.gote = None
+        self.moves = []
+        self.comments = {}
+        self.result = ""
+        self.win_reason = ""
+        self.error = None
+        self.board = Position()
+        self.finished = False
+
+    def push(self, move_usi, line_no):
+        """指し手を検証して指す（反則手はKifuImportError）"""
+        if self.finished:
+            return
+        try:
+            code = usi_to_code(move_usi)
+        except (KeyError, ValueError, IndexError):
+            code = None
+        if code is None or code not in self.board.legal_move_codes():
+            raise KifuImportError(
+                f"{line_no}行目: {len(self.moves) + 1}手目の{move_usi}は指せません"
+            )
+        self.board.push_code(code)
+        self.moves.append(move_usi)
+
+    def comment(self, text):
+        """直前の手（指す前なら0）への解説を追加"""
+        ply = len(self.moves)
+        if ply and not self.finished:
+            self.comments[ply] = (
+                self.comments[ply] + "\n" + text if ply in self.comments else text
+            )
+
+    def finish(self, reason, outcome):
+        """終局を記録（outcomeは手番側から見たlose・win・draw）"""
+        if self.finished:
+            return
+        self.finished = True
+        self.win_reason = reason
+        mover = "先手" if self.board.turn == shogi.BLACK else "後手"
+        other = "後手" if self.board.turn == shogi.BLACK else "先手"
+        if outcome == "lose":
+            self.result = f"{other}の勝ち"
+        elif outcome == "win":
+            self.result = f"{mover}の勝ち"
+        elif outcome == "draw":
+            self.result = "引き分け"
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = str(error)
+
+    @property
+    def empty(self):
+        return not self.moves and self.sente is None and self.gote is None
+
+    def to_game_data(self, game_id, notation=None):
+        """ルートが使う対局データに変換（notationは(USI, 指す前の盤面)から表記を返す関数）"""
+        board = Position()
+        moves = []
+        for ply, move_usi in enumerate(self.moves, 1):
+            moves.append(
+                {
+                    "moveNumber": ply,
+                    "moveUsi": move_usi,
+                    "moveNotation": (
+                        notation(move_usi, board) if notation else move_usi
+                    ),
+                    "commentary": self.comments.get(ply, ""),
+                }
+            )
+            board.push_usi(move_usi)
+        return {
+            "gameId": game_id,
+            "sente": self.sente or "先手",
+            "gote": self.gote or "後手",
+            "senteType": "imported",
+            "goteType": "imported",
+            "moves": moves,
+            "result": self.result,
+            "winReason": self.win_reason,
+            "source": self.source,
+        }
+
+
+def detect_encoding(head):
+    """先頭のバイト列から文字コードを判定（UTF-8として読めなければcp932）"""
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # 途中で切れた末尾の文字は無視する
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp932"
+
+
+def iter_lines(stream, encoding=None, chunk_size=SNIFF_BYTES):
+    """バイナリのストリームを少しずつ読み、改行を除いた行を順に返す"""
+    head = stream.read(chunk_size)
+    decoder = codecs.getincrementaldecoder(encoding or detect_encoding(head))(
+        errors="replace"
+    )
+    pending = ""
+    chunk = head
+    while chunk:
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            yield line.rstrip("\r\n")
+        chunk = stream.read(chunk_size)
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r\n")
+
+
+def detect_format(filename=None, first_line=""):
+    """拡張子か先頭行から棋譜の形式（kif・csa）を判定"""
+    if filename:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in EXTENSIONS:
+            return EXTENSIONS[extension]
+    if first_line.startswith(("V2", "N+", "N-", "PI", "P1", "$")):
+        return "csa"
+    return "kif"
+
+
+def parse_kif(lines, source=None):
+    """KIF形式の行から対局を順に返す（先手・後手などのヘッダーが指し手の後に来たら次の対局）"""
+    index = 0
+    game = ParsedGame(index, source)
+    last_to_square = None
+    in_variation = False
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip()
+        if line.startswith("#KIF") and not game.empty:
+            yield game
+            index += 1
+            game = ParsedGame(index, source)
+            last_to_square, in_variation = None, False
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("変化："):
+            # 分岐は本譜のみ取り込む
+            in_variation = True
+            continue
+        if line.startswith("*"):
+            if not in_variation:
+                game.comment(line[1:].strip())
+            continue
+        if "：" in line:
+            key, value = line.split("：", 1)
+            value = value.strip("　 ")
+            if game.moves or in_variation:
+                yield game
+                index += 1
+                game = ParsedGame(index, source)
+                last_to_square, in_variation = None, False
+            if key in ("先手", "下手"):
+                game.sente = value
+            elif key in ("後手", "上手"):
+                game.gote = value
+            elif key == "手合割" and value != "平手":
+                game.fail(
+                    f"{line_no}行目: 平手以外の対局（{value}）には対応していません"
+                )
+            continue
+        if in_variation or game.error:
+            continue
+        if line.count("+") == 2 and line.count("-") > 10:
+            game.fail(f"{line_no}行目: 局面図から始まる対局には対応していません")
+            continue
+        if line in ("後手番", "上手番"):
+            game.fail(f"{line_no}行目: 後手番から始まる対局には対応していません")
+            continue
+
+        special = KIF_SPECIAL_RE.match(line)
+        if special:
+            game.finish(special.group(1), KIF_SPECIAL.get(special.group(1)))
+            continue
+        if not KIF_MOVE_LINE_RE.match(line):
+            # 「まで○手で…」などの行
+            continue
+        move_usi, last_to_square, _ = shogi.KIF.Parser.parse_move_str(
+            line.rstrip("+"), last_to_square
+        )
+        try:
+            if move_usi is None:
+                raise KifuImportError(f"{line_no}行目: 指し手を読めません: {line}")
+            game.push(move_usi, line_no)
+        except KifuImportError as e:
+            game.fail(e)
+    if not game.empty or game.error:
+        yield game
+
+
+def _csa_move(game, statement, line_no):
+    """CSAの指し手（+7776FUなど）をUSIに変換"""
+    color = shogi.CSA.COLOR_SYMBOLS.index(statement[0])
+    if color != game.board.turn:
+        raise KifuImportError(f"{line_no}行目: 手番が違います: {statement}")
+    from_name, to_name, piece_name = statement[1:3], statement[3:5], statement[5:7]
+    try:
+        to_square = shogi.CSA.SQUARE_NAMES.index(to_name)
+        piece_type = shogi.CSA.PIECE_SYMBOLS.index(piece_name)
+    except ValueError:
+        raise KifuImportError(f"{line_no}行目: 指し手を読めません: {statement}")
+    if from_name == "00":
+        return (
+            f"{shogi.PIECE_SYMBOLS[piece_type].upper()}*{shogi.SQUARE_NAMES[to_square]}"
+        )
+    try:
+        from_square = shogi.CSA.SQUARE_NAMES.index(from_name)
+    except ValueError:
+        raise KifuImportError(f"{line_no}行目: 指し手を読めません: {statement}")
+    moved = game.board.piece_type_at(from_square)
+    if moved == piece_type:
+        promotion = ""
+    elif moved and shogi.PIECE_PROMOTED[moved] == piece_type:
+        promotion = "+"
+    else:
+        raise KifuImportError(f"{line_no}行目: 移動元の駒が違います: {statement}")
+    return shogi.SQUARE_NAMES[from_square] + shogi.SQUARE_NAMES[to_square] + promotion
+
+
+def parse_csa(lines, source=None):
+    """CSA形式の行から対局を順に返す（"/"の行で次の対局）"""
+    index = 0
+    game = ParsedGame(index, source)
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip()
+        if line == "/":
+            yield game
+            index += 1
+            game = ParsedGame(index, source)
+            continue
+        if line.startswith("'"):
+            if line.startswith("'*"):
+                game.comment(line[2:].strip())
+            continue
+        if game.error:
+            continue
+        # 1行に複数の文を","で区切って書ける
+        statements = line.split(",") if line.startswith(("+", "-")) else [line]
+        for statement in statements:
+            try:
+                if not statement or statement[0] in "VT$":
+                    continue
+                if statement.startswith("N+"):
+                    game.sente = statement[2:]
+                elif statement.startswith("N-"):
+                    game.gote = statement[2:]
+                elif statement.startswith("P"):
+                    if statement not in (
+                        "PI",
+                        "P+",
+                        "P-",
+                    ) and statement.rstrip() not in (
+                        row.rstrip() for row in CSA_HIRATE_ROWS
+                    ):
+                        raise KifuImportError(
+                            f"{line_no}行目: 平手以外の開始局面には対応していません"
+                        )
+                elif statement == "-":
+                    raise KifuImportError(
+                        f"{line_no}行目: 後手番から始まる対局には対応していません"
+                    )
+                elif statement == "+":
+                    continue
+                elif statement[0] in "+-":
+                    game.push(_csa_move(game, statement, line_no), line_no)
+                elif statement.startswith("%"):
+                    reason, outcome = CSA_SPECIAL.get(statement, (statement[1:], None))
+                    if statement in ("%+ILLEGAL_ACTION", "%-ILLEGAL_ACTION"):
+                        loser = shogi.BLACK if statement[1] == "+" else shogi.WHITE
+                        outcome = "lose" if loser == game.board.turn else "win"
+                    game.finish(reason, outcome)
+                else:
+                    raise KifuImportError(f"{line_no}行目: 読めない行です: {statement}")
+            except KifuImportError as e:
+                game.fail(e)
+                break
+    if not game.empty or game.error:
+        yield game
+
+
+def read_kifu(stream, filename=None, kifu_format=None, encoding=None):
+    """バイナリのストリームから対局を順に返す（形式・文字コードは省略時に判定）"""
+    lines = iter_lines(stream, encoding)
+    first = next(lines, None)
+    if first is None:
+        return
+    if kifu_format is None:
+        kifu_format = detect_format(filename, first.lstrip("﻿"))
+    parser = parse_csa if kifu_format == "csa" else parse_kif
+
+    def all_lines():
+        yield first.lstrip("﻿")
+        yield from lines
+
+    yield from parser(all_lines(), filename)
+
+
+def new_game_id():
+    return f"import-{uuid.uuid4().hex[:12]}"
+
+
+def iter_paths(paths):
+    """ファイルとディレクトリ（再帰的に棋譜ファイルを探す）から棋譜ファイルを順に返す"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in EXTENSIONS:
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def upload(url, path, commentary, batch_size, timeout):
+    """起動中のapp.pyの/api/importに1ファイルを送信"""
+    query = f"?commentary={int(commentary)}&filename={urllib.parse.quote(os.path.basename(path))}"
+    if batch_size:
+        query += f"&commentaryBatchSize={batch_size}"
+    with open(path, "rb") as f:
+        request = urllib.request.Request(
+            url.rstrip("/") + "/api/import" + query,
+            data=f.read(),
+            method="POST",
+            headers={"Content-Type": "application/octet-stream"},
+        )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read() or b"{}")
+
+
+async def import_local(paths, args):
+    """app.pyの対局ストアに直接取り込み、解説を並行して生成"""
+    import app
+
+    semaphore = asyncio.Semaphore(max(1, args.concurrency))
+    totals = {"games": 0, "errors": 0, "plies": 0}
+    tasks = set()
+
+    async def annotate(game_data):
+        async with semaphore:
+            await app.annotate_game(game_data, args.batch_size or None)
+        app.store_game(game_data)
+
+    for path in paths:
+        with open(path, "rb") as f:
+            for parsed in read_kifu(f, path):
+                if parsed.error:
+                    totals["errors"] += 1
+                    print(
+                        f"{path} #{parsed.index + 1}: {parsed.error}", file=sys.stderr
+                    )
+                    continue
+                game_data = parsed.to_game_data(
+                    new_game_id(), app.convert_usi_to_japanese
+                )
+                app.store_game(game_data)
+                totals["games"] += 1
+                totals["plies"] += len(parsed.moves)
+                if args.commentary:
+                    task = asyncio.create_task(annotate(game_data))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    # 読み込みが解説の生成より先に進みすぎないようにする
+                    while len(tasks) >= args.concurrency * 4:
+                        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    if tasks:
+        await asyncio.gather(*tasks)
+    await app.close_async_client()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KIF・CSAの棋譜の一括取り込み")
+    parser.add_argument("paths", nargs="+", help="棋譜ファイルまたはディレクトリ")
+    parser.add_argument(
+        "--commentary", action="store_true", help="解説のない手にAI解説を生成する"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="同時に解説を生成する対局数"
+    )
+    parser.add_argument("--batch-size", type=int, default=0, help="解説のまとめ数")
+    parser.add_argument(
+        "--url", help="起動中のapp.pyのURL（省略時は対局ストアに直接取り込む）"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="読み込みと検証のみ行い保存しない"
+    )
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = iter_paths(args.paths)
+    if args.dry_run:
+        totals = {"games": 0, "errors": 0, "plies": 0}
+        for path in paths:
+            with open(path, "rb") as f:
+                for parsed in read_kifu(f, path):
+                    if parsed.error:
+                        totals["errors"] += 1
+                        print(
+                            f"{path} #{parsed.index + 1}: {parsed.error}",
+                            file=sys.stderr,
+                        )
+                    else:
+                        totals["games"] += 1
+                        totals["plies"] += len(parsed.moves)
+    elif args.url:
+        totals = {"games": 0, "errors": 0, "plies": 0}
+        for path in paths:
+            result = upload(
+                args.url, path, args.commentary, args.batch_size, args.timeout
+            )
+            if not result.get("success"):
+                totals["errors"] += 1
+                print(f"{path}: {result.get('error')}", file=sys.stderr)
+                continue
+            totals["games"] += len(result["imported"])
+            totals["plies"] += sum(game["plies"] for game in result["imported"])
+            totals["errors"] += len(result["errors"])
+            for error in result["errors"]:
+                print(f"{path} #{error['game']}: {error['error']}", file=sys.stderr)
+    else:
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        totals = asyncio.run(import_local(paths, args))
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{totals['games']}局（{totals['plies']}手）を取り込みました  "
+        f"エラー{totals['errors']}局  {elapsed:.1f}秒"
+    )
+    return 1 if totals["errors"] and not totals["games"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
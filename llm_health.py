@@ -0,0 +1,117 @@
+"""LLM（OpenAI互換API）への接続状態のバックグラウンド確認
+
+起動時にはAPIに接続せず、最初に使うときに確認用のスレッドを起動して定期的に確認し、
+LLMモードとオフラインモード（サンプルデータ・内蔵エンジン）を切り替える。
+最初の確認が終わるまでは、APIキーが設定されていればLLMモードとして扱う。
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 接続状態
+UNKNOWN = "unknown"
+ONLINE = "online"
+OFFLINE = "offline"
+DISABLED = "disabled"
+
+
+class LLMHealth:
+    """接続確認を定期的に行い、LLMを使えるかどうかを保持する
+
+    checkは例外を送出しなければ接続できたとみなす関数で、確認用のスレッドで呼ばれる。
+    接続できている間はinterval秒ごと、できない間はoffline_interval秒ごとに確認する。
+    enabledが偽（APIキー未設定など）の場合は確認せず、常に使えないものとして扱う。
+    """
+
+    def __init__(self, check, enabled=True, interval=60.0, offline_interval=10.0):
+        self.check = check
+        self.enabled = enabled
+        self.interval = interval
+        self.offline_interval = offline_interval
+        self.state = UNKNOWN if enabled else DISABLED
+        self.checks = 0
+        self.failures = 0
+        self.last_checked = None
+        self.last_latency = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def available(self):
+        """LLMを使えるか（確認前は使えるものとして扱う）"""
+        return self.state in (UNKNOWN, ONLINE)
+
+    def start(self):
+        """確認用のスレッドを起動（無効な場合・起動済みの場合は何もしない）"""
+        if not self.enabled or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="llm-health", daemon=True
+            )
+            self._thread.start()
+
+    def request_check(self):
+        """次の確認を待たずにすぐ確認させる（LLM呼び出しが失敗した場合など）"""
+        self._wake.set()
+
+    def check_now(self):
+        """接続を確認して状態を更新し、新しい状態を返す"""
+        start = time.perf_counter()
+        try:
+            self.check()
+            error = None
+        except Exception as e:
+            error = e
+        with self._lock:
+            previous = self.state
+            self.checks += 1
+            self.last_checked = time.time()
+            self.last_latency = time.perf_counter() - start
+            if error is None:
+                self.state = ONLINE
+                self.last_error = None
+            else:
+                self.failures += 1
+                self.state = OFFLINE
+                self.last_error = str(error)
+            state = self.state
+        if state != previous:
+            if error is None:
+                logger.info("OpenAI API接続確認: 成功（LLMモード）")
+            else:
+                logger.warning(
+                    "OpenAI API接続確認: 失敗（オフラインモードで動作します）: %s",
+                    error,
+                )
+        return state
+
+    def stats(self):
+        """接続状態を取得"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "available": self.state in (UNKNOWN, ONLINE),
+                "checks": self.checks,
+                "failures": self.failures,
+                "lastChecked": self.last_checked,
+                "lastLatencyMs": (
+                    round(self.last_latency * 1000, 1)
+                    if self.last_latency is not None
+                    else None
+                ),
+                "lastError": self.last_error,
+            }
+
+    def _run(self):
+        while True:
+            state = self.check_now()
+            self._wake.wait(self.interval if state == ONLINE else self.offline_interval)
+            self._wake.clear()
@@ -0,0 +1,305 @@
+"""起動中のapp.pyへの負荷試験ツール
+
+/api/start_gameで対局を投入しながら、多数の観戦者が/api/board_stateで
+盤面を取得し続ける状況を再現し（観戦者は生成が完了して保存された対局の、その対局の手数までを見る）、エンドポイントごとのスループットと
+p50/p95/p99レイテンシ、対局の完了時間を表示する。
+APIを使わずに試す場合はfake_openai.pyの偽サーバーにapp.pyを向けておく。
+
+使い方:
+    python fake_openai.py --latency 0.3 --jitter 0.1 &
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:8081/v1 python app.py &
+    python loadtest.py --games 20 --viewers 50 --duration 30
+    python loadtest.py --sente-type random --gote-type engine --output result.json
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def http_request(method, url, body=None, timeout=30.0):
+    """(ステータス, 所要秒数, JSON) を返す（接続エラーはステータス0）"""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method)
+    if data is not None:
+        request.add_header("Content-Type", "application/json")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, payload = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, payload = e.code, e.read()
+    except (urllib.error.URLError, OSError):
+        return 0, time.perf_counter() - start, None
+    elapsed = time.perf_counter() - start
+    try:
+        return status, elapsed, json.loads(payload)
+    except ValueError:
+        return status, elapsed, None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+class Recorder:
+    """エンドポイントごとのレイテンシとステータスを記録"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def add(self, name, status, elapsed):
+        with self._lock:
+            self._samples.setdefault(name, []).append((status, elapsed))
+
+    def summary(self, duration):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        result = {}
+        for name, values in sorted(samples.items()):
+            latencies = sorted(elapsed for _, elapsed in values)
+            statuses = {}
+            for status, _ in values:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            result[name] = {
+                "requests": len(values),
+                "errors": sum(1 for status, _ in values if not 200 <= status < 300),
+                "statuses": statuses,
+                "throughput": round(len(values) / duration, 2) if duration else 0.0,
+                "p50Ms": round(percentile(latencies, 0.50) * 1000, 2),
+                "p95Ms": round(percentile(latencies, 0.95) * 1000, 2),
+                "p99Ms": round(percentile(latencies, 0.99) * 1000, 2),
+                "maxMs": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            }
+        return result
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.url.rstrip("/")
+        self.recorder = Recorder()
+        self.games = []
+        self.games_lock = threading.Lock()
+        self.completed = {}
+        # 生成が完了して保存された対局の (対局ID, 手数)。観戦者はこの中から選ぶ
+        self.finished = []
+        self.failed = 0
+        self.stop = threading.Event()
+        self.submitted = threading.Event()
+
+    def start_game(self, index):
+        """対局を1つ投入（待ち行列が満杯ならRetry-Afterに従って再試行）"""
+        args = self.args
+        body = {
+            "maxMoves": args.max_moves,
+            "senteType": args.sente_type,
+            "goteType": args.gote_type,
+            "commentaryBatchSize": args.batch_size,
+        }
+        while not self.stop.is_set():
+            status, elapsed, payload = http_request(
+                "POST", f"{self.base_url}/api/start_game", body, args.timeout
+            )
+            self.recorder.add("start_game", status, elapsed)
+            if status == 202 and payload:
+                with self.games_lock:
+                    self.games.append(
+                        (payload["jobId"], payload["gameId"], time.time())
+                    )
+                return
+            if status != 429 or not args.retry_queue_full:
+                return
+            self.stop.wait(args.retry_interval)
+
+    def submit_games(self):
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(self.start_game, range(self.args.games)))
+        self.submitted.set()
+
+    def viewer(self, seed):
+        """完了した対局からランダムな対局・手数の盤面を取得し続ける観戦者
+
+        生成中の対局や手数を超えた盤面はサーバーがサンプルデータで代替するため選ばない。
+        """
+        rng = random.Random(seed)
+        while not self.stop.is_set():
+            with self.games_lock:
+                game = rng.choice(self.finished) if self.finished else None
+            if game is None:
+                self.stop.wait(0.05)
+                continue
+            game_id, total_moves = game
+            move_number = rng.randint(0, total_moves)
+            status, elapsed, _ = http_request(
+                "GET",
+                f"{self.base_url}/api/board_state/{game_id}/{move_number}",
+                timeout=self.args.timeout,
+            )
+            self.recorder.add("board_state", status, elapsed)
+            if self.args.think_time:
+                self.stop.wait(rng.uniform(0, 2 * self.args.think_time))
+
+    def poll_jobs(self):
+        """対局生成ジョブの完了を確認して、投入から完了までの時間を記録"""
+        while not self.stop.is_set():
+            with self.games_lock:
+                pending = [g for g in self.games if g[0] not in self.completed]
+            for job_id, game_id, submitted_at in pending:
+                status, elapsed, payload = http_request(
+                    "GET",
+                    f"{self.base_url}/api/jobs/{job_id}",
+                    timeout=self.args.timeout,
+                )
+                self.recorder.add("jobs", status, elapsed)
+                job_status = payload and payload.get("job", {}).get("status")
+                if job_status in ("done", "failed"):
+                    self.completed[job_id] = time.time() - submitted_at
+                    if job_status == "failed":
+                        self.failed += 1
+                    elif payload.get("gameData"):
+                        with self.games_lock:
+                            self.finished.append(
+                                (game_id, len(payload["gameData"]["moves"]))
+                            )
+            if (
+                self.args.wait_games
+                and self.submitted.is_set()
+                and len(self.completed) >= len(self.games)
+            ):
+                return
+            self.stop.wait(self.args.poll_interval)
+
+    def run(self):
+        args = self.args
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.submit_games, daemon=True)]
+        threads += [
+            threading.Thread(target=self.viewer, args=(args.seed + i,), daemon=True)
+            for i in range(args.viewers)
+        ]
+        poller = threading.Thread(target=self.poll_jobs, daemon=True)
+        for thread in threads + [poller]:
+            thread.start()
+
+        deadline = started + args.duration
+        while time.perf_counter() < deadline:
+            if args.wait_games and not poller.is_alive():
+                break
+            time.sleep(0.1)
+        self.stop.set()
+        for thread in threads + [poller]:
+            thread.join(timeout=args.timeout)
+        duration = time.perf_counter() - started
+
+        game_times = sorted(self.completed.values())
+        return {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "url": self.base_url,
+                "duration": round(duration, 2),
+                "viewers": args.viewers,
+                "games": args.games,
+                "maxMoves": args.max_moves,
+                "players": [args.sente_type, args.gote_type],
+            },
+            "endpoints": self.recorder.summary(duration),
+            "games": {
+                "submitted": len(self.games),
+                "completed": len(game_times),
+                "failed": self.failed,
+                "gamesPerMinute": round(len(game_times) / duration * 60, 2),
+                "p50Seconds": round(percentile(game_times, 0.50), 2),
+                "p95Seconds": round(percentile(game_times, 0.95), 2),
+            },
+        }
+
+
+def print_report(report):
+    meta = report["meta"]
+    print(
+        f"{meta['url']}  {meta['duration']}秒  観戦者{meta['viewers']}  "
+        f"対局{meta['games']}（最大{meta['maxMoves']}手）"
+    )
+    print(
+        f"{'endpoint':<14}{'requests':>10}{'errors':>8}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    print("-" * 82)
+    for name, stats in report["endpoints"].items():
+        print(
+            f"{name:<14}{stats['requests']:>10}{stats['errors']:>8}"
+            f"{stats['throughput']:>10.2f}{stats['p50Ms']:>10.2f}"
+            f"{stats['p95Ms']:>10.2f}{stats['p99Ms']:>10.2f}{stats['maxMs']:>10.2f}"
+        )
+    games = report["games"]
+    print(
+        f"対局: 投入{games['submitted']} 完了{games['completed']} 失敗{games['failed']}  "
+        f"{games['gamesPerMinute']}局/分  完了時間 p50 {games['p50Seconds']}秒 "
+        f"p95 {games['p95Seconds']}秒"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.pyの負荷試験")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="app.pyのURL")
+    parser.add_argument("--games", type=int, default=10, help="投入する対局数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に投入する数")
+    parser.add_argument("--viewers", type=int, default=20, help="同時観戦者数")
+    parser.add_argument("--duration", type=float, default=30.0, help="試験時間（秒）")
+    parser.add_argument("--max-moves", type=int, default=20, help="1局の最大手数")
+    parser.add_argument(
+        "--sente-type", default="llm", choices=("llm", "engine", "random")
+    )
+    parser.add_argument(
+        "--gote-type", default="llm", choices=("llm", "engine", "random")
+    )
+    parser.add_argument("--batch-size", type=int, default=1, help="解説のまとめ数")
+    parser.add_argument(
+        "--think-time", type=float, default=0.0, help="観戦者の平均待機秒数"
+    )
+    parser.add_argument(
+        "--wait-games",
+        action="store_true",
+        help="すべての対局が完了したら試験時間前でも終了する",
+    )
+    parser.add_argument(
+        "--retry-queue-full",
+        action="store_true",
+        help="待ち行列が満杯（429）の場合に投入を再試行する",
+    )
+    parser.add_argument("--retry-interval", type=float, default=2.0)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果をJSONで保存するファイル")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで表示")
+    args = parser.parse_args()
+
+    report = LoadTest(args).run()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
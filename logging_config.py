@@ -0,0 +1,64 @@
+import json
+import logging
+import os
+import sys
+import time
+
+# LogRecordが元から持つ属性（これ以外をextraで渡された構造化フィールドとして扱う）
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {
+    "message",
+    "asctime",
+}
+
+
+def _fields(record):
+    return {
+        key: value
+        for key, value in record.__dict__.items()
+        if key not in _RECORD_ATTRIBUTES and not key.startswith("_")
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1レコードのJSON形式（extraで渡したフィールドも含める）"""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+            + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """人が読むためのテキスト形式（extraのフィールドはkey=valueで末尾に付ける）"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = _fields(record)
+        if fields:
+            suffix = " ".join(f"{key}={value}" for key, value in fields.items())
+            first, newline, rest = text.partition("\n")
+            text = f"{first} {suffix}{newline}{rest}"
+        return text
+
+
+def setup_logging(level=None, log_format=None, stream=None):
+    """ルートロガーを設定（LOG_LEVEL・LOG_FORMAT環境変数で変更可能、既定の出力先は標準出力）"""
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    log_format = (log_format or os.getenv("LOG_FORMAT", "text")).lower()
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
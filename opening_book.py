@@ -0,0 +1,384 @@
+"""定跡（オープニングブック）の作成と参照
+
+局面のハッシュ → 重み付きの候補手（解説付き）の索引をバイナリファイルに保存し、
+mmapで開いて二分探索する。起動時に全体を読み込まないため、大きな定跡でもすぐに使える。
+
+ファイル形式（リトルエンディアン）:
+    ヘッダ   : マジック"SGBK", バージョン(u16), 組み込み定跡の版(u16、棋譜ファイルから作成した場合は0),
+               局面数(u32), 手数(u32), 解説数(u32)
+    局面表   : 局面キー(u64), 最初の手の番号(u32), 手の数(u16), 予約(u16) を局面キー順に並べる
+    手の表   : 手コード(u16), 重み(u16), 解説の番号(u32、なしは0xFFFFFFFF)
+    解説表   : 各解説の開始位置(u32) × (解説数 + 1) と、UTF-8の文字列を連結したもの
+
+使い方:
+    python opening_book.py build -o data/opening_book.bin games.txt games.json
+    python opening_book.py show data/opening_book.bin --sfen "<SFEN>"
+
+入力ファイルは1行に1局のUSI（"startpos moves ..."、"sfen <SFEN> moves ..."、
+または指し手だけを空白区切り）か、対局データのJSON（movesにmoveUsiとcommentary）。
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+
+import shogi
+
+from fastboard import Position, decode_move, encode_move
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SGBK"
+VERSION = 2
+HEADER = struct.Struct("<4sHHIII")
+ENTRY = struct.Struct("<QIHH")
+MOVE = struct.Struct("<HHI")
+OFFSET = struct.Struct("<I")
+NO_COMMENTARY = 0xFFFFFFFF
+MAX_WEIGHT = 0xFFFF
+
+# 組み込みの定跡（重み, USIの指し手）。戦型ごとに重みを付け、対局ごとに違う序盤になるようにする
+STANDARD_LINES = [
+    (6, "7g7f 8c8d 6g6f 3c3d 6i7h 7a6b 5g5f 5c5d 3i4h 3a4b 4i5h 4a3b 5i6i 5a4a"),
+    (5, "2g2f 8c8d 7g7f 3c3d 8h2b+ 3a2b 7i8h 2b3c 3i3h 7a7b 4g4f 6a5b"),
+    (4, "2g2f 8c8d 2f2e 8d8e 6i7h 4a3b 2e2d 2c2d 2h2d P*2c 2d2f 7a7b"),
+    (4, "7g7f 3c3d 2g2f 8c8d 2f2e 8d8e 6i7h 4a3b 2e2d 2c2d 2h2d 8e8f 8g8f 8b8f"),
+    (5, "7g7f 3c3d 6g6f 8c8d 2h6h 7a6b 5i4h 5a4b 4h3h 4b3b 3h2h 8d8e 8h7g 6a5b"),
+    (3, "7g7f 3c3d 2h7h 8c8d 5i4h 5a4b 4h3h 4b3b 3h2h 7a6b 6g6f 8d8e 8h7g 6a5b"),
+    (4, "7g7f 3c3d 2g2f 5c5d 2f2e 8b5b 5i6h 5a6b 6h7h 6b7b 3i4h 7b8b"),
+    (3, "7g7f 8c8d 5g5f 8d8e 8h7g 3c3d 2h5h 7a6b 5i4h 5a4b 4h3h 4b3b"),
+]
+# 組み込みの定跡（STANDARD_LINESと種の対局）の版。変えると自動作成した定跡ファイルを作り直す
+SEED_REVISION = 1
+
+
+def position_hash(sfen):
+    """SFENから手数を除いた局面の64ビットハッシュ"""
+    text = " ".join(sfen.split()[:3])
+    return int.from_bytes(
+        hashlib.blake2b(text.encode(), digest_size=8).digest(), "little"
+    )
+
+
+class OpeningBookBuilder:
+    """対局の棋譜を集計して定跡ファイルを作成する
+
+    各対局の先頭max_plies手について、局面ごとに指された手の回数を重みとして数える。
+    解説は同じ局面・同じ手で最初に見つかった空でないものを使う。
+    """
+
+    def __init__(self, max_plies=24):
+        self.max_plies = max_plies
+        self.positions = {}
+        self.games = 0
+
+    def add_game(self, moves_usi, commentaries=None, sfen=None, weight=1):
+        """1局分の指し手をweight局分として追加（不正な手があればその手前で打ち切る）"""
+        position = Position(sfen)
+        for ply, move_usi in enumerate(moves_usi[: self.max_plies]):
+            try:
+                move = shogi.Move.from_usi(move_usi)
+                legal = move in position.legal_moves
+            except ValueError:
+                legal = False
+            if not legal:
+                logger.warning(
+                    "定跡の元の棋譜に不正な手があるため%d手目以降を除外します: %s",
+                    ply + 1,
+                    move_usi,
+                )
+                break
+            moves = self.positions.setdefault(position_hash(position.sfen()), {})
+            code = encode_move(move)
+            count, commentary = moves.get(code, (0, None))
+            if not commentary and commentaries and ply < len(commentaries):
+                commentary = commentaries[ply] or None
+            moves[code] = (min(count + weight, MAX_WEIGHT), commentary)
+            position.push(move)
+        self.games += 1
+
+    def add_game_data(self, game_data):
+        """アプリの対局データ（movesにmoveUsiとcommentary）を追加"""
+        moves = game_data.get("moves", [])
+        self.add_game(
+            [move_data["moveUsi"] for move_data in moves],
+            [move_data.get("commentary") for move_data in moves],
+        )
+
+    def add_usi_line(self, line, weight=1):
+        """1行のUSI棋譜を追加"""
+        tokens = line.split()
+        if not tokens:
+            return
+        sfen = None
+        if tokens[0] == "startpos":
+            tokens = tokens[1:]
+        elif tokens[0] == "sfen":
+            sfen = " ".join(tokens[1:5])
+            tokens = tokens[5:]
+        if tokens and tokens[0] == "moves":
+            tokens = tokens[1:]
+        self.add_game(tokens, sfen=sfen, weight=weight)
+
+    def add_file(self, path):
+        """USIまたはJSONの棋譜ファイルを追加"""
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if path.endswith(".json"):
+            data = json.loads(text)
+            for game_data in data if isinstance(data, list) else [data]:
+                self.add_game_data(game_data)
+        else:
+            for line in text.splitlines():
+                if line.strip() and not line.startswith("#"):
+                    self.add_usi_line(line)
+
+    def write(self, path, revision=0):
+        """定跡ファイルを書き出す（一時ファイルから置き換えるので読み込み中でも安全）
+
+        revisionは組み込み定跡から作成した場合のSEED_REVISION（棋譜ファイルからは0）。
+        """
+        strings = []
+        string_index = {}
+        entries = []
+        moves = []
+        for key in sorted(self.positions):
+            candidates = sorted(
+                self.positions[key].items(), key=lambda item: item[1][0], reverse=True
+            )
+            entries.append((key, len(moves), len(candidates)))
+            for code, (weight, commentary) in candidates:
+                index = NO_COMMENTARY
+                if commentary:
+                    index = string_index.get(commentary)
+                    if index is None:
+                        index = string_index[commentary] = len(strings)
+                        strings.append(commentary)
+                moves.append((code, weight, index))
+
+        blobs = [s.encode("utf-8") for s in strings]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(
+                    HEADER.pack(
+                        MAGIC,
+                        VERSION,
+                        revision,
+                        len(entries),
+                        len(moves),
+                        len(strings),
+                    )
+                )
+                for key, first, count in entries:
+                    f.write(ENTRY.pack(key, first, count, 0))
+                for code, weight, index in moves:
+                    f.write(MOVE.pack(code, weight, index))
+                for offset in offsets:
+                    f.write(OFFSET.pack(offset))
+                f.write(b"".join(blobs))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return len(entries), len(moves)
+
+
+class BookMove:
+    """定跡の候補手"""
+
+    def __init__(self, move, weight, commentary):
+        self.move = move
+        self.weight = weight
+        self.commentary = commentary
+
+    def __repr__(self):
+        return f"BookMove({self.move.usi()}, weight={self.weight})"
+
+
+class OpeningBook:
+    """mmapで開いた定跡ファイル（ファイルがなければ空の定跡として動作）"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._mm = None
+        self.revision = 0
+        self.positions = 0
+        self.moves = 0
+        self.strings = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            with open(path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.revision, self.positions, self.moves, self.strings = (
+                HEADER.unpack_from(self._mm, 0)
+            )
+            if magic != MAGIC or version != VERSION:
+                self.close()
+                raise ValueError(f"not an opening book file: {path}")
+            self._moves_offset = HEADER.size + ENTRY.size * self.positions
+            self._offsets_offset = self._moves_offset + MOVE.size * self.moves
+            self._strings_offset = self._offsets_offset + OFFSET.size * (
+                self.strings + 1
+            )
+
+    def __len__(self):
+        return self.positions
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            self.positions = 0
+
+    def _find(self, key):
+        """局面キーを二分探索して (最初の手の番号, 手の数) を返す"""
+        low, high = 0, self.positions - 1
+        while low <= high:
+            middle = (low + high) // 2
+            entry_key, first, count, _ = ENTRY.unpack_from(
+                self._mm, HEADER.size + ENTRY.size * middle
+            )
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle - 1
+            else:
+                return first, count
+        return None
+
+    def _commentary(self, index):
+        if index == NO_COMMENTARY:
+            return None
+        start, end = struct.unpack_from(
+            "<II", self._mm, self._offsets_offset + OFFSET.size * index
+        )
+        base = self._strings_offset
+        return self._mm[base + start : base + end].decode("utf-8")
+
+    def lookup(self, board):
+        """局面の候補手（BookMoveのリスト、重い順）を取得"""
+        found = self._find(position_hash(board.sfen())) if self._mm else None
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return []
+            self.hits += 1
+        first, count = found
+        candidates = []
+        for i in range(first, first + count):
+            code, weight, index = MOVE.unpack_from(
+                self._mm, self._moves_offset + MOVE.size * i
+            )
+            candidates.append(
+                BookMove(decode_move(code), weight, self._commentary(index))
+            )
+        return candidates
+
+    def choose(self, board, rng=random):
+        """重みに応じて定跡手を1つ選ぶ（定跡にない・合法でない場合はNone）"""
+        candidates = self.lookup(board)
+        if not candidates:
+            return None
+        legal_moves = board.legal_moves
+        candidates = [c for c in candidates if c.move in legal_moves]
+        if not candidates:
+            return None
+        return rng.choices(candidates, weights=[c.weight for c in candidates])[0]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "positions": self.positions,
+                "moves": self.moves,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def load_opening_book(path, seed_games=(), max_plies=24, seed_lines=STANDARD_LINES):
+    """定跡ファイルを開く
+
+    ファイルがない・古い形式・古い版の組み込み定跡から作ったものであれば、seed_lines
+    （重み付きのUSI棋譜）とseed_games（対局データ）から作り直してから開く。
+    棋譜ファイルから作成した定跡（版が0）はそのまま使う。
+    """
+    if not path:
+        return OpeningBook(None)
+    if not seed_games and not seed_lines:
+        return OpeningBook(path)
+
+    book = None
+    if os.path.exists(path):
+        try:
+            book = OpeningBook(path)
+        except ValueError:
+            logger.info("古い形式の定跡ファイルを作り直します: %s", path)
+    if book is not None and book.revision in (0, SEED_REVISION):
+        return book
+    if book is not None:
+        book.close()
+
+    builder = OpeningBookBuilder(max_plies)
+    for weight, line in seed_lines:
+        builder.add_usi_line(line, weight)
+    for game_data in seed_games:
+        builder.add_game_data(game_data)
+    builder.write(path, SEED_REVISION)
+    return OpeningBook(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="定跡ファイルの作成と確認")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="棋譜ファイルから定跡を作成")
+    build.add_argument("files", nargs="+", help="USI（1行1局）またはJSONの棋譜ファイル")
+    build.add_argument("-o", "--output", required=True, help="出力する定跡ファイル")
+    build.add_argument("--max-plies", type=int, default=24, help="定跡に含める手数")
+
+    show = commands.add_parser("show", help="局面の定跡手を表示")
+    show.add_argument("book", help="定跡ファイル")
+    show.add_argument(
+        "--sfen", default=shogi.STARTING_SFEN, help="局面（省略時は初期局面）"
+    )
+
+    args = parser.parse_args()
+    if args.command == "build":
+        builder = OpeningBookBuilder(args.max_plies)
+        for path in args.files:
+            builder.add_file(path)
+        positions, moves = builder.write(args.output)
+        print(
+            f"{builder.games}局から{positions}局面・{moves}手の定跡を作成しました: {args.output}"
+        )
+    else:
+        book = OpeningBook(args.book)
+        print(f"{len(book)}局面")
+        for candidate in book.lookup(Position(args.sfen)):
+            print(
+                f"  {candidate.move.usi()} 重み{candidate.weight} {candidate.commentary or ''}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""fastboardの指し手生成をpython-shogiと突き合わせて検証するperftスクリプト
+
+使い方:
+    python perft.py            # 既定の局面を深さ3まで検証
+    python perft.py --depth 2 --sfen "<SFEN>"
+"""
+
+import argparse
+import sys
+import time
+
+import shogi
+
+from fastboard import Position, perft
+
+# 検証用の局面（初期局面・中盤・持ち駒の多い局面・成り/打ち歩詰めの絡む局面）
+TEST_POSITIONS = [
+    shogi.STARTING_SFEN,
+    "lnsgkgsnl/1r5b1/pppppp1pp/6p2/9/2P6/PP1PPPPPP/1B5R1/LNSGKGSNL b - 3",
+    "ln1g1g1nl/1ks2r3/1pppp1bpp/p3spp2/9/P1P1SP1PP/1PBPP1P2/2KS2R2/LN1G1G1NL b - 25",
+    "l6nl/5+P1gk/2np1S3/p1p4Pp/3P2Sp1/1PPb2P1P/P5GS1/R8/LN4bKL w RGgsn5p 1",
+    "8l/1l+R2P3/p2pBG1pp/kps1p4/Nn1P2G2/P1P1P2PP/1PS6/1KSG3+r1/LN2+p3L w Sbgn3p 124",
+    "4k4/9/4P4/9/9/9/9/9/4K4 b P 1",
+    "7nk/7p1/8P/9/9/9/9/9/K8 b P 1",
+    "3r1g3/l2s1bg1l/k1+N1n1r1b/3nps1Gp/1Gp1PP1PP/1P7/2P1S1PpL/K8/LN1Ps4 b 5Pp 141",
+]
+
+
+def python_shogi_perft(board, depth):
+    """python-shogiによる参照実装"""
+    if depth == 0:
+        return 1
+    moves = list(board.legal_moves)
+    if depth == 1:
+        return len(moves)
+    total = 0
+    for move in moves:
+        board.push(move)
+        total += python_shogi_perft(board, depth - 1)
+        board.pop()
+    return total
+
+
+def divide(sfen, depth):
+    """ルートの手ごとにノード数を比較し、食い違う手を表示"""
+    board = shogi.Board(sfen)
+    position = Position(sfen)
+    expected = {}
+    for move in board.legal_moves:
+        board.push(move)
+        expected[move.usi()] = python_shogi_perft(board, depth - 1)
+        board.pop()
+
+    actual = {}
+    for move in position.legal_moves:
+        position.push(move)
+        actual[move.usi()] = perft(position, depth - 1)
+        position.pop()
+
+    for usi in sorted(set(expected) | set(actual)):
+        if expected.get(usi) != actual.get(usi):
+            print(
+                f"  {usi}: python-shogi={expected.get(usi)} fastboard={actual.get(usi)}"
+            )
+
+
+def run(sfens, max_depth):
+    ok = True
+    for sfen in sfens:
+        print(sfen)
+        for depth in range(1, max_depth + 1):
+            start = time.perf_counter()
+            expected = python_shogi_perft(shogi.Board(sfen), depth)
+            reference_time = time.perf_counter() - start
+
+            position = Position(sfen)
+            start = time.perf_counter()
+            actual = perft(position, depth)
+            fast_time = time.perf_counter() - start
+
+            status = "OK" if actual == expected else "NG"
+            speedup = reference_time / fast_time if fast_time > 0 else 0
+            print(
+                f"  depth {depth}: {actual} / {expected} {status} "
+                f"(python-shogi {reference_time:.3f}s, fastboard {fast_time:.3f}s, "
+                f"x{speedup:.1f})"
+            )
+            if actual != expected:
+                ok = False
+                divide(sfen, depth)
+                break
+            if position.sfen() != sfen:
+                print("  NG: 局面が元に戻っていません")
+                ok = False
+                break
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fastboardのperft検証")
+    parser.add_argument("--depth", type=int, default=3, help="最大の深さ")
+    parser.add_argument("--sfen", action="append", help="検証する局面（複数指定可）")
+    args = parser.parse_args()
+
+    ok = run(args.sfen or TEST_POSITIONS, args.depth)
+    print("すべて一致しました" if ok else "不一致があります")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
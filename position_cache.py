@@ -0,0 +1,108 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import shogi
+
+logger = logging.getLogger(__name__)
+
+
+class PositionCache:
+    """対局ごとの局面チェックポイント（SFEN）を保持するLRUキャッシュ
+
+    k手ごとのチェックポイントと、最後に返した局面を記録しておくことで、
+    任意の手数の局面を最大k手の再生で復元できるようにする。
+    board_factoryはSFENから盤面を作る関数（既定はpython-shogiのBoard）。
+    """
+
+    def __init__(self, interval=8, max_games=256, board_factory=shogi.Board):
+        self.interval = max(1, interval)
+        self.board_factory = board_factory
+        self.max_games = max(1, max_games)
+        self._games = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, game_id):
+        """対局のエントリを取得（LRU順序を更新し、上限超過分を破棄）"""
+        entry = self._games.get(game_id)
+        if entry is None:
+            entry = {
+                "checkpoints": {0: shogi.STARTING_SFEN},
+                "last": None,
+                "limit": None,
+            }
+            self._games[game_id] = entry
+            while len(self._games) > self.max_games:
+                self._games.popitem(last=False)
+        else:
+            self._games.move_to_end(game_id)
+        return entry
+
+    def get_board(self, game_id, moves_usi, move_number):
+        """指定した手数の盤面を返す
+
+        戻り値は (board, applied) のタプル。appliedは実際に適用できた手数で、
+        不正な指し手があった場合はその手前で止まる。
+        """
+        target = max(0, min(move_number, len(moves_usi)))
+
+        with self._lock:
+            entry = self._entry(game_id)
+            # 不正手で止まった対局はそれ以上進めない
+            if entry["limit"] is not None:
+                target = min(target, entry["limit"])
+
+            # 目標手数以下で最も近いチェックポイントを探す
+            start = target - (target % self.interval)
+            while start not in entry["checkpoints"]:
+                start -= self.interval
+            sfen = entry["checkpoints"][start]
+
+            last = entry["last"]
+            if last is not None and start <= last[0] <= target:
+                start, sfen = last
+
+            if start == target:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        board = self.board_factory(sfen)
+        applied = start
+        new_checkpoints = {}
+        for i in range(start, target):
+            try:
+                board.push_usi(moves_usi[i])
+            except Exception as e:
+                logger.warning(
+                    "Error applying move %d: %s", i + 1, e, extra={"gameId": game_id}
+                )
+                with self._lock:
+                    self._entry(game_id)["limit"] = i
+                break
+            applied = i + 1
+            if applied % self.interval == 0:
+                new_checkpoints[applied] = board.sfen()
+
+        with self._lock:
+            entry = self._entry(game_id)
+            entry["checkpoints"].update(new_checkpoints)
+            entry["last"] = (applied, board.sfen())
+
+        return board, applied
+
+    def invalidate(self, game_id):
+        """対局のキャッシュを破棄"""
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def stats(self):
+        """キャッシュの統計情報を取得"""
+        with self._lock:
+            return {
+                "games": len(self._games),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,267 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 優先度（小さいほど先に送る。次の手の選択は対局の進行を止めるので解説より優先）
+MOVE_PRIORITY = 0
+COMMENTARY_PRIORITY = 1
+PRIORITY_NAMES = {MOVE_PRIORITY: "move", COMMENTARY_PRIORITY: "commentary"}
+
+# 待機中に状態を確認し直す最大の間隔（秒）
+MAX_POLL_INTERVAL = 0.5
+# 先頭でない待機者が確認し直す最小の間隔（秒）
+MIN_POLL_INTERVAL = 0.01
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value):
+    """レート制限ヘッダの時間（"1s"、"6m0s"、"20ms"、"0.5"など）を秒に変換"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """リクエストのトークン数の見積もり（日本語は1文字1トークン前後として多めに数える）"""
+    prompt = sum(len(str(message.get("content", ""))) for message in messages or ())
+    return prompt + 4 * len(messages or ()) + (max_tokens or 0)
+
+
+class TokenBucket:
+    """1分あたりの上限で補充されるトークンバケット"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        rate = self.capacity / 60.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """amountを取り出せるまでの秒数"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.capacity / 60.0)
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def give(self, amount, now):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def limit(self, remaining, capacity, now):
+        """サーバーから返された残量・上限に合わせる（こちらの見積もりより少ない場合のみ）"""
+        self._refill(now)
+        if capacity is not None and 0 < capacity < self.capacity:
+            self.capacity = float(capacity)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class RateLimiter:
+    """OpenAI APIの呼び出しをプロセス全体で調整するレート制限
+
+    1分あたりのリクエスト数とトークン数のトークンバケットで送信を調整する。
+    待機中の呼び出しは優先度順（同じ優先度なら到着順）に送り、
+    429が返ったらRetry-Afterやレート制限ヘッダ（なければ指数バックオフ）の間
+    すべての呼び出しを止めてから再送する。成功した応答のヘッダで残量を補正する。
+    対局ごとに別のイベントループで動く場合（GAME_EXECUTION=threads）もあるため、
+    状態はスレッドロックで守る。
+    上限に0を指定するとその制限は行わない。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=500,
+        tokens_per_minute=200000,
+        max_retries=5,
+        base_backoff=1.0,
+        max_backoff=60.0,
+    ):
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.acquired = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+
+    def _delay(self, tokens, now):
+        """バケットから取り出せるまでの秒数（一時停止中はその残り時間）"""
+        delay = self._paused_until - now
+        if self.requests is not None:
+            delay = max(delay, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        return delay
+
+    async def acquire(self, tokens=1, priority=COMMENTARY_PRIORITY):
+        """送信の順番と枠が回ってくるまで待つ"""
+        ticket = [priority, next(self._sequence), tokens]
+        start = time.monotonic()
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    head = self._waiting[0]
+                    delay = self._delay(head[2], now)
+                    if head is ticket and delay <= 0:
+                        heapq.heappop(self._waiting)
+                        if self.requests is not None:
+                            self.requests.take(1, now)
+                        if self.tokens is not None:
+                            self.tokens.take(tokens, now)
+                        self.acquired += 1
+                        self.wait_seconds += now - start
+                        return
+                if head is not ticket:
+                    delay = max(delay, MIN_POLL_INTERVAL)
+                await asyncio.sleep(min(delay, MAX_POLL_INTERVAL))
+        except BaseException:
+            with self._lock:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+            raise
+
+    def settle(self, estimated, actual):
+        """見積もったトークン数と実際の使用量の差をバケットに反映"""
+        if self.tokens is None or actual is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if actual < estimated:
+                self.tokens.give(estimated - actual, now)
+            else:
+                self.tokens.take(actual - estimated, now)
+
+    def update_from_headers(self, headers):
+        """応答のレート制限ヘッダ（x-ratelimit-*）で残量と上限を補正"""
+
+        def number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        with self._lock:
+            now = time.monotonic()
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                remaining = number(f"x-ratelimit-remaining-{kind}")
+                if bucket is not None:
+                    bucket.limit(remaining, number(f"x-ratelimit-limit-{kind}"), now)
+                if remaining is not None and remaining <= 0:
+                    reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset:
+                        self._paused_until = max(self._paused_until, now + reset)
+
+    def backoff(self, error, attempt):
+        """429の応答から待機時間を決めて、すべての呼び出しを一時停止する"""
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        delay = None
+        if headers.get("retry-after-ms") is not None:
+            delay = (parse_duration(headers.get("retry-after-ms")) or 0) / 1000
+        if not delay:
+            delay = parse_duration(headers.get("retry-after"))
+        if not delay:
+            resets = [
+                parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                for kind in ("requests", "tokens")
+            ]
+            delay = max([r for r in resets if r] or [0])
+        if not delay:
+            delay = self.base_backoff * 2**attempt * random.uniform(1.0, 1.5)
+        delay = min(delay, self.max_backoff)
+        with self._lock:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    async def run(self, call, tokens=1, priority=COMMENTARY_PRIORITY):
+        """枠を確保してからcall()を実行（429なら待って再送、ヘッダで残量を補正）"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(tokens, priority)
+            try:
+                result = await call()
+            except Exception as e:
+                if (
+                    getattr(e, "status_code", None) != 429
+                    or attempt >= self.max_retries
+                ):
+                    raise
+                delay = self.backoff(e, attempt)
+                with self._lock:
+                    self.retries += 1
+                logger.warning(
+                    "レート制限に達しました。%.2f秒後に再送します (%d回目)",
+                    delay,
+                    attempt + 1,
+                )
+                continue
+            headers = getattr(result, "headers", None)
+            if headers is not None:
+                self.update_from_headers(headers)
+            return result
+
+    def stats(self):
+        """待ち行列とバケットの状態を取得"""
+        with self._lock:
+            now = time.monotonic()
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _ in self._waiting:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                waiting[name] = waiting.get(name, 0) + 1
+            stats = {
+                "waiting": waiting,
+                "pausedFor": round(max(0.0, self._paused_until - now), 3),
+                "acquired": self.acquired,
+                "rateLimited": self.rate_limited,
+                "retries": self.retries,
+                "averageWaitMs": (
+                    round(self.wait_seconds / self.acquired * 1000, 3)
+                    if self.acquired
+                    else 0.0
+                ),
+            }
+            for bucket, name in ((self.requests, "requests"), (self.tokens, "tokens")):
+                if bucket is not None:
+                    bucket._refill(now)
+                    stats[name] = {
+                        "perMinute": bucket.capacity,
+                        "available": round(bucket.level, 1),
+                    }
+            return stats
@@ -6,6 +6,10 @@ document.addEventListener('DOMContentLoaded', function() {
     const errorMessage = document.getElementById('errorMessage');
     const maxMovesSelect = document.getElementById('maxMovesSelect');
     const selectedMovesSpan = document.getElementById('selectedMoves');
+    const senteTypeSelect = document.getElementById('senteTypeSelect');
+    const goteTypeSelect = document.getElementById('goteTypeSelect');
+    const commentaryBatchSelect = document.getElementById('commentaryBatchSelect');
+    const useOpeningBookCheckbox = document.getElementById('useOpeningBookCheckbox');
 
     // 手数選択の変更イベント
     maxMovesSelect.addEventListener('change', function() {
@@ -30,23 +34,28 @@ document.addEventListener('DOMContentLoaded', function() {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
-                    maxMoves: maxMoves
+                    maxMoves: maxMoves,
+                    senteType: senteTypeSelect.value,
+                    goteType: goteTypeSelect.value,
+                    commentaryBatchSize: parseInt(commentaryBatchSelect.value),
+                    useOpeningBook: useOpeningBookCheckbox.checked
                 })
             });
 
             const data = await response.json();
 
-            if (data.success) {
-                // 成功時は棋譜ビューアに遷移
-                // ゲームデータをセッションストレージに保存
-                sessionStorage.setItem('currentGameData', JSON.stringify(data.gameData));
-                
-                // ビューアページに遷移
-                window.location.href = '/viewer';
-            } else {
+            if (response.status === 429) {
+                throw new Error('現在混雑しています。しばらくしてから再度お試しください');
+            }
+            if (!data.success) {
                 throw new Error(data.error || '対局の生成に失敗しました');
             }
 
+            // 生成と並行して観戦できるよう、すぐにビューアへ遷移する
+            sessionStorage.removeItem('currentGameData');
+            sessionStorage.removeItem('currentGamePositions');
+            window.location.href = `/viewer?game=${encodeURIComponent(data.gameId)}`;
+
         } catch (error) {
             console.error('Error starting game:', error);
             
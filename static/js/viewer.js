@@ -4,8 +4,17 @@ class ShogiViewer {
     constructor() {
         this.gameData = null;
         this.currentMoveIndex = 0;
-        this.boardStates = [];
+        this.boardStates = [];  // 全局面データ（取得できた場合はクライアント側で盤面を切り替える）
         this.isLoading = false;
+        this.pendingMoveIndex = null;  // 盤面の取得中に要求された移動先（取得後に移動する）
+        this.eventSource = null;  // 対局生成中の指し手配信（SSE）
+        // 差分モード（画面のチェックボックスか?mode=delta）では全局面を受け取らず、盤面の差分を取得する
+        // 全局面を受け取れなかった手（長い対局の再配信など）も差分で表示する
+        this.deltaMode = new URLSearchParams(window.location.search).get('mode') === 'delta'
+            || localStorage.getItem('viewerDeltaMode') === '1';
+        this.boardCells = null;
+        this.boardCellsMoveIndex = 0;
+        this.capturedPieces = null;
         
         this.initializeElements();
         this.bindEvents();
@@ -33,6 +42,7 @@ class ShogiViewer {
         this.lastBtn = document.getElementById('lastBtn');
         this.backToHomeBtn = document.getElementById('backToHomeBtn');
         this.downloadKifuBtn = document.getElementById('downloadKifuBtn');
+        this.deltaModeCheckbox = document.getElementById('deltaModeCheckbox');
     }
 
     bindEvents() {
@@ -45,6 +55,15 @@ class ShogiViewer {
         // その他のボタン
         this.backToHomeBtn.addEventListener('click', () => window.location.href = '/');
         this.downloadKifuBtn.addEventListener('click', () => this.downloadKifu());
+
+        // 差分モードの切り替え（次に棋譜を開いたときから全局面を受け取らなくなる）
+        if (this.deltaModeCheckbox) {
+            this.deltaModeCheckbox.checked = this.deltaMode;
+            this.deltaModeCheckbox.addEventListener('change', () => {
+                this.deltaMode = this.deltaModeCheckbox.checked;
+                localStorage.setItem('viewerDeltaMode', this.deltaMode ? '1' : '0');
+            });
+        }
         
         // キーボードショートカット
         document.addEventListener('keydown', (e) => {
@@ -71,6 +90,13 @@ class ShogiViewer {
 
     async loadGameData() {
         try {
+            // URLに対局IDがあれば配信に接続して観戦する
+            const liveGameId = new URLSearchParams(window.location.search).get('game');
+            if (liveGameId) {
+                this.startLiveStream(liveGameId);
+                return;
+            }
+
             // セッションストレージからゲームデータを取得
             const storedData = sessionStorage.getItem('currentGameData');
             if (!storedData) {
@@ -78,6 +104,7 @@ class ShogiViewer {
             }
 
             this.gameData = JSON.parse(storedData);
+            await this.loadPositions();
             this.initializeGame();
             
         } catch (error) {
@@ -86,6 +113,137 @@ class ShogiViewer {
         }
     }
 
+    async loadPositions() {
+        // 差分モードでは全局面を取得せず、手を進めるたびに差分を取得する
+        if (this.deltaMode) {
+            this.boardStates = [];
+            return;
+        }
+
+        // 対局開始時に受け取った全局面データを優先し、なければ一括取得APIを呼ぶ
+        const storedPositions = sessionStorage.getItem('currentGamePositions');
+        if (storedPositions) {
+            this.boardStates = JSON.parse(storedPositions);
+            return;
+        }
+
+        try {
+            const response = await fetch(`/api/game/${this.gameData.gameId}/positions`);
+            const data = await response.json();
+            if (data.success) {
+                this.boardStates = data.positions;
+            }
+        } catch (error) {
+            // 取得できない場合は手ごとに盤面の差分を取得する
+            console.warn('Error fetching positions:', error);
+            this.boardStates = [];
+        }
+    }
+
+    startLiveStream(gameId) {
+        this.gameData = { gameId: gameId, sente: '先手', gote: '後手', moves: [] };
+        this.boardStates = [];
+
+        // 途中から接続した場合も、サーバーが初手から順に送り直す
+        // （差分モードでは保存済みの対局の局面を送らせない）
+        const query = this.deltaMode ? '?positions=0' : '';
+        this.eventSource = new EventSource(`/api/games/${encodeURIComponent(gameId)}/stream${query}`);
+
+        this.eventSource.addEventListener('start', (e) => {
+            const data = JSON.parse(e.data);
+            this.gameData.sente = data.sente;
+            this.gameData.gote = data.gote;
+            this.boardStates[0] = data.position;
+            this.initializeGame();
+        });
+
+        this.eventSource.addEventListener('move', (e) => {
+            const { position, ...move } = JSON.parse(e.data);
+            const moves = this.gameData.moves;
+            if (move.moveNumber <= moves.length) return;  // 再接続時の重複
+
+            // 最新の局面を表示中（または移動中）なら新しい手に追従する
+            const following = (this.pendingMoveIndex ?? this.currentMoveIndex) === moves.length;
+            moves.push(move);
+            if (position) {
+                this.boardStates[move.moveNumber] = position;
+            }
+            this.movesListElement.appendChild(
+                this.createMoveElement(move.moveNumber, move.moveNotation || move.moveUsi, this.commentaryPreview(move.commentary))
+            );
+
+            if (following) {
+                this.goToMove(move.moveNumber);
+            } else {
+                this.updateNavigationButtons();
+            }
+        });
+
+        this.eventSource.addEventListener('commentary', (e) => {
+            const data = JSON.parse(e.data);
+            const move = this.gameData.moves[data.moveNumber - 1];
+            if (!move) return;
+
+            move.commentary = data.commentary;
+            const preview = document.querySelector(`[data-move-index="${data.moveNumber}"] .move-preview`);
+            if (preview) {
+                preview.textContent = this.commentaryPreview(data.commentary);
+            }
+            if (this.currentMoveIndex === data.moveNumber) {
+                this.updateCommentary();
+            }
+        });
+
+        this.eventSource.addEventListener('reset', () => {
+            // サーバー側で棋譜が差し替えられた場合は最初から受け直す
+            this.gameData.moves = [];
+            this.boardStates = this.boardStates.slice(0, 1);
+            this.boardCells = null;
+            this.generateMovesList();
+            this.goToMove(0);
+        });
+
+        this.eventSource.addEventListener('done', (e) => {
+            Object.assign(this.gameData, JSON.parse(e.data));
+            this.closeLiveStream();
+
+            // ダウンロードや再読み込みに備えて保存（全局面は揃っている場合だけ）
+            sessionStorage.setItem('currentGameData', JSON.stringify(this.gameData));
+            const complete = this.boardStates.length === this.gameData.moves.length + 1
+                && this.boardStates.every(Boolean);
+            if (complete && !this.deltaMode) {
+                sessionStorage.setItem('currentGamePositions', JSON.stringify(this.boardStates));
+            } else {
+                sessionStorage.removeItem('currentGamePositions');
+            }
+        });
+
+        this.eventSource.addEventListener('failed', (e) => {
+            const data = JSON.parse(e.data);
+            this.closeLiveStream();
+            this.showError(`対局の生成に失敗しました: ${data.error}`);
+        });
+
+        this.eventSource.onerror = () => {
+            // 接続が閉じられた場合のみエラー表示（それ以外はブラウザが自動で再接続する）
+            if (this.eventSource && this.eventSource.readyState === EventSource.CLOSED) {
+                this.closeLiveStream();
+                this.showError('対局の配信に接続できませんでした');
+            }
+        };
+    }
+
+    closeLiveStream() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+    }
+
+    commentaryPreview(commentary) {
+        return commentary ? commentary.substring(0, 30) + '...' : '解説を生成中...';
+    }
+
     initializeGame() {
         if (!this.gameData) return;
 
@@ -124,7 +282,7 @@ class ShogiViewer {
             const moveItem = this.createMoveElement(
                 move.moveNumber,
                 notation,
-                move.commentary.substring(0, 30) + '...'
+                this.commentaryPreview(move.commentary)
             );
             this.movesListElement.appendChild(moveItem);
         });
@@ -160,7 +318,11 @@ class ShogiViewer {
     }
 
     async goToMove(moveIndex) {
-        if (this.isLoading) return;
+        if (this.isLoading) {
+            // 差分の取得中は最後に要求された手だけを覚えておく
+            this.pendingMoveIndex = moveIndex;
+            return;
+        }
         
         const maxMoves = this.gameData ? this.gameData.moves.length : 0;
         moveIndex = Math.max(0, Math.min(moveIndex, maxMoves));
@@ -180,30 +342,45 @@ class ShogiViewer {
         } finally {
             this.isLoading = false;
         }
+
+        if (this.pendingMoveIndex !== null) {
+            const pending = this.pendingMoveIndex;
+            this.pendingMoveIndex = null;
+            await this.goToMove(pending);
+        }
     }
 
     async updateBoardDisplay(moveIndex) {
         try {
-            // API から盤面状態を取得
+            // 全局面データがあればサーバーに問い合わせずに表示
+            if (this.boardStates[moveIndex]) {
+                this.renderBoardState(this.boardStates[moveIndex], moveIndex);
+                // 局面のない手に進んだときに差分を適用できるよう、表示中の盤面として保持する
+                if (!this.boardStates[moveIndex + 1]) {
+                    this.setBoardCells(this.boardStates[moveIndex], moveIndex);
+                }
+                return;
+            }
+
+            // 表示中の盤面があれば、変わったマスと持ち駒だけを取得して適用
             const gameId = this.gameData.gameId;
+            if (this.boardCells) {
+                const response = await fetch(`/api/board_delta/${gameId}/${this.boardCellsMoveIndex}/${moveIndex}`);
+                const delta = await response.json();
+                if (delta.success) {
+                    this.applyBoardDelta(delta);
+                    this.renderBoardState(this.boardCellsState(delta.currentTurn), moveIndex);
+                    return;
+                }
+            }
+
+            // API から盤面状態を取得
             const response = await fetch(`/api/board_state/${gameId}/${moveIndex}`);
             const data = await response.json();
 
             if (data.success) {
-                // 盤面表示の更新（後手駒の色分けマーカーを処理）
-                let boardHtml = data.boardState;
-                // 後手の駒マーカー（◆駒名◆）を赤色のspanに置換
-                boardHtml = boardHtml.replace(/◆([^◆]+)◆/g, '<span class="gote-piece">$1</span>');
-                this.boardTextElement.innerHTML = boardHtml;
-                
-                // 手数と手番の更新
-                this.currentMoveNumberElement.textContent = moveIndex;
-                this.currentTurnElement.textContent = data.currentTurn;
-                this.currentTurnElement.className = `turn-indicator ${data.currentTurn === '先手' ? 'sente' : 'gote'}`;
-
-                // 持ち駒の更新
-                this.updateCapturedPieces(data.capturedPieces);
-                
+                this.setBoardCells(data, moveIndex);
+                this.renderBoardState(data, moveIndex);
             } else {
                 throw new Error(data.error || '盤面データの取得に失敗');
             }
@@ -214,6 +391,58 @@ class ShogiViewer {
         }
     }
 
+    setBoardCells(data, moveIndex) {
+        // 盤面の文字列をマスごとに分割して保持（後手の駒は◆駒名◆、成香などは2文字）
+        this.boardCells = data.boardState.split('\n').map(line => line.match(/◆[^◆]+◆|成[香桂銀]|./gu) || []);
+        this.boardCellsMoveIndex = moveIndex;
+        this.capturedPieces = {
+            sente: { ...data.capturedPieces.sente },
+            gote: { ...data.capturedPieces.gote },
+        };
+    }
+
+    applyBoardDelta(delta) {
+        delta.squares.forEach(([rank, file, cell]) => {
+            this.boardCells[rank][file] = cell;
+        });
+
+        // 持ち駒は枚数が0になった駒を除き、サーバーと同じ駒順に並べ直す
+        const order = '歩香桂銀金角飛';
+        Object.entries(delta.capturedPieces).forEach(([side, changes]) => {
+            const pieces = { ...this.capturedPieces[side], ...changes };
+            this.capturedPieces[side] = Object.fromEntries(
+                Object.entries(pieces)
+                    .filter(([, count]) => count > 0)
+                    .sort(([a], [b]) => order.indexOf(a) - order.indexOf(b))
+            );
+        });
+        this.boardCellsMoveIndex = delta.to;
+    }
+
+    boardCellsState(currentTurn) {
+        return {
+            boardState: this.boardCells.map(cells => cells.join('')).join('\n'),
+            capturedPieces: this.capturedPieces,
+            currentTurn: currentTurn,
+        };
+    }
+
+    renderBoardState(data, moveIndex) {
+        // 盤面表示の更新（後手駒の色分けマーカーを処理）
+        let boardHtml = data.boardState;
+        // 後手の駒マーカー（◆駒名◆）を赤色のspanに置換
+        boardHtml = boardHtml.replace(/◆([^◆]+)◆/g, '<span class="gote-piece">$1</span>');
+        this.boardTextElement.innerHTML = boardHtml;
+        
+        // 手数と手番の更新
+        this.currentMoveNumberElement.textContent = moveIndex;
+        this.currentTurnElement.textContent = data.currentTurn;
+        this.currentTurnElement.className = `turn-indicator ${data.currentTurn === '先手' ? 'sente' : 'gote'}`;
+
+        // 持ち駒の更新
+        this.updateCapturedPieces(data.capturedPieces);
+    }
+
     updateCapturedPieces(capturedPieces) {
         // 先手の持ち駒
         this.senteCapturedElement.innerHTML = '';
@@ -270,7 +499,7 @@ class ShogiViewer {
             this.commentaryDisplayElement.textContent = '対局開始時の盤面です。これから宗太郎君AIと四五六君AIによる対局が始まります。';
         } else if (this.gameData && this.gameData.moves[this.currentMoveIndex - 1]) {
             const move = this.gameData.moves[this.currentMoveIndex - 1];
-            this.commentaryDisplayElement.textContent = move.commentary;
+            this.commentaryDisplayElement.textContent = move.commentary || '解説を生成中です...';
         } else {
             this.commentaryDisplayElement.textContent = '解説データがありません';
         }
@@ -289,14 +518,26 @@ class ShogiViewer {
         }
     }
 
-    downloadKifu() {
+    async downloadKifu() {
         if (!this.gameData) {
             this.showError('ダウンロードするデータがありません');
             return;
         }
 
+        // 保存済みの対局はサーバーでKIF形式に書き出す
+        try {
+            const gameId = encodeURIComponent(this.gameData.gameId);
+            const response = await fetch(`/api/game/${gameId}/export?format=kif`);
+            if (response.ok) {
+                this.saveBlob(await response.blob(), `kifu_${this.gameData.gameId}.kif`);
+                return;
+            }
+        } catch (error) {
+            console.error('Error exporting kifu:', error);
+        }
+
         try {
-            // 棋譜データをテキスト形式で生成
+            // サーバーにない対局は棋譜データをテキスト形式で生成
             let kifuText = `# ${this.gameData.sente} vs ${this.gameData.gote}\n`;
             kifuText += `# 対局ID: ${this.gameData.gameId}\n`;
             kifuText += `# 生成日時: ${new Date().toLocaleString()}\n\n`;
@@ -308,14 +549,7 @@ class ShogiViewer {
 
             // ダウンロード
             const blob = new Blob([kifuText], { type: 'text/plain;charset=utf-8' });
-            const url = URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = `kifu_${this.gameData.gameId}.txt`;
-            document.body.appendChild(a);
-            a.click();
-            document.body.removeChild(a);
-            URL.revokeObjectURL(url);
+            this.saveBlob(blob, `kifu_${this.gameData.gameId}.txt`);
 
         } catch (error) {
             console.error('Error downloading kifu:', error);
@@ -323,6 +557,17 @@ class ShogiViewer {
         }
     }
 
+    saveBlob(blob, filename) {
+        const url = URL.createObjectURL(blob);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = filename;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        URL.revokeObjectURL(url);
+    }
+
     showError(message) {
         // 簡単なエラー表示
         const errorDiv = document.createElement('div');
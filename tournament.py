@@ -0,0 +1,357 @@
+"""自己対局のトーナメント（対局データの大量生成）
+
+指定した対局者（random・engine・llm）の総当たりで多数の対局を並列に行い、
+終わった対局から順にファイルへ書き出して、勝率・平均手数・1秒あたりの対局数を表示する。
+対局ごとのシードは --seed と対局番号から決まるため、同じ指定なら同じ対局を再現できる
+（engineは--engine-depthで深さを固定した場合。時間で打ち切ると探索結果が揺れる）。
+
+対局者の指定:
+    random          合法手からランダムに選ぶ
+    engine[:秒]     内蔵エンジン（1手あたりの持ち時間、省略時は--engine-time）
+    llm             app.pyのgenerate_ai_move（OPENAI_API_KEY・OPENAI_BASE_URLを使用）
+
+使い方:
+    python tournament.py --games 1000 --players random engine:0.05 --output data/selfplay.jsonl
+    python tournament.py --games 200 --players engine:0.1 engine:0.3 --workers 8 --seed 42
+    python tournament.py --games 100 --players engine random --format usi --output games.txt
+    python tournament.py --games 10000 --players random engine:0.01 --format record --output data/selfplay.sgr
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import shogi
+
+from engine import Engine
+from fastboard import Position
+from game_record import GameArchiveWriter, GameRecord
+
+# 対局者の種類
+PLAYER_KINDS = ("random", "engine", "llm")
+
+# 対局を打ち切る理由
+CHECKMATE = "checkmate"
+NO_LEGAL_MOVES = "no_legal_moves"
+ILLEGAL_MOVE = "illegal_move"
+REPETITION = "repetition"
+MAX_PLIES = "max_plies"
+
+# llmの対局者が使うapp.pyのモジュールとイベントループ（ワーカープロセスごとに1つ）
+_app = None
+_loop = None
+
+
+def game_seed(base_seed, index):
+    """対局番号ごとのシード（対局の順序やワーカー数によらず同じ値）"""
+    return random.Random(f"{base_seed}:{index}").getrandbits(32)
+
+
+class RandomPlayer:
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def choose(self, board, ply):
+        moves = list(board.legal_moves)
+        return self.rng.choice(moves) if moves else None
+
+
+class EnginePlayer:
+    def __init__(self, seed, time_limit, max_depth):
+        self.engine = Engine(seed=seed)
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+
+    def choose(self, board, ply):
+        # エンジンはpython-shogiの盤面で探索する
+        return self.engine.search(
+            shogi.Board(board.sfen()), self.time_limit, self.max_depth
+        ).move
+
+
+class LLMPlayer:
+    def __init__(self, seed):
+        global _app, _loop
+        if _app is None:
+            import app
+
+            _app = app
+            _loop = asyncio.new_event_loop()
+
+    def choose(self, board, ply):
+        player_name = "先手" if board.turn == shogi.BLACK else "後手"
+        return _loop.run_until_complete(_app.generate_ai_move(board, ply, player_name))
+
+
+def check_player(spec):
+    """対局者の指定が正しいか確認（正しくなければValueError）"""
+    kind, _, argument = spec.partition(":")
+    if kind not in PLAYER_KINDS:
+        raise ValueError(f"unknown player: {spec}")
+    if argument:
+        if kind != "engine":
+            raise ValueError(f"{kind} takes no argument: {spec}")
+        float(argument)
+
+
+def make_player(spec, seed, engine_time, engine_depth):
+    """対局者の指定（"random"、"engine:0.1"、"llm"）から対局者を作成"""
+    kind, _, argument = spec.partition(":")
+    if kind == "random":
+        return RandomPlayer(seed)
+    if kind == "engine":
+        time_limit = float(argument) if argument else engine_time
+        if engine_depth:
+            # 深さを固定する場合は時間で打ち切らない
+            time_limit = max(time_limit, 3600.0)
+        return EnginePlayer(seed, time_limit, engine_depth or 32)
+    if kind == "llm":
+        return LLMPlayer(seed)
+    raise ValueError(f"unknown player: {spec}")
+
+
+def play_game(task):
+    """1局を最後まで指して結果の辞書を返す（ワーカープロセスで実行）"""
+    index, seed, sente, gote, max_plies, engine_time, engine_depth = task
+    start = time.perf_counter()
+    players = {
+        shogi.BLACK: make_player(sente, seed * 2, engine_time, engine_depth),
+        shogi.WHITE: make_player(gote, seed * 2 + 1, engine_time, engine_depth),
+    }
+    board = Position()
+    moves = []
+    winner, reason = None, MAX_PLIES
+    while True:
+        if not board.has_legal_move():
+            # 詰み・指す手がない場合は手番側の負け
+            winner = board.turn ^ 1
+            reason = CHECKMATE if board.is_check() else NO_LEGAL_MOVES
+            break
+        if board.is_fourfold_repetition():
+            reason = REPETITION
+            break
+        if len(moves) >= max_plies:
+            reason = MAX_PLIES
+            break
+        move = players[board.turn].choose(board, len(moves) + 1)
+        if move is None or move not in board.legal_moves:
+            winner = board.turn ^ 1
+            reason = ILLEGAL_MOVE
+            break
+        board.push(move)
+        moves.append(move.usi())
+
+    return {
+        "game": index,
+        "seed": seed,
+        "sente": sente,
+        "gote": gote,
+        "winner": {shogi.BLACK: "sente", shogi.WHITE: "gote"}.get(winner),
+        "reason": reason,
+        "plies": len(moves),
+        "moves": moves,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def make_tasks(players, games, seed, max_plies, engine_time, engine_depth):
+    """総当たりの組み合わせを先後入れ替えながら順に割り当てる"""
+    pairings = list(itertools.combinations(players, 2)) or [(players[0], players[0])]
+    for index in range(games):
+        first, second = pairings[index % len(pairings)]
+        if (index // len(pairings)) % 2:
+            first, second = second, first
+        yield (
+            index,
+            game_seed(seed, index),
+            first,
+            second,
+            max_plies,
+            engine_time,
+            engine_depth,
+        )
+
+
+def format_record(result, output_format):
+    if output_format == "usi":
+        # opening_book.py buildでそのまま読める1行1局の形式
+        return "startpos moves " + " ".join(result["moves"])
+    return json.dumps(result, ensure_ascii=False)
+
+
+def to_game_record(result):
+    """対局結果をコンパクトな対局記録（game_record.py）に変換"""
+    game_data = {key: value for key, value in result.items() if key != "moves"}
+    game_data["gameId"] = f"selfplay-{result['seed']:08x}-{result['game']}"
+    game_data["moves"] = [
+        {"moveNumber": i + 1, "moveUsi": move_usi}
+        for i, move_usi in enumerate(result["moves"])
+    ]
+    return GameRecord.from_game_data(game_data)
+
+
+class Summary:
+    """対局者ごとの勝敗・手数・終局理由を集計"""
+
+    def __init__(self):
+        self.games = 0
+        self.plies = 0
+        self.reasons = {}
+        self.players = {}
+
+    def add(self, result):
+        self.games += 1
+        self.plies += result["plies"]
+        self.reasons[result["reason"]] = self.reasons.get(result["reason"], 0) + 1
+        for side in ("sente", "gote"):
+            stats = self.players.setdefault(
+                result[side],
+                {"games": 0, "wins": 0, "losses": 0, "draws": 0, "senteWins": 0},
+            )
+            stats["games"] += 1
+            if result["winner"] is None:
+                stats["draws"] += 1
+            elif result["winner"] == side:
+                stats["wins"] += 1
+                if side == "sente":
+                    stats["senteWins"] += 1
+            else:
+                stats["losses"] += 1
+
+    def to_dict(self, elapsed):
+        players = {}
+        for spec, stats in sorted(self.players.items()):
+            score = stats["wins"] + stats["draws"] / 2
+            players[spec] = {
+                **stats,
+                "score": round(score / stats["games"], 4) if stats["games"] else 0.0,
+            }
+        return {
+            "games": self.games,
+            "averagePlies": round(self.plies / self.games, 1) if self.games else 0.0,
+            "reasons": self.reasons,
+            "players": players,
+            "seconds": round(elapsed, 2),
+            "gamesPerSecond": round(self.games / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+def print_summary(summary):
+    print(
+        f"{summary['games']}局  平均{summary['averagePlies']}手  "
+        f"{summary['seconds']}秒  {summary['gamesPerSecond']}局/秒"
+    )
+    print(
+        "終局理由: "
+        + "  ".join(f"{reason} {count}" for reason, count in summary["reasons"].items())
+    )
+    print(f"{'player':<20}{'games':>8}{'wins':>8}{'losses':>8}{'draws':>8}{'score':>8}")
+    print("-" * 60)
+    for spec, stats in summary["players"].items():
+        print(
+            f"{spec:<20}{stats['games']:>8}{stats['wins']:>8}{stats['losses']:>8}"
+            f"{stats['draws']:>8}{stats['score']:>8.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="自己対局のトーナメント")
+    parser.add_argument(
+        "--players",
+        nargs="+",
+        default=["random", "engine"],
+        help="対局者（random、engine[:秒]、llm）",
+    )
+    parser.add_argument("--games", type=int, default=100, help="対局数")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数"
+    )
+    parser.add_argument("--max-plies", type=int, default=256, help="引き分けとする手数")
+    parser.add_argument(
+        "--engine-time", type=float, default=0.1, help="エンジンの1手あたりの持ち時間"
+    )
+    parser.add_argument(
+        "--engine-depth",
+        type=int,
+        default=0,
+        help="エンジンの探索深さを固定する（0で持ち時間まで探索）",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="対局ごとのシードの元")
+    parser.add_argument("--output", help="対局を書き出すファイル（終わった順に追記）")
+    parser.add_argument(
+        "--format",
+        choices=("jsonl", "usi", "record"),
+        default="jsonl",
+        help="書き出す形式（recordはgame_record.pyのアーカイブ）",
+    )
+    parser.add_argument("--summary", help="集計結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    for spec in args.players:
+        try:
+            check_player(spec)
+        except ValueError as e:
+            parser.error(str(e))
+    if "llm" in args.players:
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        # レート制限はプロセスごとなので、全体の上限をワーカー数で分ける
+        for name, default in (("OPENAI_RPM", "500"), ("OPENAI_TPM", "200000")):
+            limit = int(os.getenv(name, default))
+            if limit:
+                os.environ[name] = str(max(1, limit // args.workers))
+
+    tasks = make_tasks(
+        args.players,
+        args.games,
+        args.seed,
+        args.max_plies,
+        args.engine_time,
+        args.engine_depth,
+    )
+    summary = Summary()
+    output = None
+    if args.output and args.format == "record":
+        output = GameArchiveWriter(args.output)
+    elif args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        output = open(args.output, "a", encoding="utf-8")
+
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(args.workers) as pool:
+            for result in pool.imap_unordered(play_game, tasks):
+                summary.add(result)
+                if output is not None:
+                    if args.format == "record":
+                        output.append(to_game_record(result))
+                    else:
+                        output.write(format_record(result, args.format) + "\n")
+                    output.flush()
+                if summary.games % 100 == 0:
+                    print(
+                        f"{summary.games}/{args.games}局 "
+                        f"({time.perf_counter() - start:.1f}秒)",
+                        file=sys.stderr,
+                    )
+    finally:
+        if output is not None:
+            output.close()
+
+    report = summary.to_dict(time.perf_counter() - start)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print_summary(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())